@@ -0,0 +1,215 @@
+"""
+In-process adjacency index of accepted friendships, for mutual friend lookups.
+
+Users are interned to dense integer ids and friends of a user are kept as a sorted `array` of
+those ids: 8 bytes per friend instead of a set entry and a UUID object each.
+
+Friend lists are loaded from FriendshipEdge on first use and then updated from relation signals
+of this process once the transaction commits. Changes made by other processes are picked up when
+a list expires after ADJACENCY_INDEX_TIMEOUT seconds. Least recently used lists are evicted
+above ADJACENCY_INDEX_MAX_USERS; with 0 the index is off and lookups go to the database.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from app.models import FriendshipEdge
+from django.conf import settings
+
+# Probe the longer list with binary search when it is this many times longer than the other.
+SKEW_RATIO = 16
+
+
+def contains(ids, i):
+    position = bisect_left(ids, i)
+    return position < len(ids) and ids[position] == i
+
+
+class Neighbours:
+    """
+    Sorted friend ids of one user.
+
+    Updates replace `ids` instead of changing it, so a reader holding the array is never torn.
+    """
+
+    __slots__ = ('ids', 'loaded_at')
+
+    def __init__(self, ids, loaded_at):
+        self.ids = ids
+        self.loaded_at = loaded_at
+
+    def add(self, i):
+        """Add friend id `i`, return whether it was missing."""
+
+        position = bisect_left(self.ids, i)
+        if position < len(self.ids) and self.ids[position] == i:
+            return False
+        self.ids = self.ids[:position] + array('q', (i,)) + self.ids[position:]
+        return True
+
+    def remove(self, i):
+        """Remove friend id `i`, return whether it was there."""
+
+        position = bisect_left(self.ids, i)
+        if position == len(self.ids) or self.ids[position] != i:
+            return False
+        self.ids = self.ids[:position] + self.ids[position + 1:]
+        return True
+
+    def intersection(self, other):
+        small, big = sorted((self.ids, other.ids), key=len)
+        if len(small) * SKEW_RATIO < len(big):
+            return [i for i in small if contains(big, i)]
+        return sorted(set(small).intersection(big))
+
+
+class AdjacencyIndex:
+    """
+    Interned ids are counted: once per list kept for the user and once per list holding them as a
+    friend. Evicting a list releases its ids and an id nobody holds is freed for reuse, so memory is
+    bounded by the lists kept. Ids are only read and mapped back to users under the lock.
+    """
+
+    def __init__(self, max_users, timeout):
+        self.max_users = max_users
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._user_ids = []
+        self._references = []
+        self._free = []
+        self._entries = OrderedDict()
+        self._generation = 0
+
+    def _acquire(self, user_id):
+        i = self._ids.get(user_id)
+        if i is None:
+            if self._free:
+                i = self._free.pop()
+                self._user_ids[i] = user_id
+            else:
+                i = len(self._user_ids)
+                self._user_ids.append(user_id)
+                self._references.append(0)
+            self._ids[user_id] = i
+        self._references[i] += 1
+        return i
+
+    def _release(self, i):
+        self._references[i] -= 1
+        if not self._references[i]:
+            del self._ids[self._user_ids[i]]
+            self._user_ids[i] = None
+            self._free.append(i)
+
+    def _release_entry(self, i, entry):
+        for friend in entry.ids:
+            self._release(friend)
+        self._release(i)
+
+    def _cached(self, user_id):
+        """Fresh list of the user, or None."""
+
+        i = self._ids.get(user_id)
+        entry = self._entries.get(i)
+        if entry is not None and time.monotonic() - entry.loaded_at < self.timeout:
+            self._entries.move_to_end(i)
+            return entry
+        return None
+
+    def _store(self, user_id, friend_ids, loaded_at):
+        i = self._acquire(user_id)
+        entry = Neighbours(array('q', sorted(self._acquire(friend_id) for friend_id in friend_ids)), loaded_at)
+        # Released after the new list acquired its ids, so ids of friends kept are not freed.
+        previous = self._entries.pop(i, None)
+        if previous is not None:
+            self._release_entry(i, previous)
+        self._entries[i] = entry
+        return entry
+
+    def _trim(self):
+        while len(self._entries) > self.max_users:
+            self._release_entry(*self._entries.popitem(last=False))
+
+    def mutual(self, user_id, other_id):
+        """
+        Ids of users that are friends with both users.
+
+        Lists that are not in the index or expired are loaded with one query each, outside the lock.
+        """
+
+        loaded = {}
+        while True:
+            with self._lock:
+                cached = {user: self._cached(user) for user in (user_id, other_id) if user not in loaded}
+                missing = [user for user, entry in cached.items() if entry is None]
+                if not missing:
+                    return self._mutual(user_id, other_id, cached, loaded)
+                generation = self._generation
+            for user in missing:
+                loaded_at = time.monotonic()
+                friend_ids = list(FriendshipEdge.objects.filter(user_id=user).values_list('friend_id', flat=True))
+                loaded[user] = friend_ids, loaded_at, generation
+
+    def _mutual(self, user_id, other_id, cached, loaded):
+        lists = dict(cached)
+        for user, (friend_ids, loaded_at, generation) in loaded.items():
+            # A change applied while the list was read may be missing from it, so it is not kept.
+            if generation == self._generation:
+                lists[user] = self._store(user, friend_ids, loaded_at)
+            else:
+                lists[user] = set(friend_ids)
+        sides = [lists[user_id], lists[other_id]]
+        if all(isinstance(side, Neighbours) for side in sides):
+            mutual = [self._user_ids[i] for i in sides[0].intersection(sides[1])]
+        else:
+            first, second = (
+                {self._user_ids[i] for i in side.ids} if isinstance(side, Neighbours) else side for side in sides
+            )
+            mutual = list(first & second)
+        self._trim()
+        return mutual
+
+    def link(self, user_id, friend_id):
+        with self._lock:
+            self._generation += 1
+            for user, friend in ((user_id, friend_id), (friend_id, user_id)):
+                entry = self._entries.get(self._ids.get(user))
+                if entry is not None:
+                    i = self._acquire(friend)
+                    if not entry.add(i):
+                        self._release(i)
+
+    def unlink(self, user_id, friend_id):
+        with self._lock:
+            self._generation += 1
+            for user, friend in ((user_id, friend_id), (friend_id, user_id)):
+                entry = self._entries.get(self._ids.get(user))
+                i = self._ids.get(friend)
+                if entry is not None and i is not None and entry.remove(i):
+                    self._release(i)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._ids.clear()
+            self._user_ids.clear()
+            self._references.clear()
+            self._free.clear()
+            self._entries.clear()
+
+
+index = AdjacencyIndex(settings.ADJACENCY_INDEX_MAX_USERS, settings.ADJACENCY_INDEX_TIMEOUT)
+
+
+def mutual_friend_ids(user_id, other_id):
+    """Ids of mutual friends from the index, or a subquery when the index is off."""
+
+    if index.max_users:
+        return index.mutual(user_id, other_id)
+    return FriendshipEdge.objects.filter(
+        user_id=user_id,
+        friend_id__in=FriendshipEdge.objects.filter(user_id=other_id).values('friend_id'),
+    ).values('friend_id')
@@ -0,0 +1,153 @@
+"""
+Async versions of the read endpoints, for the ASGI deployment.
+
+Plain Django async views: authentication, querysets and serializers are the ones of the DRF
+views, but every query goes through the async ORM, so a request waiting on the database does
+not hold a worker thread.
+"""
+import json
+from functools import partial
+
+from app.models import FriendshipEdge, FriendshipRelation, ordered_pair
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import cache, events
+from .authentication import aauthenticate
+from .pagination import KeysetCursorPagination
+from .serializers import (RELATION_ROW_FIELDS, FriendshipRelationRowSerializer,
+                          FriendshipRelationSerializer)
+from .views import FriendshipRequestViewSet, FriendshipViewSet
+
+
+class AsyncAPIView(View):
+    """
+    Authenticated GET endpoint rendering `aget_data()` of the subclass as JSON, with DRF error responses.
+    """
+
+    renderer = JSONRenderer()
+
+    async def get(self, request, *args, **kwargs):
+        request = Request(request, authenticators=())
+        try:
+            user = await aauthenticate(request._request)
+            if user is None:
+                raise NotAuthenticated()
+            request.user = user
+            data, response_status = await self.aget_data(request, *args, **kwargs), status.HTTP_200_OK
+        except Http404:
+            data, response_status = {'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND
+        except APIException as error:
+            data, response_status = {'detail': error.detail}, error.status_code
+        return self.render(data, response_status)
+
+    def render(self, data, response_status):
+        response = HttpResponse(self.renderer.render(data), status=response_status, content_type='application/json')
+        if response_status == status.HTTP_401_UNAUTHORIZED:
+            response['WWW-Authenticate'] = 'Bearer realm="api"'
+        return response
+
+
+class AsyncRelationListView(AsyncAPIView):
+    """
+    List of `viewset_class` with its queryset and filters, paginated with the async ORM.
+    """
+
+    viewset_class = None
+
+    async def aget_data(self, request, *args, **kwargs):
+        view = self.viewset_class(action_map={'get': 'list'}, action='list', format_kwarg=None)
+        view.args, view.kwargs, view.request = args, kwargs, request
+        queryset = view.filter_queryset(view.get_queryset()).values(*RELATION_ROW_FIELDS)
+        paginator = KeysetCursorPagination()
+        page = await paginator.apaginate_queryset(queryset, request)
+        return paginator.get_paginated_response(FriendshipRelationRowSerializer(page, many=True).data).data
+
+
+class AsyncFriendshipListView(AsyncRelationListView):
+    viewset_class = FriendshipViewSet
+
+
+class AsyncFriendshipRequestListView(AsyncRelationListView):
+    viewset_class = FriendshipRequestViewSet
+
+
+class AsyncGetRelationView(AsyncAPIView):
+    """
+    Async GetRelationView, sharing its cache entries.
+    """
+
+    async def aget_data(self, request, *args, **kwargs):
+        user_id = await cache.aget_user_id(kwargs.get('username'))
+        if user_id is None:
+            raise Http404
+        representation = await cache.aget_relation(
+            request.user.pk, user_id, partial(self.aget_representation, request.user, user_id),
+        )
+        if representation == cache.NO_RELATION:
+            raise Http404
+        return representation
+
+    async def aget_representation(self, user, user_id):
+        edge = await FriendshipEdge.objects.filter(
+            user=user,
+            friend_id=user_id,
+            relation__owner_id=ordered_pair(user.pk, user_id)[0],
+        ).select_related('relation__user_sender', 'relation__user_recipient').afirst()
+        if edge:
+            relation = edge.relation
+        else:
+            relation = await FriendshipRelation.objects.select_related(
+                'user_sender', 'user_recipient',
+            ).between(user.pk, user_id).afirst()
+        if relation:
+            return dict(FriendshipRelationSerializer(relation).data)
+        return None
+
+
+class FriendshipEventStreamView(AsyncAPIView):
+    """
+    Server-sent events of the user's friendship requests and friendships, see `api.events`.
+
+    A stream is a coroutine waiting on a small queue, no thread, so a process holds as many idle
+    streams as its connections allow. It is closed after EVENTS_STREAM_SECONDS and the client
+    reconnects: streams of clients that went away do not outlive that.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            user = await aauthenticate(request)
+            if user is None:
+                raise NotAuthenticated()
+        except APIException as error:
+            return self.render({'detail': error.detail}, error.status_code)
+
+        response = StreamingHttpResponse(self.stream(user.pk), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Sent as they come, not buffered by a proxy.
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, user_id):
+        broker = events.get_broker()
+        subscription = broker.subscribe(user_id)
+        loop = subscription.loop
+        deadline = loop.time() + settings.EVENTS_STREAM_SECONDS
+        try:
+            yield 'retry: 3000\n\n'
+            while (remaining := deadline - loop.time()) > 0:
+                event = await subscription.get(min(settings.EVENTS_KEEPALIVE_SECONDS, remaining))
+                if subscription.overflowed:
+                    yield 'event: resync\ndata: {}\n\n'
+                    return
+                if event is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield f'event: {event["type"]}\ndata: {json.dumps(event)}\n\n'
+        finally:
+            broker.unsubscribe(subscription)
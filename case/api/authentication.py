@@ -0,0 +1,75 @@
+from app.models import User
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+from . import cache
+
+
+def has_user_claims(validated_token):
+    return api_settings.USER_ID_CLAIM in validated_token and 'username' in validated_token
+
+
+def user_from_claims(validated_token):
+    """User built from the token claims, with all fields but id, username and is_active deferred."""
+
+    claims = {
+        'id': User._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM]),
+        'username': validated_token['username'],
+        'is_active': True,
+    }
+    field_names = [field.attname for field in User._meta.concrete_fields if field.attname in claims]
+    return User.from_db(None, field_names, [claims[name] for name in field_names])
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the user claims of the token instead of loading the user row.
+
+    The user is built from the `user_id` and `username` claims with all other fields deferred,
+    so the row is only fetched if a view reads one of them. Whether the user is still active
+    is checked against the cache. Tokens issued without the `username` claim fall back to the
+    regular lookup.
+    """
+
+    def get_user(self, validated_token):
+        if not has_user_claims(validated_token):
+            return super().get_user(validated_token)
+
+        user = user_from_claims(validated_token)
+        if not cache.is_user_active(user.pk):
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+async def aauthenticate(request):
+    """
+    Authenticate a Django request by its JWT for async views, like the configured DRF authentication.
+
+    Return the user, or None if the request carries no token. Raise AuthenticationFailed or
+    InvalidToken for a bad token or user.
+    """
+
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+    if raw_token is None:
+        return None
+    validated_token = authentication.get_validated_token(raw_token)
+
+    if settings.JWT_STATELESS_AUTH and has_user_claims(validated_token):
+        user = user_from_claims(validated_token)
+        is_active = await cache.ais_user_active(user.pk)
+    else:
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            raise AuthenticationFailed(_('Token contained no recognizable user identification'), code='invalid_token')
+        user = await User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).afirst()
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        is_active = user.is_active
+    if not is_active:
+        raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+    return user
@@ -0,0 +1,178 @@
+"""
+Cache of user and relation lookups, on top of the Django cache framework.
+
+Keys are kept in the `default` cache: local memory unless REDIS_URL is set.
+Lookups have `a`-prefixed counterparts for async views, sharing the same keys.
+"""
+import time
+import uuid
+from functools import partial
+from itertools import islice
+
+from app.models import FriendshipRelation, User
+from app.routers import use_primary
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+NO_RELATION = 'no-relation'
+
+# Partners whose cached relations are dropped at a time after a rename.
+PARTNERS_CHUNK = 1000
+
+
+def user_id_key(username):
+    return f'relations:user-id:{username}'
+
+
+def user_active_key(user_id):
+    return f'auth:user-active:{user_id}'
+
+
+def relation_key(user_id, other_id):
+    low, high = sorted((str(user_id), str(other_id)))
+    return f'relations:pair:{low}:{high}'
+
+
+def relations_version_key(user_id):
+    return f'relations:version:{user_id}'
+
+
+def get_user_id(username):
+    """Return id of the user with `username` or None. Only existing users are cached."""
+
+    key = user_id_key(username)
+    user_id = cache.get(key)
+    if user_id is None:
+        user_id = User.objects.filter(username=username).values_list('id', flat=True).first()
+        if user_id is not None:
+            cache.set(key, user_id, settings.RELATION_CACHE_TIMEOUT)
+    return user_id
+
+
+def get_relation(user_id, other_id, load):
+    """
+    Return cached representation of the relation between two users, NO_RELATION if there is none.
+
+    On a miss `load` is called and its result, or NO_RELATION for None, is cached. It reads the
+    primary: a lagging replica would put a stale relation in the cache for everyone.
+    """
+
+    key = relation_key(user_id, other_id)
+    representation = cache.get(key)
+    if representation is None:
+        with use_primary():
+            representation = load()
+        if representation is None:
+            representation = NO_RELATION
+        cache.set(key, representation, settings.RELATION_CACHE_TIMEOUT)
+    return representation
+
+
+async def aget_user_id(username):
+    key = user_id_key(username)
+    user_id = await cache.aget(key)
+    if user_id is None:
+        user_id = await User.objects.filter(username=username).values_list('id', flat=True).afirst()
+        if user_id is not None:
+            await cache.aset(key, user_id, settings.RELATION_CACHE_TIMEOUT)
+    return user_id
+
+
+async def aget_relation(user_id, other_id, aload):
+    key = relation_key(user_id, other_id)
+    representation = await cache.aget(key)
+    if representation is None:
+        with use_primary():
+            representation = await aload()
+        if representation is None:
+            representation = NO_RELATION
+        await cache.aset(key, representation, settings.RELATION_CACHE_TIMEOUT)
+    return representation
+
+
+def get_relations_version(user_id):
+    """
+    Return the version of the user's relations: a random token and the time of the last change, if known.
+
+    `invalidate_relation` replaces the token whenever a relation of the user changes. Tokens expire
+    after RELATION_CACHE_TIMEOUT like the other entries: with the local memory cache a process that
+    did not see the change keeps the old token, and answers 304 to it, at most that long.
+    """
+
+    key = relations_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex, 0.0
+        if not cache.add(key, version, settings.RELATION_CACHE_TIMEOUT):
+            version = cache.get(key, version)
+    return version
+
+
+def invalidate_relation(user_id, other_id):
+    """
+    Drop the cached relation and give both users a new relations version, right away and once more after commit.
+
+    The second time covers a reader that refilled the keys from the pre-commit state.
+    """
+
+    def invalidate():
+        cache.delete(relation_key(user_id, other_id))
+        new_relations_version(user_id, other_id)
+
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+def new_relations_version(*user_ids):
+    version = uuid.uuid4().hex, time.time()
+    cache.set_many(
+        {relations_version_key(user_id): version for user_id in user_ids}, settings.RELATION_CACHE_TIMEOUT,
+    )
+
+
+def is_user_active(user_id):
+    """Whether the user exists and is active, cached for AUTH_USER_CACHE_TIMEOUT seconds."""
+
+    key = user_active_key(user_id)
+    is_active = cache.get(key)
+    if is_active is None:
+        is_active = User.objects.filter(pk=user_id).values_list('is_active', flat=True).first() or False
+        cache.set(key, is_active, settings.AUTH_USER_CACHE_TIMEOUT)
+    return is_active
+
+
+async def ais_user_active(user_id):
+    key = user_active_key(user_id)
+    is_active = await cache.aget(key)
+    if is_active is None:
+        is_active = await User.objects.filter(pk=user_id).values_list('is_active', flat=True).afirst() or False
+        await cache.aset(key, is_active, settings.AUTH_USER_CACHE_TIMEOUT)
+    return is_active
+
+
+def invalidate_user(user, previous_username=None):
+    """
+    Drop the cached lookups of the user. After a rename also, once committed, the cached relations
+    of the user and the relations versions of both sides: their representations hold the username.
+    """
+
+    keys = [user_id_key(user.username), user_active_key(user.pk)]
+    if previous_username is not None and previous_username != user.username:
+        keys.append(user_id_key(previous_username))
+        transaction.on_commit(partial(invalidate_partners, user.pk))
+    cache.delete_many(keys)
+
+
+def invalidate_partners(user_id):
+    """Drop the cached relations of the user and renew the relations versions of both sides, a chunk at a time."""
+
+    new_relations_version(user_id)
+    relations = FriendshipRelation.objects.filter(
+        Q(user_sender=user_id) | Q(user_recipient=user_id),
+    ).values_list('user_sender', 'user_recipient').iterator(chunk_size=PARTNERS_CHUNK)
+    partner_ids = (recipient_id if sender_id == user_id else sender_id for sender_id, recipient_id in relations)
+    while chunk := list(islice(partner_ids, PARTNERS_CHUNK)):
+        cache.delete_many([relation_key(user_id, partner_id) for partner_id in chunk])
+        new_relations_version(*chunk)
@@ -0,0 +1,188 @@
+"""
+Friendship events pushed to the affected users, see `FriendshipEventStreamView`.
+
+Events are published after the commit of the change, by the receivers in `api.signals`, and
+fanned out by an in-process broker to the event streams of the user open in this process. With
+REDIS_URL set they go through a Redis channel first, so every process gets the events of its
+own streams whichever process made the change (needs the `redis` package).
+
+Every stream buffers at most EVENTS_QUEUE_SIZE events. A stream that falls further behind is
+sent `resync` and closed: the client reloads its lists instead of the process buffering for it.
+So are the streams of a process whose connection to Redis dropped, events may have been missed.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+REQUEST_RECEIVED = 'request_received'
+REQUEST_ACCEPTED = 'request_accepted'
+REQUEST_REJECTED = 'request_rejected'
+FRIENDSHIP_REMOVED = 'friendship_removed'
+
+CHANNEL = 'friendship-events'
+
+# Seconds between attempts to subscribe to the Redis channel again.
+RECONNECT_SECONDS = 1
+
+logger = logging.getLogger('api.events')
+
+
+def relation_event(event_type, relation):
+    return {
+        'type': event_type,
+        'relation': str(relation.pk),
+        'user_sender': str(relation.user_sender_id),
+        'user_recipient': str(relation.user_recipient_id),
+    }
+
+
+class Subscription:
+    """Events of one user for one stream, read by the event loop the stream runs on."""
+
+    def __init__(self, user_id, size):
+        self.user_id = str(user_id)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(size)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def resync(self):
+        """Tell the stream to resync as if it overflowed, events may have been lost."""
+
+        self.overflowed = True
+        # Wakes up a waiting stream.
+        self.put(None)
+
+    async def get(self, timeout):
+        """Return the next event, None if there was none for `timeout` seconds."""
+
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    """In-process fan-out of events to the subscriptions of their users."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, settings.EVENTS_QUEUE_SIZE)
+        with self.lock:
+            self.subscriptions[subscription.user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.user_id]
+
+    def publish(self, user_id, event):
+        self.dispatch(str(user_id), event)
+
+    def dispatch(self, user_id, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            # Publishers run in any thread, the queue belongs to the loop of the stream.
+            subscription.loop.call_soon_threadsafe(subscription.put, event)
+
+    def resync(self):
+        with self.lock:
+            subscriptions = [subscription for user in self.subscriptions.values() for subscription in user]
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.resync)
+
+
+class RedisBroker(Broker):
+    """
+    Broker publishing to a Redis channel that every process listens to.
+
+    The listener is a daemon thread started with the first subscription of the process. It
+    subscribes again whenever the connection drops. Failures to publish are logged, not raised:
+    the change is committed already and its streams catch up on their next resync.
+    """
+
+    def __init__(self, url):
+        import redis
+
+        super().__init__()
+        self.client = redis.Redis.from_url(url)
+        self.errors = redis.RedisError
+        self.listener = None
+
+    def subscribe(self, user_id):
+        with self.lock:
+            if self.listener is None:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                self.listener = threading.Thread(target=self.listen, args=(pubsub,), daemon=True)
+                self.listener.start()
+        return super().subscribe(user_id)
+
+    def publish(self, user_id, event):
+        try:
+            self.client.publish(CHANNEL, json.dumps({'user': str(user_id), 'event': event}))
+        except self.errors:
+            logger.exception('Friendship event of user %s was not published.', user_id)
+
+    def listen(self, pubsub):
+        while True:
+            try:
+                for message in pubsub.listen():
+                    data = json.loads(message['data'])
+                    self.dispatch(data['user'], data['event'])
+            except self.errors:
+                logger.exception('Lost the Redis channel of friendship events, subscribing again.')
+            # Events published while the channel was down are lost.
+            self.resync()
+            time.sleep(RECONNECT_SECONDS)
+            pubsub = self.resubscribe(pubsub)
+
+    def resubscribe(self, pubsub):
+        pubsub.close()
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(CHANNEL)
+                return pubsub
+            except self.errors:
+                pubsub.close()
+                logger.warning('Redis channel of friendship events unavailable, retrying.')
+                time.sleep(RECONNECT_SECONDS)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = RedisBroker(settings.REDIS_URL) if settings.REDIS_URL else Broker()
+        return _broker
+
+
+def publish_on_commit(user_id, event):
+    """Publish `event` to the user once the current transaction commits, right away outside of one."""
+
+    transaction.on_commit(partial(get_broker().publish, user_id, event))
@@ -0,0 +1,124 @@
+"""
+Streaming exports of relations as NDJSON or CSV.
+
+Rows are read from a server-side cursor `chunk_size` at a time and each one is serialized on its
+own, by the same row serializer as the relation lists, so memory use does not grow with the
+number of relations: a user's friend list or the whole table.
+
+The reader sets the pace, and the transaction of the cursor stays open meanwhile: PostgreSQL ends
+a session idle in it for longer than EXPORT_IDLE_TIMEOUT_SECONDS, so a stalled download does not
+hold its snapshot for good. Under ASGI the chunks are served by `async_chunks`, Django reads a
+plain iterator to the end before sending anything.
+"""
+import csv
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from rest_framework.utils.encoders import JSONEncoder
+
+from .serializers import RELATION_ROW_FIELDS, FriendshipRelationRowSerializer
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+CSV_COLUMNS = (
+    'id',
+    'sender_id',
+    'sender_username',
+    'recipient_id',
+    'recipient_username',
+    'status',
+    'created_at',
+    'updated_at',
+)
+
+
+class _Echo:
+    """File-like object returning what is written, so the csv writer formats a line at a time."""
+
+    def write(self, value):
+        return value
+
+
+def _ndjson_lines(representations):
+    encoder = JSONEncoder(ensure_ascii=False)
+    for representation in representations:
+        yield encoder.encode(representation) + '\n'
+
+
+def _csv_lines(representations):
+    writer = csv.writer(_Echo())
+    # Dates are written the same as in JSON.
+    encode = JSONEncoder().default
+    yield writer.writerow(CSV_COLUMNS)
+    for representation in representations:
+        sender, recipient = representation['friend_sender'], representation['friend_recipient']
+        yield writer.writerow((
+            representation['id'],
+            sender['id'],
+            sender['username'],
+            recipient['id'],
+            recipient['username'],
+            representation['status'].value,
+            encode(representation['created_at']),
+            encode(representation['updated_at']),
+        ))
+
+
+_writers = {
+    'ndjson': _ndjson_lines,
+    'csv': _csv_lines,
+}
+
+
+def export_relations(queryset, export_format, chunk_size):
+    """
+    Chunks of `export_format` text with the relations of `queryset`, for a streaming response or a file.
+
+    The database is chosen now, while the routing of the request applies, the rows are only read
+    as the chunks are consumed.
+    """
+
+    queryset = queryset.using(queryset.db).values(*RELATION_ROW_FIELDS).order_by()
+    return _chunks(queryset, _writers[export_format], chunk_size)
+
+
+def _chunks(queryset, writer, chunk_size):
+    # Outside of a transaction the server-side cursor is declared WITH HOLD and PostgreSQL
+    # materializes the whole result before the first row is sent.
+    with transaction.atomic(using=queryset.db):
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT set_config(%s, %s, true)',
+                    ['idle_in_transaction_session_timeout', f'{settings.EXPORT_IDLE_TIMEOUT_SECONDS}s'],
+                )
+        serializer = FriendshipRelationRowSerializer()
+        representations = map(serializer.to_representation, queryset.iterator(chunk_size=chunk_size))
+        chunk = []
+        for line in writer(representations):
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield ''.join(chunk)
+                chunk.clear()
+        if chunk:
+            yield ''.join(chunk)
+
+
+async def async_chunks(chunks):
+    """
+    Serve the chunks of `export_relations` to an async consumer, a chunk at a time.
+
+    Each chunk is made in the thread of the request, where the cursor and its connection live.
+    """
+
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
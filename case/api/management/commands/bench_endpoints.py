@@ -0,0 +1,142 @@
+import random
+import statistics
+import time
+from contextlib import ExitStack
+from urllib.parse import parse_qsl, urlsplit
+
+from api.views import (FriendRecommendationView, FriendshipRequestViewSet,
+                       FriendshipViewSet, GetRelationView, MutualFriendsView,
+                       UserCountersView)
+from app.models import FriendshipEdge, User
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+# Most queries a request of each endpoint may run, with the user already authenticated.
+QUERY_BUDGETS = {
+    'requests-list': 1,
+    'requests-list?is_incoming': 1,
+    'requests-list?is_outgoing': 1,
+    'friendships-list': 1,
+    'friendships-list (next page)': 1,
+    'relations-detail': 2,
+    'relations-mutual': 3,
+    'recommendations': 1,
+    'me-counters': 0,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Call every read endpoint in-process for `bench_1`, the biggest hub of `generate_social_graph`, and '
+        'a sample of other `bench_<n>` users. Report latency percentiles, queries per request and rows/s, '
+        'and fail if an endpoint runs more queries than its budget in QUERY_BUDGETS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Users sampled besides bench_1.')
+        parser.add_argument('--rounds', type=int, default=3, help='Requests per endpoint and user.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        users = self.sample_users(options['users'], random.Random(options['seed']))
+        if not users:
+            raise CommandError('No bench_<n> users, load a graph with generate_social_graph first.')
+        friends = dict(
+            FriendshipEdge.objects.filter(user__in=users).order_by('user', 'created_at')
+            .distinct('user').values_list('user', 'friend__username')
+        )
+
+        failures = []
+        for name, view, get_path in self.get_endpoints():
+            latencies, queries, rows = [], [], 0
+            for user in users:
+                path = get_path(user, friends.get(user.pk))
+                if path is None:
+                    continue
+                for _ in range(options['rounds']):
+                    elapsed, count, response = self.call(view, path, user)
+                    latencies.append(elapsed)
+                    queries.append(count)
+                    rows += self.count_rows(response.data)
+            if not latencies:
+                continue
+            self.report(name, latencies, queries, rows)
+            if max(queries) > QUERY_BUDGETS[name]:
+                failures.append(f'{name}: {max(queries)} queries, budget {QUERY_BUDGETS[name]}')
+        if failures:
+            raise CommandError('Query budgets exceeded:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('All endpoints are within their query budgets.'))
+
+    def sample_users(self, size, rng):
+        usernames = {'bench_1'}
+        total = User.objects.filter(username__startswith='bench_').count()
+        if total:
+            usernames.update(f'bench_{rng.randint(1, total)}' for _ in range(size))
+        return list(User.objects.filter(username__in=usernames))
+
+    def get_endpoints(self):
+        """Name, view and `path(user, friend_username)` of every endpoint, the path is None to skip the user."""
+
+        requests = FriendshipRequestViewSet.as_view({'get': 'list'})
+        friendships = FriendshipViewSet.as_view({'get': 'list'})
+
+        def next_page(user, friend):
+            _, _, response = self.call(friendships, reverse('friendships-list'), user)
+            if response.data['next'] is None:
+                return None
+            parts = urlsplit(response.data['next'])
+            return f'{parts.path}?{parts.query}'
+
+        def same(path):
+            return lambda user, friend: path
+
+        def with_friend(name):
+            return lambda user, friend: friend and reverse(name, kwargs={'username': friend})
+
+        return (
+            ('requests-list', requests, same(reverse('requests-list'))),
+            ('requests-list?is_incoming', requests, same(reverse('requests-list') + '?is_incoming=true')),
+            ('requests-list?is_outgoing', requests, same(reverse('requests-list') + '?is_outgoing=true')),
+            ('friendships-list', friendships, same(reverse('friendships-list'))),
+            ('friendships-list (next page)', friendships, next_page),
+            ('relations-detail', GetRelationView.as_view(), with_friend('relations-detail')),
+            ('relations-mutual', MutualFriendsView.as_view(), with_friend('relations-mutual')),
+            ('recommendations', FriendRecommendationView.as_view(), same(reverse('recommendations'))),
+            ('me-counters', UserCountersView.as_view(), same(reverse('me-counters'))),
+        )
+
+    def call(self, view, path, user):
+        """Return the seconds and queries (on the primary and replica) of a rendered request, and its response."""
+
+        aliases = {DEFAULT_DB_ALIAS, settings.DATABASE_REPLICA} - {None}
+        parts = urlsplit(path)
+        request = APIRequestFactory(SERVER_NAME='localhost').get(parts.path, dict(parse_qsl(parts.query)))
+        force_authenticate(request, user=user)
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in aliases]
+            started = time.perf_counter()
+            response = view(request, **resolve(parts.path).kwargs)
+            response.render()
+            elapsed = time.perf_counter() - started
+        return elapsed, sum(len(queries) for queries in captured), response
+
+    def count_rows(self, data):
+        if isinstance(data, dict):
+            return len(data['results']) if 'results' in data else 1
+        return len(data)
+
+    def report(self, name, latencies, queries, rows):
+        latencies.sort()
+
+        def percentile(value):
+            return latencies[min(int(len(latencies) * value), len(latencies) - 1)] * 1000
+
+        self.stdout.write(
+            f'{name}: {len(latencies)} requests, p50 {percentile(0.5):.1f} ms, p95 {percentile(0.95):.1f} ms, '
+            f'p99 {percentile(0.99):.1f} ms, queries {statistics.mean(queries):.1f} mean {max(queries)} max, '
+            f'{rows / sum(latencies):,.0f} rows/s'
+        )
@@ -0,0 +1,131 @@
+import hashlib
+import random
+import statistics
+import time
+import uuid
+from array import array
+
+from api.paths import PathSearchLimitExceeded, expand_from_db, shortest_path
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+def bfs(source, target, max_depth, expand):
+    """One-sided breadth-first search, the baseline for the bidirectional one."""
+
+    visited = {source}
+    frontier = [source]
+    for depth in range(1, max_depth + 1):
+        next_frontier = []
+        for _, friend_id in expand(frontier):
+            if friend_id == target:
+                return depth
+            if friend_id not in visited:
+                visited.add(friend_id)
+                next_frontier.append(friend_id)
+        if not next_frontier:
+            return None
+        frontier = next_frontier
+    return None
+
+
+class Counter:
+    """`expand` wrapper counting calls (queries with the database) and users expanded."""
+
+    def __init__(self, expand):
+        self.expand = expand
+        self.calls = 0
+        self.users = 0
+
+    def __call__(self, user_ids, limit=None):
+        self.calls += 1
+        self.users += len(user_ids)
+        return self.expand(user_ids, limit)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the shortest friendship path search on synthetic in-memory graphs against '
+        'a one-sided BFS, or with --db on users generated by `bench_list_indexes --seed`.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--edges', type=int, nargs='+', default=[100_000, 1_000_000, 10_000_000])
+        parser.add_argument('--degree', type=int, default=20, help='Average number of friends.')
+        parser.add_argument('--pairs', type=int, default=200, help='Random user pairs searched per graph.')
+        parser.add_argument('--max-depth', type=int, default=6)
+        parser.add_argument('--db', action='store_true', help='Search the database instead of in-memory graphs.')
+        parser.add_argument('--users', type=int, default=1_000_000, help='Seeded users with --db.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['db']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('The database benchmark runs on PostgreSQL only.')
+            users = options['users']
+            pairs = [
+                (self.bench_user_id(rng.randint(1, users)), self.bench_user_id(rng.randint(1, users)))
+                for _ in range(options['pairs'])
+            ]
+            self.report('database', pairs, expand_from_db, options['max_depth'], baseline=False)
+            return
+
+        for edges in options['edges']:
+            users = max(2 * edges // options['degree'], 2)
+            started = time.perf_counter()
+            graph = self.make_graph(rng, users, edges)
+            self.stdout.write(f'{edges:,} edges, {users:,} users, built in {time.perf_counter() - started:.1f}s')
+
+            def expand(user_ids, limit=None):
+                return [(user_id, friend_id) for user_id in user_ids for friend_id in graph[user_id]][:limit]
+
+            pairs = [(rng.randrange(users), rng.randrange(users)) for _ in range(options['pairs'])]
+            self.report(f'{edges:,} edges', pairs, expand, options['max_depth'], baseline=True)
+
+    def make_graph(self, rng, users, edges):
+        """
+        Random graph with a skewed degree distribution: low user numbers get most of the friends.
+        """
+
+        graph = [array('l') for _ in range(users)]
+        for _ in range(edges):
+            a = int(users * rng.random() ** 2)
+            b = rng.randrange(users)
+            if a != b:
+                graph[a].append(b)
+                graph[b].append(a)
+        return graph
+
+    def report(self, name, pairs, expand, max_depth, baseline):
+        timings, calls, expanded, found, limited, baseline_expanded = [], [], [], 0, 0, []
+        for source, target in pairs:
+            counter = Counter(expand)
+            started = time.perf_counter()
+            try:
+                path = shortest_path(source, target, max_depth, counter)
+            except PathSearchLimitExceeded:
+                path, limited = None, limited + 1
+            timings.append(time.perf_counter() - started)
+            calls.append(counter.calls)
+            expanded.append(counter.users)
+            found += path is not None
+            if baseline:
+                counter = Counter(expand)
+                bfs(source, target, max_depth, counter)
+                baseline_expanded.append(counter.users)
+
+        timings.sort()
+        self.stdout.write(
+            f'{name}: found {found}/{len(pairs)}, over limits {limited}, '
+            f'p50 {timings[len(timings) // 2] * 1000:.2f} ms, '
+            f'p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} ms, '
+            f'{statistics.mean(calls):.1f} expansions and {statistics.mean(expanded):,.0f} users expanded on average'
+        )
+        if baseline:
+            self.stdout.write(
+                f'{name}: one-sided BFS expands {statistics.mean(baseline_expanded):,.0f} users on average'
+            )
+
+    def bench_user_id(self, n):
+        return uuid.UUID(hashlib.md5(f'bench_{n}'.encode()).hexdigest())
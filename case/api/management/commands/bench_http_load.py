@@ -0,0 +1,109 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from app.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+async def read_response(reader):
+    """Read one HTTP/1.1 response, return its status and whether the server keeps the connection."""
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed by the server.')
+    status = int(status_line.split()[1])
+    length, keep_alive = 0, not status_line.startswith(b'HTTP/1.0')
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection':
+            keep_alive = value == 'keep-alive'
+        elif name == 'transfer-encoding' and value == 'chunked':
+            raise ConnectionError('Chunked responses are not supported.')
+    await reader.readexactly(length)
+    return status, keep_alive
+
+
+class Command(BaseCommand):
+    help = (
+        'Keep N connections busy with GET requests to each URL for a while and report requests/s and '
+        'latency percentiles, e.g. the same endpoint served by a WSGI and by an ASGI server.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='Absolute URLs, http only.')
+        parser.add_argument('--username', required=True, help='User the requests are authenticated as.')
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds per URL.')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for one response.')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f'User "{options["username"]}" does not exist.')
+        token = str(RefreshToken.for_user(user).access_token)
+        for url in options['urls']:
+            parts = urlsplit(url)
+            if parts.scheme != 'http':
+                raise CommandError(f'Only http URLs are supported: {url}')
+            latencies, errors = asyncio.run(
+                self.run(parts, token, options['connections'], options['duration'], options['timeout'])
+            )
+            self.report(url, latencies, errors, options['duration'])
+
+    async def run(self, parts, token, connections, duration, timeout):
+        path = parts.path + (f'?{parts.query}' if parts.query else '')
+        request = (
+            f'GET {path} HTTP/1.1\r\n'
+            f'Host: {parts.netloc}\r\n'
+            f'Authorization: Bearer {token}\r\n'
+            'Connection: keep-alive\r\n\r\n'
+        ).encode()
+        deadline = time.perf_counter() + duration
+        latencies, errors = [], {}
+
+        async def connection():
+            reader = writer = None
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.wait_for(
+                            asyncio.open_connection(parts.hostname, parts.port or 80), timeout,
+                        )
+                    writer.write(request)
+                    status, keep_alive = await asyncio.wait_for(read_response(reader), timeout)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as error:
+                    errors[type(error).__name__] = errors.get(type(error).__name__, 0) + 1
+                    status, keep_alive = None, False
+                else:
+                    latencies.append(time.perf_counter() - started)
+                    if status != 200:
+                        errors[f'HTTP {status}'] = errors.get(f'HTTP {status}', 0) + 1
+                if not keep_alive and writer is not None:
+                    writer.close()
+                    reader = writer = None
+            if writer is not None:
+                writer.close()
+
+        await asyncio.gather(*(connection() for _ in range(connections)))
+        return latencies, errors
+
+    def report(self, url, latencies, errors, duration):
+        latencies.sort()
+
+        def percentile(value):
+            return latencies[min(int(len(latencies) * value), len(latencies) - 1)] * 1000 if latencies else 0
+
+        self.stdout.write(
+            f'{url}: {len(latencies) / duration:,.0f} requests/s, '
+            f'p50 {percentile(0.5):.1f} ms, p99 {percentile(0.99):.1f} ms, '
+            f'errors {sum(errors.values())}' + (f' {errors}' if errors else '')
+        )
@@ -0,0 +1,161 @@
+import json
+
+from api.pagination import KeysetCursorPagination
+from api.views import FriendshipRequestViewSet, FriendshipViewSet
+from app.models import FriendshipEdge, FriendshipRelation, User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+SCANNED_TABLES = (FriendshipRelation._meta.db_table, FriendshipEdge._meta.db_table)
+INDEX_SCANS = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+PENDING_INDEXES = {'relation_pending_in_idx', 'relation_pending_out_idx'}
+PAIR_INDEX = 'relation_unique_pair'
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN the list and relation queries of the API and fail unless each of them reads '
+        'the relation tables by index scans of the indexes meant for it. Run with --seed on an '
+        'empty database to get a synthetic 10M-row relation table first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='Generate synthetic users and relations first.')
+        parser.add_argument('--users', type=int, default=1_000_000, help='Users to generate with --seed.')
+        parser.add_argument('--relations', type=int, default=10_000_000, help='Relations to generate with --seed.')
+        parser.add_argument('--username', default='bench_1', help='User whose queries are explained.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Query plans are only checked on PostgreSQL.')
+        if options['seed']:
+            self.seed(options['users'], options['relations'])
+
+        user = User.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f'User "{options["username"]}" does not exist, use --seed or --username.')
+
+        failures = []
+        for name, queryset, expected in self.get_querysets(user):
+            plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+            scans = list(self.get_scans(plan))
+            self.stdout.write(f'{name}:')
+            for node_type, index, table in scans:
+                target = (f' on {table}' if table else '') + (f' using {index}' if index else '')
+                self.stdout.write(f'    {node_type}{target}')
+                failure = self.check_scan(node_type, index, table, expected)
+                if failure:
+                    failures.append(f'{name}: {failure}')
+        if failures:
+            raise CommandError('Relation tables not read by their indexes:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('All list and relation queries use their indexes.'))
+
+    def check_scan(self, node_type, index, table, expected):
+        """
+        Describe what is wrong with a scan of the plan, None if it is not one of the relation tables
+        or an index scan of one of the `expected` indexes.
+
+        Scans of partitions are checked as scans of their table, by the indexes they were made from.
+        A bitmap heap scan is judged by the bitmap index scans below it.
+        """
+
+        if index is not None:
+            index, table = self.get_parents(index)
+        elif table is not None:
+            table = self.get_parents(table)[0]
+        if table not in SCANNED_TABLES or node_type == 'Bitmap Heap Scan':
+            return None
+        if node_type in INDEX_SCANS and index in expected:
+            return None
+        return f'{node_type} on {table}' + (f' using {index}' if index else '')
+
+    def get_parents(self, name):
+        """(index or table, table) of the index or table `name`, those of the parent table for a partition."""
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                '''
+                SELECT coalesce(parent.inhparent, relation.oid)::regclass::text,
+                       coalesce(parent_table.inhparent, indexed.indrelid)::regclass::text
+                FROM pg_class relation
+                LEFT JOIN pg_inherits parent ON parent.inhrelid = relation.oid
+                LEFT JOIN pg_index indexed ON indexed.indexrelid = relation.oid
+                LEFT JOIN pg_inherits parent_table ON parent_table.inhrelid = indexed.indrelid
+                WHERE relation.oid = to_regclass(%s)
+                ''',
+                [name],
+            )
+            return cursor.fetchone()
+
+    def get_index_names(self, model, *columns):
+        """Names of the indexes of `model` whose key starts with `columns`, whatever Django named them."""
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                '''
+                SELECT indexrelid::regclass::text, array(
+                    SELECT attribute.attname::text
+                    FROM unnest(indkey::int2[]) WITH ORDINALITY AS key (attnum, position)
+                    JOIN pg_attribute attribute ON attribute.attrelid = indrelid AND attribute.attnum = key.attnum
+                    ORDER BY key.position
+                )
+                FROM pg_index WHERE indrelid = to_regclass(%s)
+                ''',
+                [model._meta.db_table],
+            )
+            return {name for name, key in cursor.fetchall() if tuple(key[:len(columns)]) == columns}
+
+    def get_querysets(self, user):
+        """(name, queryset, names of the indexes it should read the relation tables by) of each query."""
+
+        relation_ids = self.get_index_names(FriendshipRelation, 'id') | self.get_index_names(
+            FriendshipRelation, 'owner_id', 'id',
+        )
+        user_edges = self.get_index_names(FriendshipEdge, 'user_id')
+        paginator = KeysetCursorPagination()
+        page_size = paginator.page_size + 1
+        # The filters narrow the requests of either direction, which the planner may still read by both indexes.
+        shapes = (
+            ('requests-list', FriendshipRequestViewSet, {}, PENDING_INDEXES),
+            ('requests-list?is_incoming', FriendshipRequestViewSet, {'is_incoming': 'true'}, PENDING_INDEXES),
+            ('requests-list?is_outgoing', FriendshipRequestViewSet, {'is_outgoing': 'true'}, PENDING_INDEXES),
+            # The edges of the user, then each relation by id.
+            ('friendships-list', FriendshipViewSet, {}, user_edges | relation_ids),
+        )
+        for name, viewset, query, expected in shapes:
+            queryset = self.get_list_queryset(viewset, user, query).order_by(*paginator.ordering)
+            yield name, queryset[:page_size], expected
+            last = queryset.values('created_at', 'id')[page_size - 1:page_size].first()
+            if last:
+                position = paginator._get_position_from_instance(last, paginator.ordering)
+                condition = paginator.get_position_filter(position, paginator.ordering)
+                yield f'{name} (next page)', queryset.filter(condition)[:page_size], expected
+
+        friend_id = FriendshipEdge.objects.filter(user=user).values_list('friend', flat=True).first()
+        if friend_id:
+            yield (
+                'relations-detail (edge)',
+                FriendshipEdge.objects.filter(user=user, friend_id=friend_id)[:1],
+                self.get_index_names(FriendshipEdge, 'user_id', 'friend_id'),
+            )
+            yield 'relations-detail (pair)', FriendshipRelation.objects.between(user.pk, friend_id)[:1], {PAIR_INDEX}
+
+    def get_list_queryset(self, viewset, user, query):
+        request = APIRequestFactory().get('/', query)
+        force_authenticate(request, user=user)
+        view = viewset(action_map={'get': 'list'}, format_kwarg=None, args=(), kwargs={})
+        view.request = view.initialize_request(request)
+        return view.filter_queryset(view.get_queryset())
+
+    def get_scans(self, plan):
+        if 'Scan' in plan['Node Type']:
+            yield plan['Node Type'], plan.get('Index Name'), plan.get('Relation Name')
+        for child in plan.get('Plans', ()):
+            yield from self.get_scans(child)
+
+    def seed(self, users, relations):
+        """Generate `bench_<n>` users and the relations between them, see `generate_social_graph`."""
+
+        call_command('generate_social_graph', users=users, relations=relations, stdout=self.stdout)
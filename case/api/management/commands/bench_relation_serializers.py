@@ -0,0 +1,76 @@
+import time
+import uuid
+
+from api.serializers import (FriendshipRelationRowSerializer,
+                             FriendshipRelationSerializer, UserSerializer,
+                             relation_status)
+from app.models import FriendshipRelation, User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+
+def nested_representation(instance):
+    """Relation representation with nested user serializers, as lists were built before the fast path."""
+
+    return {
+        'id': instance.id,
+        'friend_sender': UserSerializer(instance.user_sender).data,
+        'friend_recipient': UserSerializer(instance.user_recipient).data,
+        'status': relation_status(instance.is_accepted),
+        'created_at': instance.created_at,
+        'updated_at': instance.updated_at,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Measure rows/s of relation list serialization: nested serializers, model serializer and row fast path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        for size in options['sizes']:
+            instances, rows = self.make_relations(size)
+            paths = (
+                ('nested', lambda: [nested_representation(instance) for instance in instances]),
+                ('model', lambda: FriendshipRelationSerializer(instances, many=True).data),
+                ('rows', lambda: FriendshipRelationRowSerializer(rows, many=True).data),
+            )
+            rendered = set()
+            for name, serialize in paths:
+                started = time.perf_counter()
+                content = renderer.render(serialize())
+                elapsed = time.perf_counter() - started
+                rendered.add(content)
+                self.stdout.write(f'{size:>7} {name:<6} {size / elapsed:>12,.0f} rows/s')
+            if len(rendered) != 1:
+                self.stderr.write(f'{size:>7} outputs differ between paths!')
+
+    def make_relations(self, size):
+        now = timezone.now()
+        users = [User(id=uuid.uuid4(), username=f'user{n}') for n in range(max(size // 10, 2))]
+        instances, rows = [], []
+        for n in range(size):
+            sender, recipient = users[n % len(users)], users[(n + 1) % len(users)]
+            relation = FriendshipRelation(
+                id=uuid.uuid4(),
+                user_sender=sender,
+                user_recipient=recipient,
+                is_accepted=(None, True, False)[n % 3],
+                created_at=now,
+                updated_at=now,
+            )
+            instances.append(relation)
+            rows.append({
+                'id': relation.id,
+                'user_sender_id': sender.id,
+                'user_sender__username': sender.username,
+                'user_recipient_id': recipient.id,
+                'user_recipient__username': recipient.username,
+                'is_accepted': relation.is_accepted,
+                'created_at': now,
+                'updated_at': now,
+            })
+        return instances, rows
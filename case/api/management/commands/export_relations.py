@@ -0,0 +1,39 @@
+from api.export import EXPORT_FORMATS, export_relations
+from app.models import FriendshipRelation, User
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Write all relations, or the friendships of --user, as NDJSON or CSV, streamed from a '
+        'server-side cursor, see `api.export`.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default=None, help='Username whose friendships are exported.')
+        parser.add_argument('--format', choices=tuple(EXPORT_FORMATS), default='ndjson', dest='export_format')
+        parser.add_argument('--output', default=None, help='File to write instead of the standard output.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=settings.EXPORT_CHUNK_SIZE, help='Relations read at a time.',
+        )
+
+    def handle(self, *args, **options):
+        if options['user'] is None:
+            queryset = FriendshipRelation.objects.all()
+        else:
+            user_id = User.objects.filter(username=options['user']).values_list('id', flat=True).first()
+            if user_id is None:
+                raise CommandError(f'User {options["user"]} does not exist.')
+            queryset = FriendshipRelation.objects.friendships_of(user_id)
+
+        chunks = export_relations(queryset, options['export_format'], options['chunk_size'])
+        if options['output'] is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        # The csv module expects files opened without newline translation.
+        with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+            for chunk in chunks:
+                file.write(chunk)
+        self.stdout.write(f'Relations written to {options["output"]}.')
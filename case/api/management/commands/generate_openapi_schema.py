@@ -0,0 +1,17 @@
+from config.schema import code_version, generate_schema
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema for the current code version and write it to OPENAPI_SCHEMA_FILE.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='File to write instead of OPENAPI_SCHEMA_FILE.')
+
+    def handle(self, *args, **options):
+        path = options['output'] or settings.OPENAPI_SCHEMA_FILE
+        content = generate_schema()
+        with open(path, 'wb') as file:
+            file.write(content)
+        self.stdout.write(f'Schema for code version {code_version()} written to {path} ({len(content):,} bytes).')
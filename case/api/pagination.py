@@ -0,0 +1,129 @@
+import uuid
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the unique `(created_at, id)` pair of a BaseModel.
+
+    The cursor keeps the position of the boundary row, so each page is a single
+    index range scan whatever the depth: no OFFSET and no COUNT(*).
+    """
+
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    position_separator = '|'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.get_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Async counterpart of `paginate_queryset`, for views using the async ORM."""
+
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.get_page([row async for row in queryset])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """Queryset of the requested page plus one row, or None when pagination is off."""
+
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        # The position is unique, so the offset part of a cursor is never needed.
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (self.reverse, self.current_position) = (False, None)
+        else:
+            (_, self.reverse, self.current_position) = self.cursor
+
+        ordering = _reverse_ordering(self.ordering) if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.current_position is not None:
+            queryset = queryset.filter(self.get_position_filter(self.current_position, ordering))
+
+        # Always fetch an extra item to determine if there is a following page.
+        return queryset[:self.page_size + 1]
+
+    def get_page(self, results):
+        reverse, current_position = self.reverse, self.current_position
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_position_filter(self, position, ordering):
+        """
+        Build the condition selecting rows strictly after `position` in `ordering`.
+
+        Written as `created_at <= x AND (created_at < x OR id < y)` rather than a plain OR,
+        so the leading column still bounds the index range scan.
+        """
+
+        created_at, pk = self.parse_position(position)
+        time_field, id_field = (order.lstrip('-') for order in ordering)
+        lookup = 'lt' if ordering[0].startswith('-') else 'gt'
+        return Q(**{f'{time_field}__{lookup}e': created_at}) & (
+            Q(**{f'{time_field}__{lookup}': created_at}) | Q(**{f'{id_field}__{lookup}': pk})
+        )
+
+    def parse_position(self, position):
+        try:
+            created_at, pk = position.split(self.position_separator)
+            created_at = parse_datetime(created_at)
+            pk = uuid.UUID(pk)
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            field_name = order.lstrip('-')
+            if isinstance(instance, dict):
+                attr = instance[field_name]
+            else:
+                attr = getattr(instance, field_name)
+            values.append(attr.isoformat() if hasattr(attr, 'isoformat') else str(attr))
+        return self.position_separator.join(values)
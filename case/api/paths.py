@@ -0,0 +1,89 @@
+"""
+Shortest friendship path between two users, by bidirectional breadth-first search.
+
+Both users' sides are searched level by level, always expanding the smaller frontier. A level
+is expanded with one `IN (...)` query over FriendshipEdge, so a path of length N costs at most N
+queries however many users the frontiers hold. Frontier size and wall time are capped by
+PATH_MAX_FRONTIER and PATH_TIME_BUDGET_MS, and the friendships read by a level by PATH_MAX_EDGES:
+a frontier of a few hub users can have millions, the query reads one more than that at most and
+the wall time is checked as they are read.
+"""
+import time
+
+from app.models import FriendshipEdge
+from django.conf import settings
+
+
+class PathSearchLimitExceeded(Exception):
+    pass
+
+
+def expand_from_db(user_ids, limit=None):
+    """(user, friend) pairs of accepted friendships of `user_ids`, `limit` at most."""
+
+    return FriendshipEdge.objects.filter(user_id__in=user_ids).values_list('user_id', 'friend_id')[:limit]
+
+
+def shortest_path(
+    source, target, max_depth, expand=expand_from_db, max_frontier=None, time_budget=None, max_edges=None,
+):
+    """
+    Return the shortest list of user ids from `source` to `target`, or None if it is longer than `max_depth`.
+
+    `expand` maps a list of user ids and a limit to their (user, friend) pairs, that many at most.
+    Raise PathSearchLimitExceeded when a frontier to expand is larger than `max_frontier`, its
+    expansion gives more than `max_edges` pairs or the search runs over `time_budget` seconds.
+    """
+
+    if max_frontier is None:
+        max_frontier = settings.PATH_MAX_FRONTIER
+    if max_edges is None:
+        max_edges = settings.PATH_MAX_EDGES
+    if time_budget is None:
+        time_budget = settings.PATH_TIME_BUDGET_MS / 1000
+    deadline = time.monotonic() + time_budget
+
+    if source == target:
+        return [source]
+    forward, backward = {source: None}, {target: None}
+    forward_frontier, backward_frontier = [source], [target]
+    for _ in range(max_depth):
+        if not forward_frontier or not backward_frontier:
+            return None
+        if len(forward_frontier) > len(backward_frontier):
+            frontier, parents, other = backward_frontier, backward, forward
+        else:
+            frontier, parents, other = forward_frontier, forward, backward
+        if len(frontier) > max_frontier or time.monotonic() > deadline:
+            raise PathSearchLimitExceeded
+
+        next_frontier = []
+        for read, (user_id, friend_id) in enumerate(expand(frontier, max_edges + 1), 1):
+            if read > max_edges or time.monotonic() > deadline:
+                raise PathSearchLimitExceeded
+            if friend_id in parents:
+                continue
+            parents[friend_id] = user_id
+            if friend_id in other:
+                return join_path(friend_id, forward, backward)
+            next_frontier.append(friend_id)
+
+        if frontier is forward_frontier:
+            forward_frontier = next_frontier
+        else:
+            backward_frontier = next_frontier
+    return None
+
+
+def join_path(meeting, forward, backward):
+    path = []
+    user_id = meeting
+    while user_id is not None:
+        path.append(user_id)
+        user_id = forward[user_id]
+    path.reverse()
+    user_id = backward[meeting]
+    while user_id is not None:
+        path.append(user_id)
+        user_id = backward[user_id]
+    return path
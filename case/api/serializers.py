@@ -1,9 +1,37 @@
-from app.models import FriendshipRelation, User
+from app.models import (COUNTER_FIELDS, FriendRecommendation,
+                        FriendshipRelation, User)
+from django.conf import settings
 from rest_framework import serializers
 from rest_framework.validators import ValidationError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 from .enums import FriendshipStatus
 
+RELATION_ROW_FIELDS = (
+    'id',
+    'user_sender_id',
+    'user_sender__username',
+    'user_recipient_id',
+    'user_recipient__username',
+    'is_accepted',
+    'created_at',
+    'updated_at',
+)
+
+
+def user_representation(user_id, username):
+    """Same output as `UserSerializer(user).data`, without building a serializer."""
+
+    return {'id': str(user_id), 'username': username}
+
+
+def relation_status(is_accepted):
+    return (
+        FriendshipStatus.accepted if is_accepted is True else
+        FriendshipStatus.waiting if is_accepted is None else
+        FriendshipStatus.rejected
+    )
+
 
 class UserSerializer(serializers.ModelSerializer):
 
@@ -19,12 +47,31 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
+class UserCountersSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = User
+        fields = COUNTER_FIELDS
+        read_only_fields = COUNTER_FIELDS
+
+
+class TokenObtainPairWithClaimsSerializer(TokenObtainPairSerializer):
+    """
+    Token pair that also carries the username, for StatelessJWTAuthentication.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        return token
+
+
 class FriendshipRelationSerializer(serializers.ModelSerializer):
 
-    request_friendship_to_user = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all(),
+    request_friendship_to_user = serializers.UUIDField(
         write_only=True,
-        source='user_recipient',
+        source='user_recipient_id',
         label='Friendship request to user',
         help_text='Pass here id of user to be requested.'
     )
@@ -51,26 +98,42 @@ class FriendshipRelationSerializer(serializers.ModelSerializer):
         }
 
     def validate(self, attrs):
-        if self.context['request'].user == attrs['user_recipient']:
+        if self.context['request'].user.pk == attrs['user_recipient_id']:
             raise ValidationError('Impossible to make friendship request to yourself!')
         return attrs
 
     def to_representation(self, instance):
         representation = {
             'id': instance.id,
-            'friend_sender': UserSerializer(instance.user_sender).data,
-            'friend_recipient': UserSerializer(instance.user_recipient).data,
-            'status': (
-                FriendshipStatus.accepted if instance.is_accepted is True else
-                FriendshipStatus.waiting if instance.is_accepted is None else
-                FriendshipStatus.rejected
-            ),
+            'friend_sender': user_representation(instance.user_sender_id, instance.user_sender.username),
+            'friend_recipient': user_representation(instance.user_recipient_id, instance.user_recipient.username),
+            'status': relation_status(instance.is_accepted),
             'created_at': instance.created_at,
             'updated_at': instance.updated_at,
         }
         return representation
 
 
+class FriendshipRelationRowSerializer(serializers.Serializer):
+    """
+    Read-only fast path for relation lists.
+
+    Takes `.values(*RELATION_ROW_FIELDS)` rows instead of model instances and builds the same
+    representation as FriendshipRelationSerializer without any field machinery per row.
+    """
+
+    def to_representation(self, row):
+        representation = {
+            'id': row['id'],
+            'friend_sender': user_representation(row['user_sender_id'], row['user_sender__username']),
+            'friend_recipient': user_representation(row['user_recipient_id'], row['user_recipient__username']),
+            'status': relation_status(row['is_accepted']),
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        }
+        return representation
+
+
 class FriendshipAcceptSerializer(serializers.ModelSerializer):
 
     is_accepted = serializers.BooleanField(
@@ -92,8 +155,8 @@ class FriendshipAcceptSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         representation = {
             'id': instance.id,
-            'friend_sender': UserSerializer(instance.user_sender).data,
-            'friend_recipient': UserSerializer(instance.user_recipient).data,
+            'friend_sender': user_representation(instance.user_sender_id, instance.user_sender.username),
+            'friend_recipient': user_representation(instance.user_recipient_id, instance.user_recipient.username),
             'friendship': (
                 FriendshipStatus.accepted if instance.is_accepted is True else
                 FriendshipStatus.rejected,
@@ -101,3 +164,76 @@ class FriendshipAcceptSerializer(serializers.ModelSerializer):
             'updated_at': instance.updated_at,
         }
         return representation
+
+
+class FriendRecommendationSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = FriendRecommendation
+        fields = ('candidate', 'mutual_friends')
+
+    def to_representation(self, instance):
+        representation = {
+            'user': user_representation(instance.candidate_id, instance.candidate.username),
+            'mutual_friends': instance.mutual_friends,
+        }
+        return representation
+
+
+class FriendshipPathQuerySerializer(serializers.Serializer):
+
+    max_depth = serializers.IntegerField(
+        min_value=1,
+        max_value=settings.PATH_MAX_DEPTH,
+        default=settings.PATH_MAX_DEPTH,
+        help_text='Longest friendship path to look for.',
+    )
+
+
+class FriendshipExportQuerySerializer(serializers.Serializer):
+
+    export_format = serializers.ChoiceField(
+        choices=('ndjson', 'csv'),
+        default='ndjson',
+        help_text='ndjson: a relation as JSON per line | csv: a relation per row, after a header row.',
+    )
+
+
+class FriendshipBulkRequestSerializer(serializers.Serializer):
+
+    users = serializers.ListField(
+        child=serializers.UUIDField(),
+        min_length=1,
+        max_length=settings.BULK_REQUESTS_LIMIT,
+        label='Friendship requests to users',
+        help_text='Pass here ids of users to be requested.',
+    )
+
+    def validate_users(self, value):
+        if len(set(value)) != len(value):
+            raise ValidationError('User ids must be unique.')
+        return value
+
+
+class FriendshipBulkAnswerItemSerializer(serializers.Serializer):
+
+    id = serializers.UUIDField(label='Friendship request')
+    is_accepted = serializers.BooleanField(
+        required=True,
+        label='Friendship request processing',
+        help_text='Accept: true | Reject: false',
+    )
+
+
+class FriendshipBulkAnswerSerializer(serializers.Serializer):
+
+    requests = FriendshipBulkAnswerItemSerializer(
+        many=True,
+        allow_empty=False,
+        max_length=settings.BULK_REQUESTS_LIMIT,
+    )
+
+    def validate_requests(self, value):
+        if len({item['id'] for item in value}) != len(value):
+            raise ValidationError('Friendship request ids must be unique.')
+        return value
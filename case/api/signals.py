@@ -0,0 +1,91 @@
+from functools import partial
+
+from app.models import FriendshipRelation, User
+from app.signals import relations_bulk_saved
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import adjacency, cache, events
+
+
+@receiver(post_save, sender=FriendshipRelation)
+@receiver(post_delete, sender=FriendshipRelation)
+def invalidate_cached_relation(sender, instance, **kwargs):
+    cache.invalidate_relation(instance.user_sender_id, instance.user_recipient_id)
+
+
+@receiver(relations_bulk_saved, sender=FriendshipRelation)
+def invalidate_cached_relations(sender, created, updated, **kwargs):
+    for relation in created + updated:
+        cache.invalidate_relation(relation.user_sender_id, relation.user_recipient_id)
+
+
+def update_adjacency_index(relation, is_friendship):
+    update = adjacency.index.link if is_friendship else adjacency.index.unlink
+    transaction.on_commit(partial(update, relation.user_sender_id, relation.user_recipient_id))
+
+
+@receiver(post_save, sender=FriendshipRelation)
+def update_adjacency_index_on_save(sender, instance, created, **kwargs):
+    if instance.is_accepted or not created:
+        update_adjacency_index(instance, bool(instance.is_accepted))
+
+
+@receiver(post_delete, sender=FriendshipRelation)
+def update_adjacency_index_on_delete(sender, instance, **kwargs):
+    update_adjacency_index(instance, False)
+
+
+@receiver(relations_bulk_saved, sender=FriendshipRelation)
+def update_adjacency_index_on_bulk_save(sender, created, updated, **kwargs):
+    for relation in [relation for relation in created if relation.is_accepted] + updated:
+        update_adjacency_index(relation, bool(relation.is_accepted))
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user(sender, instance, update_fields=None, **kwargs):
+    previous_username = None
+    if update_fields is None or 'username' in update_fields:
+        # Users not loaded by User.from_db nor saved before have no previous username.
+        previous_username = vars(instance).get('_loaded_username')
+        instance._loaded_username = instance.username
+    cache.invalidate_user(instance, previous_username=previous_username)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    cache.invalidate_user(instance)
+
+
+def publish_relation_event(event_type, relation):
+    event = events.relation_event(event_type, relation)
+    for user_id in (relation.user_sender_id, relation.user_recipient_id):
+        events.publish_on_commit(user_id, event)
+
+
+def publish_answer(relation):
+    publish_relation_event(events.REQUEST_ACCEPTED if relation.is_accepted else events.REQUEST_REJECTED, relation)
+
+
+@receiver(post_save, sender=FriendshipRelation)
+def publish_saved_relation(sender, instance, created, **kwargs):
+    if created and instance.is_accepted is None:
+        publish_relation_event(events.REQUEST_RECEIVED, instance)
+    elif not created and instance.is_accepted is not None:
+        publish_answer(instance)
+
+
+@receiver(relations_bulk_saved, sender=FriendshipRelation)
+def publish_bulk_saved_relations(sender, created, updated, **kwargs):
+    for relation in created:
+        if relation.is_accepted is None:
+            publish_relation_event(events.REQUEST_RECEIVED, relation)
+    for relation in updated:
+        publish_answer(relation)
+
+
+@receiver(post_delete, sender=FriendshipRelation)
+def publish_removed_friendship(sender, instance, **kwargs):
+    if instance.is_accepted:
+        publish_relation_event(events.FRIENDSHIP_REMOVED, instance)
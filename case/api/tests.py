@@ -1,13 +1,47 @@
+import asyncio
+import csv
+import json
+import os
+import tempfile
+from array import array
 from http import HTTPStatus
-
-from app.models import FriendshipRelation, User
-from django.test import RequestFactory, TestCase
+from io import StringIO
+from itertools import islice
+from unittest import mock, skipUnless
+
+from app import timing
+from app.middleware import ReadYourWritesMiddleware
+from app.models import (FriendshipChange, FriendshipEdge, FriendshipRelation,
+                        FriendshipTombstone, User)
+from app.postgresql_pool.pool import ConnectionPool
+from app.routers import get_state, pin_key
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from config import schema
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from . import adjacency, events, paths
+from .authentication import StatelessJWTAuthentication
+from .cache import get_user_id, relation_key
 from .enums import FriendshipStatus
-from .views import (FriendshipRequestViewSet, FriendshipViewSet,
-                    GetRelationView, RegistrationView)
+from .management.commands import bench_endpoints
+from .serializers import (RELATION_ROW_FIELDS, FriendshipRelationRowSerializer,
+                          FriendshipRelationSerializer,
+                          TokenObtainPairWithClaimsSerializer, UserSerializer)
+from .views import (REJECTED_RECENTLY, DatabasePoolMetricsView,
+                    FriendRecommendationView, FriendshipPathView,
+                    FriendshipRequestViewSet, FriendshipViewSet,
+                    GetRelationView, MutualFriendsView, RegistrationView,
+                    UserCountersView)
 
 
 class BaseViewTest(TestCase):
@@ -25,6 +59,8 @@ class BaseViewTest(TestCase):
         cls.test_user = User.objects.create(username='test_user')
 
     def setUp(self):
+        cache.clear()
+        adjacency.index.clear()
         token = RefreshToken.for_user(self.test_user).access_token
         self.headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
 
@@ -134,6 +170,7 @@ class FriendshipRequestCreateViewSetTest(BaseViewTest):
         self.assertEqual(response.status_code, HTTPStatus.CREATED)
         self.assertEqual(FriendshipRelation.objects.count(), 1)
         self.assertTrue(relation.is_accepted)
+        self.assertEqual(FriendshipEdge.objects.filter(relation=relation).count(), 2)
 
     def test_bad_self_friendship_request(self):
         """
@@ -169,6 +206,24 @@ class FriendshipRequestCreateViewSetTest(BaseViewTest):
         self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
         self.assertEqual(FriendshipRelation.objects.count(), 1)
 
+    def test_bad_friendship_request_rejected_recently(self):
+        """
+        Authenticated user is not able to repeat a rejected request until the cooldown ends.
+        """
+
+        relation = FriendshipRelation.objects.create(user_sender=self.test_user, user_recipient=self.user1)
+        FriendshipRelation.objects.archive([relation], FriendshipTombstone.Outcome.REJECTED)
+        request = self.factory.post(
+            self.url,
+            {'request_friendship_to_user': self.user1.id},
+            content_type='application/json',
+            **self.headers,
+        )
+        response = self.view.as_view({'post': 'create'})(request)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(response.data, [REJECTED_RECENTLY])
+        self.assertEqual(FriendshipRelation.objects.count(), 0)
+
     def test_bad_unauthorized_user_friendship_request(self):
         """
         Anonymous user is not able to create friendship request.
@@ -244,11 +299,8 @@ class FriendshipRequestReadViewSetTest(BaseViewTest):
             is_accepted=None,
         ) for user in users_objects[2:4]]
         FriendshipRelation.objects.bulk_create(outgoing)
-        FriendshipRelation.objects.create(
-            user_sender=cls.test_user,
-            user_recipient=users_objects[4],
-            is_accepted=False,
-        )
+        rejected = FriendshipRelation.objects.create(user_sender=cls.test_user, user_recipient=users_objects[4])
+        FriendshipRelation.objects.archive([rejected], FriendshipTombstone.Outcome.REJECTED)
         FriendshipRelation.objects.create(
             user_sender=cls.test_user,
             user_recipient=users_objects[5],
@@ -264,7 +316,7 @@ class FriendshipRequestReadViewSetTest(BaseViewTest):
         )
         response = self.view.as_view({'get': 'list'})(request)
         self.assertEqual(response.status_code, HTTPStatus.OK)
-        self.assertEqual(len(response.data), 4)
+        self.assertEqual(len(response.data['results']), 4)
 
     def test_list_with_query_params(self):
         """Testing clean list action with query params."""
@@ -281,14 +333,14 @@ class FriendshipRequestReadViewSetTest(BaseViewTest):
         response_out = self.view.as_view({'get': 'list'})(request_out)
         self.assertEqual(response_in.status_code, HTTPStatus.OK)
         self.assertEqual(response_out.status_code, HTTPStatus.OK)
-        self.assertEqual(len(response_in.data), 2)
-        self.assertEqual(len(response_out.data), 2)
+        self.assertEqual(len(response_in.data['results']), 2)
+        self.assertEqual(len(response_out.data['results']), 2)
         self.assertEqual(
-            set([pk['friend_recipient']['id'] for pk in response_in.data]),
+            set([pk['friend_recipient']['id'] for pk in response_in.data['results']]),
             set([str(self.test_user.pk)],)
         )
         self.assertEqual(
-            set([pk['friend_sender']['id'] for pk in response_out.data]),
+            set([pk['friend_sender']['id'] for pk in response_out.data['results']]),
             set([str(self.test_user.pk)],)
         )
 
@@ -332,6 +384,29 @@ class FriendshipRequestUpdateViewSetTest(BaseViewTest):
         self.friendship_request.refresh_from_db()
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertTrue(self.friendship_request.is_accepted)
+        self.assertEqual(
+            set(FriendshipEdge.objects.values_list('user', 'friend')),
+            {(self.user1.pk, self.test_user.pk), (self.test_user.pk, self.user1.pk)},
+        )
+
+    def test_reject_friendship_request(self):
+        """
+        Rejected request is answered and moved out of the relations to a tombstone.
+        """
+
+        request = self.factory.put(
+            reverse('requests-detail', kwargs={'pk': self.friendship_request.id}),
+            {'is_accepted': 'false'},
+            content_type='application/json',
+            **self.headers,
+        )
+        response = self.view.as_view({'put': 'update'})(request, pk=self.friendship_request.id)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data['friendship'], (FriendshipStatus.rejected,))
+        self.assertFalse(FriendshipRelation.objects.exists())
+        tombstone = FriendshipTombstone.objects.get(pk=self.friendship_request.pk)
+        self.assertEqual(tombstone.outcome, FriendshipTombstone.Outcome.REJECTED)
+        self.assertEqual(User.objects.get(pk=self.test_user.pk).incoming_pending_count, 0)
 
     def test_bad_sender_updates_friendship_request(self):
         """
@@ -365,6 +440,153 @@ class FriendshipRequestUpdateViewSetTest(BaseViewTest):
         self.assertIsNone(self.friendship_request.is_accepted)
 
 
+class FriendshipRequestBulkViewSetTest(BaseViewTest):
+    """
+    Testing bulk creation and accept/reject of friendship requests.
+    """
+
+    url = reverse('requests-bulk')
+    view = FriendshipRequestViewSet
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user1, cls.user2, cls.user3 = User.objects.bulk_create(
+            [User(username=f'user{i}') for i in range(1, 4)]
+        )
+
+    def test_bulk_create_friendship_requests(self):
+        """
+        New requests are created, a pending incoming one is accepted, failed items are reported.
+        """
+
+        incoming = FriendshipRelation.objects.create(user_sender=self.user2, user_recipient=self.test_user)
+        FriendshipRelation.objects.create(user_sender=self.test_user, user_recipient=self.user3)
+        missing = '00000000-0000-4000-8000-000000000000'
+        request = self.factory.post(
+            self.url,
+            {'users': [self.user1.id, self.user2.id, self.user3.id, missing, self.test_user.id]},
+            content_type='application/json',
+            **self.headers,
+        )
+        response = self.view.as_view({'post': 'bulk_create'})(request)
+        incoming.refresh_from_db()
+        results = response.data['results']
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual([str(item['user']) for item in results], [
+            str(self.user1.id), str(self.user2.id), str(self.user3.id), missing, str(self.test_user.id),
+        ])
+        self.assertEqual(results[0]['relation']['status'], FriendshipStatus.waiting)
+        self.assertEqual(results[1]['relation']['status'], FriendshipStatus.accepted)
+        self.assertEqual(results[2]['error'], 'Relation with this user already exists.')
+        self.assertEqual(results[3]['error'], 'User does not exist.')
+        self.assertIn('error', results[4])
+        self.assertTrue(FriendshipRelation.objects.filter(
+            user_sender=self.test_user,
+            user_recipient=self.user1,
+            is_accepted=None,
+        ).exists())
+        self.assertTrue(incoming.is_accepted)
+        self.assertEqual(FriendshipEdge.objects.filter(relation=incoming).count(), 2)
+        self.assertEqual(FriendshipRelation.objects.count(), 3)
+
+    def test_bulk_create_in_constant_queries(self):
+        """
+        Number of queries doesn't depend on the batch size.
+        """
+
+        request = self.factory.post(
+            self.url,
+            {'users': [self.user1.id, self.user2.id, self.user3.id]},
+            content_type='application/json',
+            **self.headers,
+        )
+        # user, savepoint, users, relations, recent rejections, insert, inserted ids, recipients and sender
+        # counters, release
+        with self.assertNumQueries(10):
+            response = self.view.as_view({'post': 'bulk_create'})(request)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(FriendshipRelation.objects.count(), 3)
+
+    def test_bad_bulk_create_with_duplicate_users(self):
+        """
+        Batch with repeated user ids is rejected as a whole.
+        """
+
+        request = self.factory.post(
+            self.url,
+            {'users': [self.user1.id, self.user1.id]},
+            content_type='application/json',
+            **self.headers,
+        )
+        response = self.view.as_view({'post': 'bulk_create'})(request)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(FriendshipRelation.objects.count(), 0)
+
+    def test_bulk_update_friendship_requests(self):
+        """
+        Recipient accepts and rejects incoming requests, outgoing and unknown ones are reported.
+        """
+
+        accepted = FriendshipRelation.objects.create(user_sender=self.user1, user_recipient=self.test_user)
+        rejected = FriendshipRelation.objects.create(user_sender=self.user2, user_recipient=self.test_user)
+        outgoing = FriendshipRelation.objects.create(user_sender=self.test_user, user_recipient=self.user3)
+        missing = '00000000-0000-4000-8000-000000000000'
+        request = self.factory.patch(
+            self.url,
+            {'requests': [
+                {'id': accepted.id, 'is_accepted': True},
+                {'id': rejected.id, 'is_accepted': False},
+                {'id': outgoing.id, 'is_accepted': True},
+                {'id': missing, 'is_accepted': True},
+            ]},
+            content_type='application/json',
+            **self.headers,
+        )
+        response = self.view.as_view({'patch': 'bulk_update'})(request)
+        results = response.data['results']
+        for relation in (accepted, outgoing):
+            relation.refresh_from_db()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(results[0]['relation']['friendship'], (FriendshipStatus.accepted,))
+        self.assertEqual(results[1]['relation']['friendship'], (FriendshipStatus.rejected,))
+        self.assertEqual(results[2]['error'], 'Only recipient can accept or reject friendship!')
+        self.assertEqual(results[3]['error'], 'Friendship request not found.')
+        self.assertTrue(accepted.is_accepted)
+        self.assertFalse(FriendshipRelation.objects.filter(pk=rejected.pk).exists())
+        self.assertEqual(FriendshipTombstone.objects.get(pk=rejected.pk).outcome, FriendshipTombstone.Outcome.REJECTED)
+        self.assertIsNone(outgoing.is_accepted)
+        self.assertEqual(
+            set(FriendshipEdge.objects.values_list('user', 'friend')),
+            {(self.user1.pk, self.test_user.pk), (self.test_user.pk, self.user1.pk)},
+        )
+
+    def test_bulk_update_invalidates_cached_relation(self):
+        """
+        Cached relation is dropped when a request is answered in bulk.
+        """
+
+        relation = FriendshipRelation.objects.create(user_sender=self.user1, user_recipient=self.test_user)
+        cache.set(relation_key(self.test_user.pk, self.user1.pk), {'status': FriendshipStatus.waiting})
+        request = self.factory.patch(
+            self.url,
+            {'requests': [{'id': relation.id, 'is_accepted': True}]},
+            content_type='application/json',
+            **self.headers,
+        )
+        self.view.as_view({'patch': 'bulk_update'})(request)
+        self.assertIsNone(cache.get(relation_key(self.test_user.pk, self.user1.pk)))
+
+    def test_bad_anonymous_user_bulk_requests(self):
+        """
+        Anonymous user is not able to use bulk endpoints.
+        """
+
+        request = self.factory.post(self.url, {'users': [self.user1.id]}, content_type='application/json')
+        response = self.view.as_view({'post': 'bulk_create'})(request)
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
 class FriendshipViewTest(BaseViewTest):
     """
     Testing the capabilities to have list and destroy actions with accepted friendships.
@@ -401,26 +623,62 @@ class FriendshipViewTest(BaseViewTest):
         )
         response = self.view.as_view({'get': 'list'})(request)
         self.assertEqual(response.status_code, HTTPStatus.OK)
-        self.assertEqual(len(response.data), 6)
+        self.assertEqual(len(response.data['results']), 6)
 
     def test_list_accepted_only_friendships(self):
         """
-        Friendships are only accepted friendship requests.
+        Friendships are only accepted friendship requests, not pending or rejected ones.
         """
 
-        user = User.objects.create(username='rejected_user')
         FriendshipRelation.objects.create(
             user_sender=self.test_user,
-            user_recipient=user,
-            is_accepted=False,
+            user_recipient=User.objects.create(username='pending_user'),
         )
+        rejected = FriendshipRelation.objects.create(
+            user_sender=self.test_user,
+            user_recipient=User.objects.create(username='rejected_user'),
+        )
+        FriendshipRelation.objects.archive([rejected], FriendshipTombstone.Outcome.REJECTED)
         request = self.factory.get(
             reverse('friendships-list'),
             **self.headers,
         )
         response = self.view.as_view({'get': 'list'})(request)
         self.assertEqual(response.status_code, HTTPStatus.OK)
-        self.assertEqual(len(response.data), 6)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_list_friendships_by_cursor_pages(self):
+        """
+        Cursor pages walk all friendships newest first without gaps or repeats, in both directions.
+        """
+
+        def get_page(url):
+            response = self.view.as_view({'get': 'list'})(self.factory.get(url, **self.headers))
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            return response.data
+
+        first_page = get_page(reverse('friendships-list') + '?page_size=4')
+        second_page = get_page(first_page['next'])
+        back_page = get_page(second_page['previous'])
+        ids = [item['id'] for item in first_page['results'] + second_page['results']]
+        self.assertEqual(len(first_page['results']), 4)
+        self.assertEqual(len(second_page['results']), 2)
+        self.assertIsNone(first_page['previous'])
+        self.assertIsNone(second_page['next'])
+        self.assertEqual(ids, [friendship.id for friendship in reversed(self.friendships)])
+        self.assertEqual(back_page['results'], first_page['results'])
+
+    def test_bad_list_friendships_with_invalid_cursor(self):
+        """
+        A malformed cursor is rejected.
+        """
+
+        request = self.factory.get(
+            reverse('friendships-list') + '?cursor=cD1sb2w=',
+            **self.headers,
+        )
+        response = self.view.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
 
     def test_destroy_friendship_instance(self):
         """
@@ -434,6 +692,84 @@ class FriendshipViewTest(BaseViewTest):
         response = self.view.as_view({'delete': 'destroy'})(request, pk=self.friendships[0].pk)
         self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
         self.assertEqual(FriendshipRelation.objects.count(), 5)
+        self.assertEqual(FriendshipEdge.objects.count(), 10)
+        tombstone = FriendshipTombstone.objects.get(pk=self.friendships[0].pk)
+        self.assertEqual(tombstone.outcome, FriendshipTombstone.Outcome.REMOVED)
+
+    def test_export_friendships_as_ndjson(self):
+        """
+        Export streams a JSON line per friendship, the same as in the list.
+        """
+
+        request = self.factory.get(reverse('friendships-export'), **self.headers)
+        with override_settings(EXPORT_CHUNK_SIZE=4):
+            response = self.view.as_view({'get': 'export'})(request)
+            chunks = list(response.streaming_content)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertEqual(len(chunks), 2)
+        lines = b''.join(chunks).decode().splitlines()
+        request = self.factory.get(reverse('friendships-list'), **self.headers)
+        listed = self.view.as_view({'get': 'list'})(request).render()
+        self.assertCountEqual([json.loads(line) for line in lines], json.loads(listed.content)['results'])
+
+    def test_export_friendships_as_csv(self):
+        """
+        Export streams a CSV row per friendship after the header row.
+        """
+
+        request = self.factory.get(reverse('friendships-export') + '?export_format=csv', **self.headers)
+        response = self.view.as_view({'get': 'export'})(request)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertCountEqual([row['id'] for row in rows], [str(friendship.id) for friendship in self.friendships])
+        self.assertEqual({row['recipient_username'] for row in rows}, {self.test_user.username})
+        self.assertEqual({row['status'] for row in rows}, {FriendshipStatus.accepted.value})
+
+    async def test_export_friendships_under_asgi(self):
+        """
+        Under ASGI the export is an async stream, Django would read a plain one to the end first.
+        """
+
+        with override_settings(EXPORT_CHUNK_SIZE=4):
+            response = await self.async_client.get(
+                reverse('friendships-export'), headers={'Authorization': self.headers['HTTP_AUTHORIZATION']},
+            )
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response]
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(len(b''.join(chunks).decode().splitlines()), 6)
+
+    def test_bad_export_friendships_format(self):
+        request = self.factory.get(reverse('friendships-export') + '?export_format=xml', **self.headers)
+        response = self.view.as_view({'get': 'export'})(request)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_export_relations_command(self):
+        """
+        The command exports every relation, or the friendships of one user, in chunks.
+        """
+
+        FriendshipRelation.objects.create(
+            user_sender=self.test_user, user_recipient=User.objects.create(username='pending_user'),
+        )
+        out = StringIO()
+        call_command('export_relations', chunk_size=2, stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 7)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'friendships.csv')
+            call_command(
+                'export_relations', user='user1', export_format='csv', output=path, stdout=StringIO(),
+            )
+            with open(path, newline='') as file:
+                rows = list(csv.DictReader(file))
+        self.assertEqual([row['id'] for row in rows], [str(self.friendships[0].id)])
+
+        with self.assertRaises(CommandError):
+            call_command('export_relations', user='nobody', stdout=StringIO())
 
 
 class GetRelationViewTest(BaseViewTest):
@@ -449,7 +785,7 @@ class GetRelationViewTest(BaseViewTest):
         5 users: 1 base, 4 extra.
         4 relations:
             Accepted friendship - self.test_user to user1;
-            Rejected friendship - self.test_user to user2;
+            Requested friendship, rejected by the test of rejection - self.test_user to user2;
             Requested friendship - self.test_user to user3;
             None - self.test_user and user4;
         """
@@ -467,7 +803,7 @@ class GetRelationViewTest(BaseViewTest):
         FriendshipRelation.objects.create(
             user_sender=cls.test_user,
             user_recipient=cls.user_objects[1],
-            is_accepted=False,
+            is_accepted=None,
         )
         FriendshipRelation.objects.create(
             user_sender=cls.test_user,
@@ -490,16 +826,37 @@ class GetRelationViewTest(BaseViewTest):
 
     def test_get_rejected_relation_with_user(self):
         """
-        Testing the rejected friendship case.
+        A rejected request leaves no relation, and can not be repeated until the cooldown ends.
         """
 
+        recipient = self.user_objects[1]
+        relation = FriendshipRelation.objects.get(user_recipient=recipient)
+        token = RefreshToken.for_user(recipient).access_token
+        request = self.factory.put(
+            reverse('requests-detail', kwargs={'pk': relation.pk}),
+            {'is_accepted': 'false'},
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+        response = FriendshipRequestViewSet.as_view({'put': 'update'})(request, pk=relation.pk)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
         request = self.factory.get(
-            reverse('relations-detail', kwargs={'username': self.user_objects[1].username}),
+            reverse('relations-detail', kwargs={'username': recipient.username}),
             **self.headers,
         )
-        response = GetRelationView.as_view()(request, username=self.user_objects[1].username)
-        self.assertEqual(response.status_code, HTTPStatus.OK)
-        self.assertEqual(response.data['status'], FriendshipStatus.rejected)
+        response = GetRelationView.as_view()(request, username=recipient.username)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+        request = self.factory.post(
+            reverse('requests-list'),
+            {'request_friendship_to_user': recipient.pk},
+            content_type='application/json',
+            **self.headers,
+        )
+        response = FriendshipRequestViewSet.as_view({'post': 'create'})(request)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(response.data, [REJECTED_RECENTLY])
 
     def test_get_requested_only_relation_with_user(self):
         """
@@ -537,3 +894,1091 @@ class GetRelationViewTest(BaseViewTest):
         )
         response = GetRelationView.as_view()(request, username='lol')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_relation_is_cached(self):
+        """
+        Repeated relation check is served from cache, only the auth lookup hits the database.
+        """
+
+        username = self.user_objects[0].username
+        request = self.factory.get(
+            reverse('relations-detail', kwargs={'username': username}),
+            **self.headers,
+        )
+        first_response = GetRelationView.as_view()(request, username=username)
+        with self.assertNumQueries(1):
+            second_response = GetRelationView.as_view()(request, username=username)
+        self.assertEqual(second_response.status_code, HTTPStatus.OK)
+        self.assertEqual(second_response.data, first_response.data)
+
+    def test_renamed_user_is_not_found_by_previous_username(self):
+        """
+        After a rename the cached id of the previous username is dropped.
+        """
+
+        user = User.objects.get(pk=self.user_objects[0].pk)
+        previous_username = user.username
+        self.assertEqual(get_user_id(previous_username), user.pk)
+        user.username = 'renamed_user'
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertIsNone(get_user_id(previous_username))
+        self.assertEqual(get_user_id('renamed_user'), user.pk)
+
+    def test_save_without_rename_reads_nothing(self):
+        """
+        A rename is told from the username the user was loaded with, a save only writes.
+        """
+
+        user = User.objects.get(pk=self.user_objects[0].pk)
+        user.first_name = 'name'
+        with self.assertNumQueries(1), self.captureOnCommitCallbacks() as callbacks:
+            user.save()
+        self.assertEqual(callbacks, [])
+
+    def test_cached_relation_is_invalidated_on_accept(self):
+        """
+        Accepting a friendship request replaces the cached waiting status.
+        """
+
+        user = self.user_objects[2]
+        request = self.factory.get(
+            reverse('relations-detail', kwargs={'username': user.username}),
+            **self.headers,
+        )
+        response = GetRelationView.as_view()(request, username=user.username)
+        self.assertEqual(response.data['status'], FriendshipStatus.waiting)
+
+        relation = FriendshipRelation.objects.get(user_sender=self.test_user, user_recipient=user)
+        token = RefreshToken.for_user(user).access_token
+        accept_request = self.factory.put(
+            reverse('requests-detail', kwargs={'pk': relation.id}),
+            {'is_accepted': 'true'},
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+        FriendshipRequestViewSet.as_view({'put': 'update'})(accept_request, pk=relation.id)
+        response = GetRelationView.as_view()(request, username=user.username)
+        self.assertEqual(response.data['status'], FriendshipStatus.accepted)
+
+
+class MutualFriendsViewTest(BaseViewTest):
+    """
+    Testing the capability to get friends shared with user.
+    """
+
+    view = MutualFriendsView
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Relations dataset setup.
+
+        5 users: 1 base, 4 extra.
+        user1 is the other user, user2 and user3 are friends of both,
+        user4 is a friend of self.test_user only and has a pending request from user1.
+        """
+
+        super().setUpTestData()
+        cls.user1, cls.user2, cls.user3, cls.user4 = User.objects.bulk_create(
+            [User(username=f'user{i}') for i in range(1, 5)]
+        )
+        for sender, recipient, is_accepted in (
+            (cls.test_user, cls.user2, True),
+            (cls.user3, cls.test_user, True),
+            (cls.test_user, cls.user4, True),
+            (cls.user1, cls.user2, True),
+            (cls.user1, cls.user3, True),
+            (cls.user1, cls.user4, None),
+        ):
+            FriendshipRelation.objects.create(user_sender=sender, user_recipient=recipient, is_accepted=is_accepted)
+
+    def get_mutual(self, username='user1'):
+        request = self.factory.get(reverse('relations-mutual', kwargs={'username': username}), **self.headers)
+        return self.view.as_view()(request, username=username)
+
+    def test_list_mutual_friends(self):
+        """
+        Only accepted friends of both users are listed.
+        """
+
+        response = self.get_mutual()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            {user['username'] for user in response.data['results']},
+            {'user2', 'user3'},
+        )
+
+    def test_mutual_friends_are_served_from_index(self):
+        """
+        Friend lists are loaded once, repeated lookups only query users.
+        """
+
+        self.get_mutual()
+        with self.assertNumQueries(2):
+            response = self.get_mutual()
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_index_follows_accepted_and_deleted_friendships(self):
+        """
+        Accepting and deleting friendships updates the index without reloading friend lists.
+        """
+
+        self.get_mutual()
+        relation = FriendshipRelation.objects.get(user_sender=self.user1, user_recipient=self.user4)
+        with self.captureOnCommitCallbacks(execute=True):
+            relation.is_accepted = True
+            relation.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            FriendshipRelation.objects.get(user_sender=self.user1, user_recipient=self.user2).delete()
+        with self.assertNumQueries(2):
+            response = self.get_mutual()
+        self.assertEqual(
+            {user['username'] for user in response.data['results']},
+            {'user3', 'user4'},
+        )
+
+    def test_index_frees_ids_of_evicted_lists(self):
+        """
+        Only users of the lists kept stay interned, evicted lists release theirs.
+        """
+
+        index = adjacency.index
+        with mock.patch.object(index, 'max_users', 1):
+            self.get_mutual()
+            self.get_mutual('user2')
+        kept = {index._user_ids[i] for i in index._entries}
+        kept.update(index._user_ids[i] for entry in index._entries.values() for i in entry.ids)
+        self.assertEqual(len(index._entries), 1)
+        self.assertEqual(set(index._ids), kept)
+        self.assertEqual(len(index._ids) + len(index._free), len(index._user_ids))
+
+    def test_mutual_friends_without_index(self):
+        """
+        With the index off mutual friends are found in the database.
+        """
+
+        with mock.patch.object(adjacency.index, 'max_users', 0):
+            response = self.get_mutual()
+        self.assertEqual(
+            {user['username'] for user in response.data['results']},
+            {'user2', 'user3'},
+        )
+
+    def test_get_mutual_friends_with_unexisted_user(self):
+        response = self.get_mutual('user5')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class NeighboursIntersectionTest(SimpleTestCase):
+    """
+    Testing intersections of friend lists of the adjacency index.
+    """
+
+    def intersect(self, a, b):
+        return adjacency.Neighbours(array('q', a), 0).intersection(adjacency.Neighbours(array('q', b), 0))
+
+    def test_intersection_of_similar_lists(self):
+        self.assertEqual(self.intersect([1, 3, 5, 7], [3, 4, 5, 6]), [3, 5])
+
+    def test_intersection_of_skewed_lists(self):
+        self.assertEqual(self.intersect([4, 500], range(0, 1000, 2)), [4, 500])
+
+    def test_updates_keep_lists_sorted(self):
+        neighbours = adjacency.Neighbours(array('q', [2, 4]), 0)
+        neighbours.add(3)
+        neighbours.add(3)
+        neighbours.remove(2)
+        neighbours.remove(5)
+        self.assertEqual(list(neighbours.ids), [3, 4])
+
+
+class FriendshipPathViewTest(BaseViewTest):
+    """
+    Testing the capability to find how users are connected.
+    """
+
+    view = FriendshipPathView
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Relations dataset setup.
+
+        Chain of friendships self.test_user - user1 - user2 - user3,
+        a shortcut user1 - user4 - user3 one step longer and user5 with a pending request only.
+        """
+
+        super().setUpTestData()
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(1, 6)])
+        for sender, recipient, is_accepted in (
+            (cls.test_user, users[0], True),
+            (users[1], users[0], True),
+            (users[1], users[2], True),
+            (users[0], users[3], True),
+            (users[3], users[4], True),
+            (users[4], users[2], True),
+            (cls.test_user, users[4], None),
+        ):
+            FriendshipRelation.objects.create(user_sender=sender, user_recipient=recipient, is_accepted=is_accepted)
+
+    def get_path(self, username, query=''):
+        request = self.factory.get(
+            reverse('relations-path', kwargs={'username': username}) + query,
+            **self.headers,
+        )
+        return self.view.as_view()(request, username=username)
+
+    def test_get_shortest_path(self):
+        """
+        Shortest path is returned, one query per searched level.
+        """
+
+        # user, username lookup, 3 levels, usernames
+        with self.assertNumQueries(6):
+            response = self.get_path('user3')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data['degree'], 3)
+        self.assertEqual(
+            [user['username'] for user in response.data['path']],
+            ['test_user', 'user1', 'user2', 'user3'],
+        )
+
+    def test_pending_requests_are_not_a_path(self):
+        response = self.get_path('user5')
+        self.assertEqual(response.data['degree'], 3)
+
+    def test_bad_path_longer_than_max_depth(self):
+        response = self.get_path('user3', '?max_depth=2')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_bad_max_depth_over_limit(self):
+        response = self.get_path('user3', '?max_depth=100')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_get_path_to_unexisted_user(self):
+        response = self.get_path('user6')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class ShortestPathTest(SimpleTestCase):
+    """
+    Testing the bidirectional search on in-memory graphs.
+    """
+
+    def expand(self, graph):
+        def expand(user_ids, limit):
+            self.expanded.append(len(user_ids))
+            pairs = ((user_id, friend_id) for user_id in user_ids for friend_id in graph.get(user_id, ()))
+            for self.read, pair in enumerate(islice(pairs, limit), 1):
+                yield pair
+        self.expanded = []
+        return expand
+
+    def graph(self, *edges):
+        graph = {}
+        for a, b in edges:
+            graph.setdefault(a, []).append(b)
+            graph.setdefault(b, []).append(a)
+        return graph
+
+    def test_path_on_a_ring(self):
+        graph = self.graph(*[(n, (n + 1) % 10) for n in range(10)])
+        path = paths.shortest_path(0, 4, 10, self.expand(graph), 100, 1)
+        self.assertEqual(path, [0, 1, 2, 3, 4])
+        self.assertEqual(len(self.expanded), 4)
+
+    def test_unreachable_user(self):
+        graph = self.graph((0, 1), (2, 3))
+        self.assertIsNone(paths.shortest_path(0, 3, 10, self.expand(graph), 100, 1))
+
+    def test_smaller_frontier_is_expanded(self):
+        graph = self.graph(*[(0, n) for n in range(1, 50)], (1, 100))
+        self.assertEqual(paths.shortest_path(0, 100, 2, self.expand(graph), 100, 1), [0, 1, 100])
+        self.assertEqual(self.expanded, [1, 1])
+
+    def test_frontier_limit(self):
+        graph = self.graph(*[(0, n) for n in range(1, 50)], *[(100, n) for n in range(50, 100)])
+        with self.assertRaises(paths.PathSearchLimitExceeded):
+            paths.shortest_path(0, 100, 4, self.expand(graph), 10, 1)
+
+    def test_edge_limit_within_a_level(self):
+        """
+        A frontier holding a hub is read up to the edge limit, not to the end of its friendships.
+        """
+
+        graph = self.graph((0, 1), *[(1, n) for n in range(2, 10_000)], (9_999, 20_000))
+        with self.assertRaises(paths.PathSearchLimitExceeded):
+            paths.shortest_path(0, 20_000, 6, self.expand(graph), 10, 1, max_edges=100)
+        self.assertEqual(self.read, 101)
+        self.assertEqual(paths.shortest_path(0, 20_000, 6, self.expand(graph), 10, 1, max_edges=20_000)[-1], 20_000)
+
+    def test_time_budget_within_a_level(self):
+        graph = self.graph(*[(0, n) for n in range(1, 1000)])
+        clock = mock.Mock(monotonic=mock.Mock(side_effect=[0, 0, *range(2, 1000)]))
+        with mock.patch.object(paths, 'time', clock):
+            with self.assertRaises(paths.PathSearchLimitExceeded):
+                paths.shortest_path(0, 5_000, 6, self.expand(graph), 10, 1, max_edges=10_000)
+        self.assertEqual(self.read, 1)
+
+
+class FriendRecommendationViewTest(BaseViewTest):
+    """
+    Testing the capability to get people you may know.
+    """
+
+    view = FriendRecommendationView
+    url = reverse('recommendations')
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Relations dataset setup.
+
+        self.test_user is a friend of user1 and user2.
+        user3 is a friend of both, user4 of user1 only, user5 of user2 only
+        and user5 has a pending request from self.test_user.
+        """
+
+        super().setUpTestData()
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(1, 6)])
+        for sender, recipient in (
+            (cls.test_user, users[0]),
+            (cls.test_user, users[1]),
+            (users[2], users[0]),
+            (users[2], users[1]),
+            (users[3], users[0]),
+            (users[4], users[1]),
+        ):
+            FriendshipRelation.objects.create(user_sender=sender, user_recipient=recipient, is_accepted=True)
+        FriendshipRelation.objects.create(user_sender=cls.test_user, user_recipient=users[4])
+        FriendshipChange.objects.process(batch_size=100)
+
+    def test_list_recommendations(self):
+        """
+        Non-friends are ranked by mutual friends, users with a pending request are left out.
+        """
+
+        request = self.factory.get(self.url, **self.headers)
+        with self.assertNumQueries(2):
+            response = self.view.as_view()(request)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            [(item['user']['username'], item['mutual_friends']) for item in response.data],
+            [('user3', 2), ('user4', 1)],
+        )
+
+    def test_recently_rejected_users_are_left_out(self):
+        """
+        A user who rejected a request either way is not recommended until the cooldown ends.
+        """
+
+        user4 = User.objects.get(username='user4')
+        relation = FriendshipRelation.objects.create(user_sender=user4, user_recipient=self.test_user)
+        FriendshipRelation.objects.archive([relation], FriendshipTombstone.Outcome.REJECTED)
+        request = self.factory.get(self.url, **self.headers)
+        response = self.view.as_view()(request)
+        self.assertEqual([item['user']['username'] for item in response.data], ['user3'])
+
+        with override_settings(REJECTION_COOLDOWN_SECONDS=0):
+            response = self.view.as_view()(request)
+        self.assertEqual([item['user']['username'] for item in response.data], ['user3', 'user4'])
+
+    def test_bad_anonymous_user_recommendations(self):
+        request = self.factory.get(self.url)
+        response = self.view.as_view()(request)
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class RelationETagTest(BaseViewTest):
+    """
+    Testing conditional GET of relation lists and relation status.
+    """
+
+    def setUp(self):
+        super().setUp()
+        token = TokenObtainPairWithClaimsSerializer.get_token(self.test_user).access_token
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        self.user1 = User.objects.create(username='user1')
+        self.relation = FriendshipRelation.objects.create(user_sender=self.user1, user_recipient=self.test_user)
+        authentication = {'authentication_classes': (StatelessJWTAuthentication,)}
+        self.requests_view = FriendshipRequestViewSet.as_view({'get': 'list'}, **authentication)
+        self.relation_view = GetRelationView.as_view(**authentication)
+
+    def get_requests(self, etag=None, query='?is_incoming=true'):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        request = self.factory.get(reverse('requests-list') + query, **self.headers, **headers)
+        return self.requests_view(request)
+
+    def test_not_modified_without_queries(self):
+        """
+        A poll with the ETag of the unchanged list gets 304 without touching the database.
+        """
+
+        response = self.get_requests()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('private', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            not_modified = self.get_requests(response['ETag'])
+        self.assertEqual(not_modified.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(not_modified.content, b'')
+
+    def test_etag_changes_with_relations(self):
+        """
+        A new request, an answer or another query string give a new ETag.
+        """
+
+        etag = self.get_requests()['ETag']
+        self.assertNotEqual(self.get_requests(query='?is_incoming=false')['ETag'], etag)
+
+        user2 = User.objects.create(username='user2')
+        FriendshipRelation.objects.create(user_sender=user2, user_recipient=self.test_user)
+        response = self.get_requests(etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self.relation.is_accepted = True
+        self.relation.save()
+        response = self.get_requests(etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_etag_changes_with_partner_username(self):
+        """
+        Renaming a user changes the ETags of their partners, the lists show the username.
+        """
+
+        etag = self.get_requests()['ETag']
+        self.user1.username = 'renamed_user'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user1.save()
+        response = self.get_requests(etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data['results'][0]['friend_sender']['username'], 'renamed_user')
+
+    def test_relation_not_modified(self):
+        url = reverse('relations-detail', kwargs={'username': self.user1.username})
+        response = self.relation_view(self.factory.get(url, **self.headers), username=self.user1.username)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        etag = response['ETag']
+
+        request = self.factory.get(url, HTTP_IF_NONE_MATCH=etag, **self.headers)
+        response = self.relation_view(request, username=self.user1.username)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+        self.relation.delete()
+        response = self.relation_view(request, username=self.user1.username)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class UserCountersViewTest(BaseViewTest):
+    """
+    Testing the counters of friends and pending requests of the current user.
+    """
+
+    view = UserCountersView
+    url = reverse('me-counters')
+
+    def get_counters(self):
+        request = self.factory.get(self.url, **self.headers)
+        response = self.view.as_view()(request)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response.data
+
+    def test_get_counters(self):
+        """
+        Counters follow requests made, answered and friendships destroyed through the API.
+        """
+
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(3)])
+        incoming = FriendshipRelation.objects.create(user_sender=users[0], user_recipient=self.test_user)
+        FriendshipRelation.objects.create(user_sender=users[1], user_recipient=self.test_user)
+        FriendshipRelation.objects.create(user_sender=self.test_user, user_recipient=users[2])
+        self.assertEqual(self.get_counters(), {
+            'friends_count': 0,
+            'incoming_pending_count': 2,
+            'outgoing_pending_count': 1,
+        })
+
+        request = self.factory.put(
+            reverse('requests-detail', kwargs={'pk': incoming.id}),
+            {'is_accepted': 'true'},
+            content_type='application/json',
+            **self.headers,
+        )
+        FriendshipRequestViewSet.as_view({'put': 'update'})(request, pk=incoming.id)
+        self.assertEqual(self.get_counters(), {
+            'friends_count': 1,
+            'incoming_pending_count': 1,
+            'outgoing_pending_count': 1,
+        })
+
+        request = self.factory.delete(reverse('friendships-detail', kwargs={'pk': incoming.id}), **self.headers)
+        response = FriendshipViewSet.as_view({'delete': 'destroy'})(request, pk=incoming.id)
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertEqual(self.get_counters()['friends_count'], 0)
+
+    def test_bad_anonymous_user_gets_counters(self):
+        response = self.view.as_view()(self.factory.get(self.url))
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class DatabasePoolMetricsViewTest(BaseViewTest):
+    """
+    Testing the connection pool metrics endpoint.
+    """
+
+    view = DatabasePoolMetricsView
+    url = reverse('metrics-db-pool')
+
+    def test_admin_gets_metrics(self):
+        self.test_user.is_staff = True
+        self.test_user.save()
+        pool = ConnectionPool(lambda connection: True, size=1, max_overflow=0, timeout=1)
+        with mock.patch.dict('app.postgresql_pool.pool._pools', {('default', ()): pool}, clear=True):
+            request = self.factory.get(self.url, **self.headers)
+            response = self.view.as_view()(request)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(set(response.data), {'default'})
+        self.assertEqual(response.data['default']['checkouts'], 0)
+
+    def test_bad_not_admin_metrics(self):
+        request = self.factory.get(self.url, **self.headers)
+        response = self.view.as_view()(request)
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+
+
+class ServerTimingTest(BaseViewTest):
+    """
+    Testing the per-request timing of sampled requests.
+    """
+
+    def setUp(self):
+        super().setUp()
+        timing.reset_timing_stats()
+        user = User.objects.create(username='user1')
+        FriendshipRelation.objects.create(user_sender=user, user_recipient=self.test_user, is_accepted=True)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    def test_sampled_request_timings(self):
+        """
+        A sampled request gets a Server-Timing header, a log line and is counted in the route histograms.
+        """
+
+        with self.assertLogs('app.timing', 'INFO') as logs, CaptureQueriesContext(connections['default']) as queries:
+            response = self.client.get(reverse('friendships-list'), **self.headers)
+        queries = len(queries)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        server_timing = response['Server-Timing']
+        self.assertIn('db;dur=', server_timing)
+        self.assertIn(f'desc="{queries} queries"', server_timing)
+        for name in ('serialize', 'render', 'total'):
+            self.assertIn(f'{name};dur=', server_timing)
+        self.assertIn(f'route=friendships-list method=GET status=200 queries={queries} ', logs.output[0])
+
+        self.test_user.is_staff = True
+        self.test_user.save()
+        response = self.client.get(reverse('metrics-timings'), **self.headers)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        histograms = response.json()['friendships-list']
+        self.assertEqual(histograms['total']['count'], 1)
+        self.assertEqual(histograms['queries']['sum'], queries)
+        self.assertEqual(histograms['total']['buckets']['+Inf'], 1)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    async def test_sampled_async_request_timings(self):
+        """
+        Under ASGI no middleware is adapted to sync and async views are timed too.
+        """
+
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+        with self.assertLogs('app.timing', 'INFO') as logs:
+            response = await self.async_client.get(
+                reverse('async-friendships-list'), headers={'Authorization': self.headers['HTTP_AUTHORIZATION']},
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('route=async-friendships-list method=GET status=200 ', logs.output[0])
+
+    def test_not_sampled_request(self):
+        response = self.client.get(reverse('friendships-list'), **self.headers)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(timing.timing_stats(), {})
+
+    def test_bad_not_admin_timing_metrics(self):
+        response = self.client.get(reverse('metrics-timings'), **self.headers)
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+
+
+@override_settings(DATABASE_REPLICA='replica')
+class ReadYourWritesTest(TransactionTestCase):
+    """
+    Testing that a user reads their own writes while others read from the replica.
+
+    The replica alias is a test mirror: a second connection to the test database.
+    """
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        adjacency.index.clear()
+        self.sender, self.recipient = User.objects.bulk_create([User(username='sender'), User(username='recipient')])
+        self.relation = FriendshipRelation.objects.create(user_sender=self.sender, user_recipient=self.recipient)
+        # Forget that the relation is new, as if the replica had long caught up.
+        cache.clear()
+
+    def get(self, user, url):
+        """Return the response and the number of queries to the primary and to the replica."""
+
+        token = RefreshToken.for_user(user).access_token
+        with CaptureQueriesContext(connections['default']) as primary:
+            with CaptureQueriesContext(connections['replica']) as replica:
+                response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response, len(primary), len(replica)
+
+    def test_user_reads_own_writes_from_primary(self):
+        url = reverse('friendships-list')
+        _, primary, replica = self.get(self.recipient, url)
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+        token = RefreshToken.for_user(self.recipient).access_token
+        response = self.client.put(
+            reverse('requests-detail', kwargs={'pk': self.relation.pk}),
+            {'is_accepted': 'true'},
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+        response, primary, replica = self.get(self.recipient, url)
+        self.assertEqual(len(response.data['results']), 1)
+        # Only the user lookup of the authentication runs before the pin is known.
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 1)
+
+        # The sender's list changed too, it is read from the primary while the replica may lag.
+        _, primary, _ = self.get(self.sender, url)
+        self.assertGreater(primary, 0)
+
+        cache.clear()
+        _, primary, _ = self.get(self.recipient, url)
+        self.assertEqual(primary, 0)
+
+    async def test_async_request_pins_user(self):
+        """
+        In an async middleware chain the middleware stays async and pins the user after a write.
+        """
+
+        async def view(request):
+            get_state().wrote = True
+            return HttpResponse()
+
+        middleware = ReadYourWritesMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        request = RequestFactory().post('/')
+        request.user = self.recipient
+        await middleware(request)
+        self.assertTrue(await cache.aget(pin_key(self.recipient.pk)))
+
+
+class SchemaViewTest(TestCase):
+    """
+    Testing the OpenAPI schema served once generated.
+    """
+
+    url = reverse('schema-swagger-ui')
+
+    def setUp(self):
+        schema._documents.clear()
+        self.addCleanup(schema._documents.clear)
+
+    def test_schema_is_generated_once(self):
+        with mock.patch('config.schema.generate_schema', wraps=schema.generate_schema) as generate:
+            response = self.client.get(self.url, {'format': 'openapi'})
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertEqual(response.json()['x-code-version'], schema.code_version())
+            self.assertIn('/friendships/', response.json()['paths'])
+            response = self.client.get(self.url, {'format': 'openapi'})
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(generate.call_count, 1)
+
+    def test_not_modified_with_etag(self):
+        etag = self.client.get(self.url, {'format': 'openapi'})['ETag']
+        response = self.client.get(self.url, {'format': 'openapi'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        response = self.client.get(self.url, {'format': 'openapi'}, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_schema_file_of_current_version_is_served(self):
+        """
+        The schema file is served as is if it was generated for the running code, ignored otherwise.
+        """
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'openapi.json')
+            with override_settings(OPENAPI_SCHEMA_FILE=path):
+                for version, expected in ((schema.code_version(), 'file'), ('old', None)):
+                    schema._documents.clear()
+                    with open(path, 'w') as file:
+                        json.dump({'x-code-version': version, 'source': 'file'}, file)
+                    response = self.client.get(self.url, {'format': 'openapi'})
+                    self.assertEqual(response.json().get('source'), expected)
+
+    def test_ui_page(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('text/html', response['Content-Type'])
+
+
+class AsyncViewsTest(BaseViewTest):
+    """
+    Testing the async read endpoints against their sync versions.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Relations dataset setup.
+
+        self.test_user is a friend of user1, requested user2 and is requested by user3.
+        """
+
+        super().setUpTestData()
+        cls.user1, cls.user2, cls.user3 = User.objects.bulk_create([User(username=f'user{i}') for i in range(1, 4)])
+        FriendshipRelation.objects.create(user_sender=cls.test_user, user_recipient=cls.user1, is_accepted=True)
+        FriendshipRelation.objects.create(user_sender=cls.test_user, user_recipient=cls.user2)
+        FriendshipRelation.objects.create(user_sender=cls.user3, user_recipient=cls.test_user)
+
+    def get_sync(self, view, url, **kwargs):
+        request = self.factory.get(url, **self.headers)
+        response = view(request, **kwargs)
+        return JSONRenderer().render(response.data)
+
+    async def get_async(self, url, **headers):
+        headers = {'Authorization': self.headers['HTTP_AUTHORIZATION'], **headers}
+        return await self.async_client.get(url, headers=headers)
+
+    async def test_async_lists_match_sync(self):
+        """
+        Async lists render the same JSON as the DRF views, filters included.
+        """
+
+        for name, view, query in (
+            ('friendships-list', FriendshipViewSet.as_view({'get': 'list'}), ''),
+            ('requests-list', FriendshipRequestViewSet.as_view({'get': 'list'}), ''),
+            ('requests-list', FriendshipRequestViewSet.as_view({'get': 'list'}), '?is_incoming=true'),
+        ):
+            expected = await sync_to_async(self.get_sync)(view, reverse(name) + query)
+            response = await self.get_async(reverse(f'async-{name}') + query)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertEqual(response.content, expected)
+
+    async def test_async_relation_matches_sync(self):
+        url = reverse('relations-detail', kwargs={'username': 'user1'})
+        expected = await sync_to_async(self.get_sync)(GetRelationView.as_view(), url, username='user1')
+        await sync_to_async(cache.clear)()
+        response = await self.get_async(reverse('async-relations-detail', kwargs={'username': 'user1'}))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.content, expected)
+
+    async def test_bad_async_relation_with_unexisted_user(self):
+        response = await self.get_async(reverse('async-relations-detail', kwargs={'username': 'user5'}))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    async def test_bad_async_invalid_cursor(self):
+        response = await self.get_async(reverse('async-friendships-list') + '?cursor=cD1sb2w=')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    async def test_bad_anonymous_user_async_list(self):
+        response = await self.async_client.get(reverse('async-friendships-list'))
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        response = await self.async_client.get(reverse('async-friendships-list'), headers={'Authorization': 'Bearer x'})
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class EventBrokerTest(SimpleTestCase):
+    """
+    Testing the in-process fan-out of friendship events.
+    """
+
+    async def test_events_reach_subscriptions_of_user(self):
+        broker = events.Broker()
+        first, second, other = broker.subscribe('user'), broker.subscribe('user'), broker.subscribe('other')
+        # Published from another thread, like the commit of a sync view.
+        await sync_to_async(broker.publish)('user', {'type': events.REQUEST_RECEIVED})
+        self.assertEqual(await first.get(1), {'type': events.REQUEST_RECEIVED})
+        self.assertEqual(await second.get(1), {'type': events.REQUEST_RECEIVED})
+        self.assertIsNone(await other.get(0.01))
+
+        for subscription in (first, second, other):
+            broker.unsubscribe(subscription)
+        self.assertEqual(broker.subscriptions, {})
+
+    @override_settings(EVENTS_QUEUE_SIZE=2)
+    async def test_slow_subscription_overflows(self):
+        """
+        Events beyond EVENTS_QUEUE_SIZE are dropped and the subscription is marked to resync.
+        """
+
+        broker = events.Broker()
+        subscription = broker.subscribe('user')
+        for number in range(3):
+            broker.publish('user', {'number': number})
+        await asyncio.sleep(0)
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(subscription.queue.qsize(), 2)
+
+
+class RedisBrokerTest(SimpleTestCase):
+    """
+    Testing the Redis broker against a fake client, on connection errors.
+    """
+
+    class RedisError(Exception):
+        pass
+
+    class Stop(Exception):
+        pass
+
+    def setUp(self):
+        client = mock.Mock()
+        redis = mock.Mock(RedisError=self.RedisError)
+        redis.Redis.from_url.return_value = client
+        with mock.patch.dict('sys.modules', redis=redis):
+            self.broker = events.RedisBroker('redis://')
+        self.client = client
+
+    def test_publish_error_is_logged(self):
+        self.client.publish.side_effect = self.RedisError
+        with self.assertLogs('api.events', 'ERROR'):
+            self.broker.publish('user', {'type': events.REQUEST_RECEIVED})
+
+    @mock.patch.object(events, 'RECONNECT_SECONDS', 0)
+    async def test_listener_subscribes_again(self):
+        """
+        A dropped channel marks the streams to resync, and events flow again once subscribed anew.
+        """
+
+        # Without starting the listener thread of the broker, it is run below.
+        subscription = events.Broker.subscribe(self.broker, 'user')
+        lost = mock.Mock()
+        lost.listen.side_effect = self.RedisError
+        unavailable = mock.Mock()
+        unavailable.subscribe.side_effect = self.RedisError
+        restored = mock.Mock()
+        message = {'data': json.dumps({'user': 'user', 'event': {'type': events.REQUEST_RECEIVED}})}
+
+        def listen():
+            yield message
+            raise self.Stop
+
+        restored.listen.side_effect = listen
+        self.client.pubsub.side_effect = [unavailable, restored]
+        with self.assertLogs('api.events', 'WARNING') as logs, self.assertRaises(self.Stop):
+            self.broker.listen(lost)
+        self.assertEqual(len(logs.records), 2)
+        restored.subscribe.assert_called_once_with(events.CHANNEL)
+        lost.close.assert_called_once_with()
+        unavailable.close.assert_called_once_with()
+
+        self.assertIsNone(await subscription.get(1))
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(await subscription.get(1), {'type': events.REQUEST_RECEIVED})
+        self.broker.unsubscribe(subscription)
+
+
+class FriendshipEventsTest(BaseViewTest):
+    """
+    Testing friendship events published on changes and sent by the event stream.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user1 = User.objects.create(username='user1')
+
+    def published(self, change):
+        with mock.patch.object(events.get_broker(), 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                relation = change()
+        return relation, [(user_id, event['type']) for (user_id, event), _ in publish.call_args_list]
+
+    def test_events_of_changes(self):
+        """
+        Both users get an event after the commit of a request, an answer and a removal.
+        """
+
+        relation, published = self.published(
+            lambda: FriendshipRelation.objects.create(user_sender=self.user1, user_recipient=self.test_user),
+        )
+        users = [self.user1.pk, self.test_user.pk]
+        self.assertEqual(published, [(user_id, events.REQUEST_RECEIVED) for user_id in users])
+
+        def accept():
+            relation.is_accepted = True
+            relation.save()
+        _, published = self.published(accept)
+        self.assertEqual(published, [(user_id, events.REQUEST_ACCEPTED) for user_id in users])
+
+        _, published = self.published(relation.delete)
+        self.assertEqual(published, [(user_id, events.FRIENDSHIP_REMOVED) for user_id in users])
+
+    def test_rejected_request_event(self):
+        relation = FriendshipRelation.objects.create(user_sender=self.user1, user_recipient=self.test_user)
+        request = self.factory.put(
+            reverse('requests-detail', kwargs={'pk': relation.id}),
+            {'is_accepted': 'false'},
+            content_type='application/json',
+            **self.headers,
+        )
+        _, published = self.published(
+            lambda: FriendshipRequestViewSet.as_view({'put': 'update'})(request, pk=relation.id),
+        )
+        users = [self.user1.pk, self.test_user.pk]
+        self.assertEqual(published, [(user_id, events.REQUEST_REJECTED) for user_id in users])
+
+    @override_settings(EVENTS_KEEPALIVE_SECONDS=0.05, EVENTS_STREAM_SECONDS=0.2)
+    async def test_stream_sends_events(self):
+        """
+        The stream sends published events, keepalives when idle, and ends after EVENTS_STREAM_SECONDS.
+        """
+
+        response = await self.async_client.get(
+            reverse('async-events'), headers={'Authorization': self.headers['HTTP_AUTHORIZATION']},
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 3000\n\n')
+
+        event = {'type': events.REQUEST_RECEIVED, 'relation': 'id'}
+        events.get_broker().publish(self.test_user.pk, event)
+        self.assertEqual(await anext(chunks), f'event: request_received\ndata: {json.dumps(event)}\n\n'.encode())
+        self.assertEqual(await anext(chunks), b': keepalive\n\n')
+        self.assertEqual({chunk async for chunk in chunks}, {b': keepalive\n\n'})
+        self.assertEqual(events.get_broker().subscriptions, {})
+
+    async def test_bad_anonymous_user_stream(self):
+        response = await self.async_client.get(reverse('async-events'))
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'The graph is loaded with PostgreSQL COPY.')
+class BenchEndpointsTest(TestCase):
+    """
+    Testing the endpoint benchmark and its query budgets on a small synthetic graph.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_social_graph', users=100, relations=2000, stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+
+    def test_endpoints_within_budgets(self):
+        stdout = StringIO()
+        call_command('bench_endpoints', users=5, rounds=1, stdout=stdout)
+        output = stdout.getvalue()
+        for name in bench_endpoints.QUERY_BUDGETS:
+            self.assertIn(f'{name}: ', output)
+        self.assertIn('within their query budgets', output)
+
+    def test_bad_query_count_regression(self):
+        with mock.patch.dict(bench_endpoints.QUERY_BUDGETS, {'friendships-list': 0}):
+            with self.assertRaisesMessage(CommandError, 'friendships-list: 1 queries, budget 0'):
+                call_command('bench_endpoints', users=5, rounds=1, stdout=StringIO())
+
+
+class FriendshipRelationRowSerializerTest(TestCase):
+    """
+    Testing the fast-path relation list serialization.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(1, 4)])
+        cls.relations = [
+            FriendshipRelation.objects.create(user_sender=sender, user_recipient=recipient, is_accepted=status)
+            for sender, recipient, status in (
+                (users[0], users[1], None),
+                (users[0], users[2], True),
+                (users[1], users[2], False),
+            )
+        ]
+
+    def test_rows_render_as_nested_serializers(self):
+        """
+        Rows render to exactly the same bytes as relations with nested user serializers.
+        """
+
+        for relation in self.relations:
+            expected = JSONRenderer().render({
+                'id': relation.id,
+                'friend_sender': UserSerializer(relation.user_sender).data,
+                'friend_recipient': UserSerializer(relation.user_recipient).data,
+                'status': FriendshipRelationSerializer(relation).data['status'],
+                'created_at': relation.created_at,
+                'updated_at': relation.updated_at,
+            })
+            row = FriendshipRelation.objects.filter(pk=relation.pk).values(*RELATION_ROW_FIELDS).get()
+            self.assertEqual(JSONRenderer().render(FriendshipRelationRowSerializer(row).data), expected)
+            self.assertEqual(JSONRenderer().render(FriendshipRelationSerializer(relation).data), expected)
+
+
+class StatelessJWTAuthenticationTest(BaseViewTest):
+    """
+    Testing the authentication that builds the user from token claims.
+    """
+
+    view = FriendshipViewSet
+
+    def setUp(self):
+        super().setUp()
+        token = TokenObtainPairWithClaimsSerializer.get_token(self.test_user).access_token
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        self.list_view = self.view.as_view(
+            {'get': 'list'},
+            authentication_classes=(StatelessJWTAuthentication,),
+        )
+
+    def test_list_without_user_lookup(self):
+        """
+        Once the active flag is cached, listing friendships runs the list query only.
+        """
+
+        request = self.factory.get(reverse('friendships-list'), **self.headers)
+        self.list_view(request)
+        with self.assertNumQueries(1):
+            response = self.list_view(request)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_user_fields_are_loaded_lazily(self):
+        """
+        Fields missing from the token are fetched from the database on access.
+        """
+
+        user, _ = StatelessJWTAuthentication().authenticate(self.factory.get('/', **self.headers))
+        self.assertEqual(user, self.test_user)
+        self.assertEqual(user.username, self.test_user.username)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.date_joined, self.test_user.date_joined)
+
+    def test_bad_inactive_user(self):
+        """
+        Deactivated user is rejected even with a valid token.
+        """
+
+        request = self.factory.get(reverse('friendships-list'), **self.headers)
+        self.list_view(request)
+        self.test_user.is_active = False
+        self.test_user.save()
+        response = self.list_view(request)
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
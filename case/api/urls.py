@@ -3,8 +3,13 @@ from rest_framework.routers import SimpleRouter
 from rest_framework_simplejwt.views import (TokenObtainPairView,
                                             TokenRefreshView, TokenVerifyView)
 
-from .views import (FriendshipRequestViewSet, FriendshipViewSet,
-                    GetRelationView, RegistrationView)
+from .async_views import (AsyncFriendshipListView,
+                          AsyncFriendshipRequestListView, AsyncGetRelationView,
+                          FriendshipEventStreamView)
+from .views import (DatabasePoolMetricsView, FriendRecommendationView,
+                    FriendshipPathView, FriendshipRequestViewSet,
+                    FriendshipViewSet, GetRelationView, MutualFriendsView,
+                    RegistrationView, TimingMetricsView, UserCountersView)
 
 router = SimpleRouter()
 router.register('friendships', FriendshipViewSet, basename='friendships')
@@ -19,10 +24,25 @@ auth_patterns = [
 ]
 
 
+async_patterns = [
+    path('friendships/', AsyncFriendshipListView.as_view(), name='async-friendships-list'),
+    path('requests/', AsyncFriendshipRequestListView.as_view(), name='async-requests-list'),
+    path('relations/<str:username>/', AsyncGetRelationView.as_view(), name='async-relations-detail'),
+    path('events/', FriendshipEventStreamView.as_view(), name='async-events'),
+]
+
+
 urlpatterns = [
     path('v1/', include([
         path('auth/', include(auth_patterns)),
         path('', include(router.urls)),
+        path('async/', include(async_patterns)),
         path('relations/<str:username>/', GetRelationView.as_view(), name='relations-detail'),
+        path('relations/<str:username>/mutual/', MutualFriendsView.as_view(), name='relations-mutual'),
+        path('relations/<str:username>/path/', FriendshipPathView.as_view(), name='relations-path'),
+        path('recommendations/', FriendRecommendationView.as_view(), name='recommendations'),
+        path('me/counters/', UserCountersView.as_view(), name='me-counters'),
+        path('metrics/db-pool/', DatabasePoolMetricsView.as_view(), name='metrics-db-pool'),
+        path('metrics/timings/', TimingMetricsView.as_view(), name='metrics-timings'),
     ])),
 ]
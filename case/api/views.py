@@ -1,14 +1,45 @@
-from app.models import FriendshipRelation, User
-from django.db.models import Q
-from django.http import Http404
-from django.shortcuts import get_object_or_404
+import hashlib
+import time
+from functools import partial
+from http import HTTPStatus
+
+from app.models import (COUNTER_FIELDS, FriendRecommendation, FriendshipEdge,
+                        FriendshipRelation, FriendshipTombstone, User,
+                        ordered_pair)
+from app.postgresql_pool.pool import pool_stats
+from app.routers import use_primary
+from app.signals import relations_bulk_saved
+from app.timing import timed, timing_stats
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, UUIDField, Value
+from django.db.models.functions import Least
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
 from django_filters import rest_framework as filters
 from rest_framework import generics, mixins, viewsets
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from . import adjacency, cache, export, paths
 from .filters import FriendshipRequestFilter
-from .serializers import (FriendshipAcceptSerializer,
-                          FriendshipRelationSerializer, UserSerializer)
+from .serializers import (RELATION_ROW_FIELDS, FriendRecommendationSerializer,
+                          FriendshipAcceptSerializer,
+                          FriendshipBulkAnswerSerializer,
+                          FriendshipBulkRequestSerializer,
+                          FriendshipExportQuerySerializer,
+                          FriendshipPathQuerySerializer,
+                          FriendshipRelationRowSerializer,
+                          FriendshipRelationSerializer, UserCountersSerializer,
+                          UserSerializer, user_representation)
+
+REJECTED_RECENTLY = 'Friendship request was rejected recently, try again later.'
 
 
 class RegistrationView(generics.CreateAPIView):
@@ -21,19 +52,77 @@ class RegistrationView(generics.CreateAPIView):
     permission_classes = (AllowAny,)
 
 
+class RelationVersionETagMixin:
+    """
+    ETag of GET responses from the version of the user's relations, see `cache.get_relations_version`.
+
+    A request with a matching If-None-Match gets 304 before any query of the view runs.
+    """
+
+    def get_etag(self, request, version):
+        key = f'{version}:{request.user.pk}:{request.get_full_path()}:{request.accepted_media_type}'
+        return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        version, changed_at = cache.get_relations_version(request.user.pk)
+        etag = self.get_etag(request, version)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            # The replica may not have the change that made the version yet, the response must.
+            if settings.DATABASE_REPLICA and time.time() - changed_at < settings.REPLICA_PIN_SECONDS:
+                with use_primary():
+                    response = handler(request, *args, **kwargs)
+            else:
+                response = handler(request, *args, **kwargs)
+        if response.status_code in (HTTPStatus.OK, HTTPStatus.NOT_MODIFIED):
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+
+class RelationListModelMixin(RelationVersionETagMixin, mixins.ListModelMixin):
+    """
+    List relations from `.values()` rows through the fast-path row serializer, with an ETag.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.list_rows, *args, **kwargs)
+
+    def list_rows(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).values(*RELATION_ROW_FIELDS)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            with timed('serialize'):
+                data = FriendshipRelationRowSerializer(page, many=True).data
+            return self.get_paginated_response(data)
+        with timed('serialize'):
+            data = FriendshipRelationRowSerializer(queryset, many=True).data
+        return Response(data)
+
+
 class FriendshipRequestViewSet(
-    mixins.ListModelMixin,
+    RelationListModelMixin,
     mixins.CreateModelMixin,
     mixins.UpdateModelMixin,
     viewsets.GenericViewSet,
 ):
     """
     Handling of a friendship requests. Create new one, get all, accept/reject incoming.
+
+    `bulk/` does the same for up to BULK_REQUESTS_LIMIT users (POST) or requests (PATCH) at once,
+    in one transaction, and returns a result or an error per item.
     """
 
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = FriendshipRequestFilter
     permission_classes = (IsAuthenticated,)
+    serializer_classes = {
+        'update': FriendshipAcceptSerializer,
+        'partial_update': FriendshipAcceptSerializer,
+        'bulk_create': FriendshipBulkRequestSerializer,
+        'bulk_update': FriendshipBulkAnswerSerializer,
+    }
 
     def get_queryset(self):
         queryset = FriendshipRelation.objects.filter(
@@ -43,60 +132,346 @@ class FriendshipRequestViewSet(
         return queryset
 
     def get_serializer_class(self):
-        if self.action == 'update' or self.action == 'partial_update':
-            return FriendshipAcceptSerializer
-        return FriendshipRelationSerializer
+        return self.serializer_classes.get(self.action, FriendshipRelationSerializer)
 
     def perform_create(self, serializer):
-        mutual_request = FriendshipRelation.objects.filter(
-            user_sender=self.request.data.get('request_friendship_to_user'),
-            user_recipient=self.request.user,
-            is_accepted=None,
-        ).first()
-        if mutual_request:
-            mutual_request.is_accepted = True
-            mutual_request.save()
-            serializer.instance = mutual_request
-        else:
-            serializer.save(user_sender=self.request.user)
+        recipient_id = serializer.validated_data['user_recipient_id']
+        relation = FriendshipRelation.objects.request_friendship(self.request.user, recipient_id)
+        if relation is None:
+            if not User.objects.filter(pk=recipient_id).exists():
+                raise ValidationError('User does not exist.')
+            if FriendshipTombstone.objects.in_cooldown().filter(
+                user_sender=self.request.user, user_recipient=recipient_id,
+            ).exists():
+                raise ValidationError(REJECTED_RECENTLY)
+            raise ValidationError('Relation with this user already exists.')
+        serializer.instance = relation
+
+    def perform_update(self, serializer):
+        # Edges and counters are updated by the post_save receivers, in the same transaction.
+        # Rejected requests leave the relation table for FriendshipTombstone.
+        with transaction.atomic():
+            super().perform_update(serializer)
+            if serializer.instance.is_accepted is False:
+                FriendshipRelation.objects.archive([serializer.instance], FriendshipTombstone.Outcome.REJECTED)
+
+    @action(detail=False, methods=['post'], url_path='bulk', url_name='bulk')
+    def bulk_create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            results = self.perform_bulk_create(serializer.validated_data['users'])
+        return Response({'results': results})
+
+    @bulk_create.mapping.patch
+    def bulk_update(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        answers = {item['id']: item['is_accepted'] for item in serializer.validated_data['requests']}
+        with transaction.atomic():
+            results = self.perform_bulk_update(answers)
+        return Response({'results': results})
+
+    def perform_bulk_create(self, user_ids):
+        """
+        Request friendship with every user of `user_ids`, accepting their pending requests instead.
+
+        Users and existing relations of the whole batch are read with one query each, new relations
+        are inserted with one statement and accepted ones are updated with another.
+        """
+
+        user = self.request.user
+        users = User.objects.only('id', 'username').in_bulk(user_ids)
+        existing = {
+            relation.user_sender_id if relation.user_recipient_id == user.pk else relation.user_recipient_id: relation
+            for relation in FriendshipRelation.objects.filter(
+                Q(user_sender=user, user_recipient__in=user_ids) | Q(user_sender__in=user_ids, user_recipient=user),
+                owner_id__in={ordered_pair(user.pk, user_id)[0] for user_id in user_ids},
+            ).select_related('user_sender', 'user_recipient').select_for_update(of=('self',))
+        }
+        rejected = set(
+            FriendshipTombstone.objects.in_cooldown().filter(
+                user_sender=user, user_recipient__in=user_ids,
+            ).values_list('user_recipient', flat=True)
+        )
+
+        now = timezone.now()
+        created, accepted, errors = [], [], {}
+        for user_id in user_ids:
+            relation = existing.get(user_id)
+            if user_id == user.pk:
+                errors[user_id] = 'Impossible to make friendship request to yourself!'
+            elif user_id not in users:
+                errors[user_id] = 'User does not exist.'
+            elif relation is None and user_id in rejected:
+                errors[user_id] = REJECTED_RECENTLY
+            elif relation is None:
+                created.append(FriendshipRelation(user_sender=user, user_recipient=users[user_id]))
+            elif relation.user_sender_id == user_id and relation.is_accepted is None:
+                relation.is_accepted = True
+                relation.updated_at = now
+                accepted.append(relation)
+            else:
+                errors[user_id] = 'Relation with this user already exists.'
+
+        # A concurrent request may have created the pair since it was read: such rows are skipped
+        # by the unique constraint and reported as existing.
+        FriendshipRelation.objects.bulk_create(created, ignore_conflicts=True)
+        inserted = set(
+            FriendshipRelation.objects.filter(pk__in=[relation.pk for relation in created]).values_list('pk', flat=True)
+        )
+        created = [relation for relation in created if relation.pk in inserted]
+        FriendshipRelation.objects.bulk_update(accepted, ('is_accepted', 'updated_at'))
+        relations_bulk_saved.send(sender=FriendshipRelation, created=created, updated=accepted)
+
+        relations = {relation.user_recipient_id: relation for relation in created}
+        relations.update({relation.user_sender_id: relation for relation in accepted})
+        return [
+            {'user': user_id, 'relation': FriendshipRelationSerializer(relations[user_id]).data}
+            if user_id in relations else
+            {'user': user_id, 'error': errors.get(user_id, 'Relation with this user already exists.')}
+            for user_id in user_ids
+        ]
+
+    def perform_bulk_update(self, answers):
+        """
+        Accept or reject pending requests by `answers` of request id -> is_accepted.
+
+        Requests are locked and read with one query and saved with one update, rejected ones are
+        then moved to FriendshipTombstone with one more statement.
+        """
+
+        relations = self.get_queryset().select_for_update(of=('self',)).in_bulk(list(answers))
+        now = timezone.now()
+        updated, errors = [], {}
+        for pk, is_accepted in answers.items():
+            relation = relations.get(pk)
+            if relation is None:
+                errors[pk] = 'Friendship request not found.'
+            elif relation.user_recipient_id != self.request.user.pk:
+                errors[pk] = 'Only recipient can accept or reject friendship!'
+            else:
+                relation.is_accepted = is_accepted
+                relation.updated_at = now
+                updated.append(relation)
+
+        FriendshipRelation.objects.bulk_update(updated, ('is_accepted', 'updated_at'))
+        relations_bulk_saved.send(sender=FriendshipRelation, created=[], updated=updated)
+        FriendshipRelation.objects.archive(
+            [relation for relation in updated if relation.is_accepted is False], FriendshipTombstone.Outcome.REJECTED,
+        )
+        return [
+            {'request': pk, 'error': errors[pk]}
+            if pk in errors else
+            {'request': pk, 'relation': FriendshipAcceptSerializer(relations[pk]).data}
+            for pk in answers
+        ]
 
 
 class FriendshipViewSet(
-    mixins.ListModelMixin,
+    RelationListModelMixin,
     mixins.DestroyModelMixin,
     viewsets.GenericViewSet,
 ):
     """Handling of a accepted friendships. Get all, delete one."""
 
     serializer_class = FriendshipRelationSerializer
+    serializer_classes = {
+        'export': FriendshipExportQuerySerializer,
+    }
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
-        queryset = FriendshipRelation.objects.filter(
-            Q(user_sender=self.request.user) | Q(user_recipient=self.request.user),
-            is_accepted=True,
+        queryset = FriendshipRelation.objects.friendships_of(
+            self.request.user.pk,
         ).select_related('user_sender', 'user_recipient')
         return queryset
 
+    def get_serializer_class(self):
+        return self.serializer_classes.get(self.action, self.serializer_class)
+
+    def perform_destroy(self, instance):
+        FriendshipRelation.objects.archive([instance], FriendshipTombstone.Outcome.REMOVED)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request, *args, **kwargs):
+        """All friendships of the user in one streamed NDJSON or CSV file, see `api.export`."""
+
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        export_format = serializer.validated_data['export_format']
+        queryset = FriendshipRelation.objects.friendships_of(request.user.pk)
+        chunks = export.export_relations(queryset, export_format, settings.EXPORT_CHUNK_SIZE)
+        if isinstance(request._request, ASGIRequest):
+            chunks = export.async_chunks(chunks)
+        response = StreamingHttpResponse(
+            chunks,
+            content_type=f'{export.EXPORT_FORMATS[export_format]}; charset=utf-8',
+        )
+        response['Content-Disposition'] = f'attachment; filename="friendships.{export_format}"'
+        return response
+
 
 class GetRelationView(
+    RelationVersionETagMixin,
     generics.RetrieveAPIView,
 ):
     """
     Check relation with user by username as URL path parameter.
+
+    Username lookups and relation representations are cached until the relation changes.
     """
 
-    queryset = FriendshipRelation.objects.all()
+    queryset = FriendshipRelation.objects.select_related('user_sender', 'user_recipient')
     serializer_class = FriendshipRelationSerializer
     permission_classes = (IsAuthenticated,)
 
-    def get_object(self):
-        username = self.kwargs.get('username')
-        user = get_object_or_404(User, username=username)
-        relation = self.queryset.filter(
-            Q(user_sender=self.request.user, user_recipient=user) |
-            Q(user_sender=user, user_recipient=self.request.user)
-        ).first()
+    def get(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().get, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        user_id = cache.get_user_id(self.kwargs.get('username'))
+        if user_id is None:
+            raise Http404
+        representation = cache.get_relation(request.user.pk, user_id, partial(self.get_representation, user_id))
+        if representation == cache.NO_RELATION:
+            raise Http404
+        return Response(representation)
+
+    def get_representation(self, user_id):
+        relation = self.get_relation(user_id)
         if relation:
-            return relation
-        raise Http404
+            with timed('serialize'):
+                return dict(self.get_serializer(relation).data)
+        return None
+
+    def get_relation(self, user_id):
+        edge = FriendshipEdge.objects.filter(
+            user=self.request.user,
+            friend_id=user_id,
+            relation__owner_id=ordered_pair(self.request.user.pk, user_id)[0],
+        ).select_related('relation__user_sender', 'relation__user_recipient').first()
+        if edge:
+            return edge.relation
+        return self.queryset.between(self.request.user.pk, user_id).first()
+
+
+class MutualFriendsView(generics.ListAPIView):
+    """
+    Friends shared with user by username as URL path parameter.
+
+    Mutual friends are found in the in-process adjacency index, see `api.adjacency`.
+    """
+
+    serializer_class = UserSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        user_id = cache.get_user_id(self.kwargs.get('username'))
+        if user_id is None:
+            raise Http404
+        friend_ids = adjacency.mutual_friend_ids(self.request.user.pk, user_id)
+        return User.objects.filter(pk__in=friend_ids).only('id', 'username', 'created_at')
+
+
+class FriendshipPathView(generics.GenericAPIView):
+    """
+    Shortest friendship path to user by username as URL path parameter, up to `max_depth` friendships long.
+
+    See `api.paths` for the search and its limits.
+    """
+
+    serializer_class = FriendshipPathQuerySerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        max_depth = serializer.validated_data['max_depth']
+        user_id = cache.get_user_id(self.kwargs.get('username'))
+        if user_id is None:
+            raise Http404
+        try:
+            path = paths.shortest_path(request.user.pk, user_id, max_depth)
+        except paths.PathSearchLimitExceeded:
+            raise NotFound('Friendship path search limit exceeded.')
+        if path is None:
+            raise NotFound(f'No friendship path within {max_depth} steps.')
+        usernames = dict(User.objects.filter(pk__in=path).values_list('id', 'username'))
+        return Response({
+            'degree': len(path) - 1,
+            'path': [user_representation(user_id, usernames[user_id]) for user_id in path],
+        })
+
+
+class FriendRecommendationView(generics.ListAPIView):
+    """
+    People you may know: non-friends ranked by number of mutual friends.
+
+    Served from the FriendRecommendation table, kept up to date by `update_recommendations`.
+    Users with a pending request either way, or a request rejected within REJECTION_COOLDOWN_SECONDS,
+    are left out.
+    """
+
+    serializer_class = FriendRecommendationSerializer
+    permission_classes = (IsAuthenticated,)
+    pagination_class = None
+
+    def get_queryset(self):
+        user = self.request.user
+        either_way = (
+            Q(user_sender=user, user_recipient=OuterRef('candidate'))
+            | Q(user_sender=OuterRef('candidate'), user_recipient=user)
+        )
+        owner_id = Least(Value(user.pk, output_field=UUIDField()), OuterRef('candidate'))
+        queryset = FriendRecommendation.objects.filter(user=user).exclude(
+            Exists(FriendshipRelation.objects.filter(either_way, owner_id=owner_id)),
+        ).exclude(
+            Exists(FriendshipTombstone.objects.in_cooldown().filter(either_way)),
+        ).select_related('candidate').only(
+            'candidate__id', 'candidate__username', 'mutual_friends',
+        ).order_by('-mutual_friends', 'candidate')
+        return queryset
+
+
+class UserCountersView(generics.RetrieveAPIView):
+    """
+    Numbers of friends and of incoming and outgoing pending requests of the current user.
+
+    Read from the counters stored on User, see `app.signals.count_relations`.
+    """
+
+    serializer_class = UserCountersSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_object(self):
+        user = self.request.user
+        if user.get_deferred_fields().intersection(COUNTER_FIELDS):
+            user.refresh_from_db(fields=COUNTER_FIELDS)
+        return user
+
+
+class DatabasePoolMetricsView(APIView):
+    """
+    Connection pool metrics of the process serving the request, by database alias.
+
+    Checkout counts, time spent waiting for a free connection, timeouts and connections in use.
+    Empty unless the pooled backend is on (POSTGRES_POOL=1).
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, *args, **kwargs):
+        return Response(pool_stats())
+
+
+class TimingMetricsView(APIView):
+    """
+    Histograms of query count, database, serialization, rendering and total time of the sampled
+    requests of the process serving the request, by route. See `app.timing`.
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, *args, **kwargs):
+        return Response(timing_stats())
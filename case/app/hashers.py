@@ -0,0 +1,89 @@
+"""
+Password hashers with cost parameters from the settings, optionally run in a process pool.
+
+PASSWORD_HASHER picks the hasher of new hashes, the others stay listed in PASSWORD_HASHERS to
+verify older hashes. Django re-hashes a password on successful login whenever its hash was
+made by another hasher or with other cost parameters, so a policy change is picked up without
+a migration.
+
+With PASSWORD_HASHING_WORKERS above 0, hashing and verification run in a pool of that many
+processes: at most that many cores spend time on hashing however many requests arrive, and the
+GIL of the web worker is free meanwhile.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_worker = False
+
+
+def _init_worker():
+    global _in_worker
+    _in_worker = True
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned, not forked: the web worker may have threads holding locks.
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.PASSWORD_HASHING_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return _executor
+
+
+def _call(hasher, method, *args, **kwargs):
+    return getattr(super(OffloadedHasherMixin, hasher), method)(*args, **kwargs)
+
+
+class OffloadedHasherMixin:
+    """
+    Run `encode` and `verify` in the process pool when PASSWORD_HASHING_WORKERS is set.
+
+    The hasher instance is pickled to the worker with its cost parameters, so workers do not
+    need the Django settings.
+    """
+
+    def encode(self, password, salt, *args, **kwargs):
+        return self.run('encode', password, salt, *args, **kwargs)
+
+    def verify(self, password, encoded):
+        return self.run('verify', password, encoded)
+
+    def run(self, method, *args, **kwargs):
+        if _in_worker or not settings.PASSWORD_HASHING_WORKERS:
+            return _call(self, method, *args, **kwargs)
+        return get_executor().submit(_call, self, method, *args, **kwargs).result()
+
+
+class ScryptPasswordHasher(OffloadedHasherMixin, hashers.ScryptPasswordHasher):
+
+    def __init__(self):
+        self.work_factor = settings.PASSWORD_SCRYPT_WORK_FACTOR
+        self.block_size = settings.PASSWORD_SCRYPT_BLOCK_SIZE
+        self.parallelism = settings.PASSWORD_SCRYPT_PARALLELISM
+        # scrypt needs 128 * r * (N + p) bytes, OpenSSL refuses more than 32 MiB by default.
+        self.maxmem = 2 * 128 * self.block_size * (self.work_factor + self.parallelism)
+
+
+class Argon2PasswordHasher(OffloadedHasherMixin, hashers.Argon2PasswordHasher):
+    """Argon2id, needs the `argon2-cffi` package."""
+
+    def __init__(self):
+        self.time_cost = settings.PASSWORD_ARGON2_TIME_COST
+        self.memory_cost = settings.PASSWORD_ARGON2_MEMORY_COST
+        self.parallelism = settings.PASSWORD_ARGON2_PARALLELISM
+
+
+class PBKDF2PasswordHasher(OffloadedHasherMixin, hashers.PBKDF2PasswordHasher):
+
+    def __init__(self):
+        self.iterations = settings.PASSWORD_PBKDF2_ITERATIONS
@@ -0,0 +1,68 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.hashers import (Argon2PasswordHasher, PBKDF2PasswordHasher,
+                         ScryptPasswordHasher, _init_worker)
+from django.core.management.base import BaseCommand
+
+HASHERS = {
+    'scrypt': ScryptPasswordHasher,
+    'argon2': Argon2PasswordHasher,
+    'pbkdf2': PBKDF2PasswordHasher,
+}
+
+
+def verify_for(hasher, encoded, duration):
+    """Verify `encoded` in a loop for `duration` seconds, return the number of verifications."""
+
+    count = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        hasher.verify('benchmark password', encoded)
+        count += 1
+    return count
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure password verifications, the CPU cost of a login, per second on one core and on '
+        'all worker processes for the hashers with the configured costs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hashers', nargs='+', choices=list(HASHERS), default=list(HASHERS))
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per measurement.')
+
+    def handle(self, *args, **options):
+        duration, workers = options['duration'], options['workers']
+        for name in options['hashers']:
+            hasher = HASHERS[name]()
+            if hasher.library:
+                try:
+                    hasher._load_library()
+                except ValueError as error:
+                    self.stdout.write(f'{name}: skipped, {error}')
+                    continue
+            encoded = hasher.encode('benchmark password', hasher.salt())
+            summary = ', '.join(f'{key} {value}' for key, value in hasher.safe_summary(encoded).items()
+                                if key not in ('algorithm', 'salt', 'hash'))
+
+            single = self.run(hasher, encoded, duration, 1) / duration
+            total = self.run(hasher, encoded, duration, workers) / duration
+            self.stdout.write(
+                f'{name} ({summary}): {single:,.1f} logins/s on one core, '
+                f'{total:,.1f} logins/s on {workers} processes ({total / workers:,.1f} per process)'
+            )
+
+    def run(self, hasher, encoded, duration, workers):
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+        ) as executor:
+            # Warm the processes up first, so that start-up does not count.
+            list(executor.map(verify_for, [hasher] * workers, [encoded] * workers, [0] * workers))
+            return sum(executor.map(verify_for, [hasher] * workers, [encoded] * workers, [duration] * workers))
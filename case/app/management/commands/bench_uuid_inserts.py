@@ -0,0 +1,76 @@
+import time
+import uuid
+
+from app.models import FriendshipRelation, User
+from app.utils import uuid7
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+GENERATORS = {4: uuid.uuid4, 7: uuid7}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare insert throughput, WAL volume and primary key index size of v4 and v7 ids '
+        'on a scratch copy of the relation table with its primary key and foreign key indexes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Rows inserted per UUID version.')
+        parser.add_argument('--batch', type=int, default=1000, help='Rows per INSERT statement.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The insert benchmark runs on PostgreSQL only.')
+
+        users = list(User.objects.values_list('id', flat=True)[:1000])
+        if len(users) < 2:
+            raise CommandError('At least two users are needed to reference from relations.')
+
+        for version, generate in GENERATORS.items():
+            table = f'bench_uuid{version}_relation'
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE IF EXISTS {table}')
+                cursor.execute(
+                    f'CREATE TABLE {table} (LIKE {FriendshipRelation._meta.db_table} INCLUDING DEFAULTS)'
+                )
+                cursor.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id)')
+                cursor.execute(f'CREATE INDEX ON {table} (user_sender_id)')
+                cursor.execute(f'CREATE INDEX ON {table} (user_recipient_id)')
+                cursor.execute('SELECT pg_current_wal_lsn()')
+                (wal_start,) = cursor.fetchone()
+            try:
+                elapsed = self.insert(table, generate, users, options['rows'], options['batch'])
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s)', [wal_start])
+                    (wal_bytes,) = cursor.fetchone()
+                    cursor.execute(f"SELECT pg_relation_size('{table}_pkey')")
+                    (index_bytes,) = cursor.fetchone()
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP TABLE IF EXISTS {table}')
+            self.stdout.write(
+                f'uuid{version}: {options["rows"] / elapsed:,.0f} rows/s, '
+                f'WAL {int(wal_bytes) / 2 ** 20:,.1f} MiB, '
+                f'pkey {index_bytes / 2 ** 20:,.1f} MiB'
+            )
+
+    def insert(self, table, generate, users, rows, batch):
+        elapsed = 0.0
+        for start in range(0, rows, batch):
+            size = min(batch, rows - start)
+            ids = [str(generate()) for _ in range(size)]
+            senders = [str(users[(start + n) % len(users)]) for n in range(size)]
+            recipients = [str(users[(start + n + 1) % len(users)]) for n in range(size)]
+            started = time.perf_counter()
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f'''
+                    INSERT INTO {table} (id, created_at, updated_at, is_accepted, user_sender_id, user_recipient_id)
+                    SELECT id, now(), now(), NULL, sender, recipient
+                    FROM unnest(%s::uuid[], %s::uuid[], %s::uuid[]) AS batch (id, sender, recipient)
+                    ''',
+                    [ids, senders, recipients],
+                )
+            elapsed += time.perf_counter() - started
+        return elapsed
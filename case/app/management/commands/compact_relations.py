@@ -0,0 +1,27 @@
+import time
+
+from app.models import FriendshipRelation
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Move rejected relations left in the relation table to FriendshipTombstone, a batch per transaction '
+        'with a pause between batches, so the hot table is not locked for long. Rows locked by running '
+        'requests are skipped and picked up by the next run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000, help='Relations moved per transaction.')
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between batches.')
+
+    def handle(self, *args, **options):
+        moved = 0
+        while True:
+            count = FriendshipRelation.objects.compact(options['batch'])
+            if not count:
+                break
+            moved += count
+            self.stdout.write(f'Relations moved: {moved}')
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'{moved} rejected relations moved to tombstones.'))
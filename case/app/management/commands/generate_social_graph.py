@@ -0,0 +1,182 @@
+import io
+import random
+from itertools import accumulate
+
+from app.models import (FriendshipEdge, FriendshipRelation,
+                        FriendshipTombstone, User)
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+USER_CHUNK = 1_000_000
+
+
+class Command(BaseCommand):
+    help = (
+        'Load a synthetic friendship graph with a power-law degree distribution: `bench_<n>` users, '
+        'relations streamed with COPY a chunk per transaction, friendship edges and counters. '
+        'Low numbers get the most relations, `bench_1` is the biggest hub.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument(
+            '--relations', type=int, default=1_000_000, help='Relations to generate, rejected requests included.',
+        )
+        parser.add_argument('--pending', type=float, default=0.2, help='Share of pending requests.')
+        parser.add_argument('--rejected', type=float, default=0.05, help='Share of rejected requests.')
+        parser.add_argument(
+            '--exponent', type=float, default=2.5,
+            help='Exponent of the degree distribution, P(degree = k) ~ k^-exponent; lower makes bigger hubs.',
+        )
+        parser.add_argument('--chunk', type=int, default=100_000, help='Relations copied per transaction.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The graph is loaded with PostgreSQL COPY.')
+        if options['exponent'] <= 2:
+            raise CommandError('The exponent must be above 2.')
+        if options['pending'] + options['rejected'] > 1:
+            raise CommandError('Pending and rejected shares add up to more than 1.')
+
+        self.create_users(options['users'])
+        self.copy_relations(options)
+        self.link_edges()
+        call_command('reconcile_user_counters', chunk=10_000, stdout=io.StringIO())
+        self.stdout.write(self.style.SUCCESS(
+            f'Graph loaded: {User.objects.count():,} users, {FriendshipRelation.objects.count():,} relations, '
+            f'{FriendshipEdge.objects.count() // 2:,} friendships, '
+            f'{FriendshipTombstone.objects.filter(outcome=FriendshipTombstone.Outcome.REJECTED).count():,} rejected.'
+        ))
+
+    def create_users(self, users):
+        """Insert `bench_<n>` users with ids derived from `md5('bench_<n>')`, like `bench_list_indexes --seed`."""
+
+        for start in range(1, users + 1, USER_CHUNK):
+            stop = min(start + USER_CHUNK - 1, users)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f'''
+                    INSERT INTO {User._meta.db_table} (
+                        id, password, is_superuser, username, first_name, last_name, email, is_staff,
+                        is_active, date_joined, created_at, updated_at,
+                        friends_count, incoming_pending_count, outgoing_pending_count
+                    )
+                    SELECT md5('bench_' || n)::uuid, '', false, 'bench_' || n, '', '', '', false,
+                           true, now(), now(), now(), 0, 0, 0
+                    FROM generate_series(%s, %s) AS n
+                    ON CONFLICT DO NOTHING
+                    ''',
+                    [start, stop],
+                )
+            self.stdout.write(f'Users: {stop:,}/{users:,}')
+
+    def copy_relations(self, options):
+        """
+        Generate relations in chunks and COPY them through a staging table.
+
+        Both ends of a relation are drawn with probability proportional to n^(-1 / (exponent - 1))
+        (the Chung-Lu model), which gives a power-law degree distribution with that exponent.
+        Repeated pairs are skipped, so chunks are drawn until `--relations` are stored or a chunk adds
+        nothing new. Rejected requests go to FriendshipTombstone, like answered ones do, and the
+        relation table only gets pending and accepted relations.
+        """
+
+        rng = random.Random(options['seed'])
+        users, target, chunk = options['users'], options['relations'], options['chunk']
+        population = range(1, users + 1)
+        cum_weights = list(accumulate(n ** (-1 / (options['exponent'] - 1)) for n in population))
+        pending, rejected = options['pending'], options['pending'] + options['rejected']
+        relation_table = FriendshipRelation._meta.db_table
+        tombstone_table = FriendshipTombstone._meta.db_table
+
+        stored = 0
+        while stored < target:
+            size = min(chunk, target - stored)
+            senders = rng.choices(population, cum_weights=cum_weights, k=size)
+            recipients = rng.choices(population, cum_weights=cum_weights, k=size)
+            rows = io.StringIO()
+            for sender, recipient in zip(senders, recipients):
+                if sender != recipient:
+                    state = rng.random()
+                    is_accepted = r'\N' if state < pending else 'f' if state < rejected else 't'
+                    rows.write(f'{sender}\t{recipient}\t{is_accepted}\n')
+            rows.seek(0)
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    'CREATE TEMPORARY TABLE IF NOT EXISTS graph_staging '
+                    '(sender integer, recipient integer, is_accepted boolean)'
+                )
+                cursor.copy_expert('COPY graph_staging FROM STDIN', rows)
+                staged = '''
+                    SELECT md5('bench_' || sender)::uuid AS sender_id,
+                           md5('bench_' || recipient)::uuid AS recipient_id,
+                           is_accepted, now() - random() * interval '365 days' AS created_at
+                    FROM graph_staging
+                '''
+                cursor.execute(
+                    f'''
+                    INSERT INTO {relation_table} (
+                        id, created_at, updated_at, user_sender_id, user_recipient_id, owner_id, is_accepted
+                    )
+                    SELECT gen_random_uuid(), created_at, created_at, sender_id, recipient_id,
+                           LEAST(sender_id, recipient_id), is_accepted
+                    FROM ({staged}) AS staged
+                    WHERE is_accepted IS NOT false
+                    ON CONFLICT DO NOTHING
+                    '''
+                )
+                added = cursor.rowcount
+                cursor.execute(
+                    f'''
+                    INSERT INTO {tombstone_table} (
+                        id, created_at, updated_at, user_sender_id, user_recipient_id, outcome, archived_at
+                    )
+                    SELECT DISTINCT ON (sender_id, recipient_id)
+                           gen_random_uuid(), created_at, created_at, sender_id, recipient_id, %s, now()
+                    FROM ({staged}) AS staged
+                    WHERE is_accepted = false
+                      AND NOT EXISTS (
+                          SELECT FROM {relation_table} relation
+                          WHERE relation.owner_id = LEAST(sender_id, recipient_id)
+                            AND GREATEST(relation.user_sender_id, relation.user_recipient_id)
+                                = GREATEST(sender_id, recipient_id)
+                      )
+                      AND NOT EXISTS (
+                          SELECT FROM {tombstone_table} tombstone
+                          WHERE tombstone.user_sender_id = sender_id AND tombstone.user_recipient_id = recipient_id
+                      )
+                    ''',
+                    [FriendshipTombstone.Outcome.REJECTED],
+                )
+                added += cursor.rowcount
+                cursor.execute('TRUNCATE graph_staging')
+            stored += added
+            self.stdout.write(f'Relations and rejected requests: {stored:,}/{target:,}')
+            if not added:
+                self.stdout.write('No new pairs left to draw, stopping.')
+                break
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS graph_staging')
+
+    def link_edges(self):
+        relation_table = FriendshipRelation._meta.db_table
+        edge_table = FriendshipEdge._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            for user_column, friend_column in (
+                ('user_sender_id', 'user_recipient_id'),
+                ('user_recipient_id', 'user_sender_id'),
+            ):
+                cursor.execute(
+                    f'''
+                    INSERT INTO {edge_table} (id, created_at, updated_at, user_id, friend_id, relation_id)
+                    SELECT gen_random_uuid(), created_at, created_at, {user_column}, {friend_column}, id
+                    FROM {relation_table}
+                    WHERE is_accepted
+                    ON CONFLICT DO NOTHING
+                    '''
+                )
+            cursor.execute(f'ANALYZE {User._meta.db_table}, {relation_table}, {edge_table}')
+        self.stdout.write('Edges linked and tables analyzed.')
@@ -0,0 +1,60 @@
+from app.models import FriendshipEdge, FriendshipRelation
+from app.partitioning import PartitionSplit, get_partitions, partition_table
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+
+class Command(BaseCommand):
+    help = (
+        'Split the hash partitions of the relation and edge tables into --partitions partitions, a partition '
+        'at a time while it serves reads and writes, see `app.partitioning.PartitionSplit`. A table that is '
+        'not partitioned yet is partitioned first, locked while its rows are copied.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--partitions', type=int, required=True, help='Partitions of each table, a multiple of the current number.',
+        )
+        parser.add_argument(
+            '--lock-timeout', type=float, default=5,
+            help='Seconds to wait for the locks of a partition before starting and swapping it.',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Hash partitioning is PostgreSQL specific.')
+        partitions = options['partitions']
+        models = (FriendshipRelation, FriendshipEdge)
+        current = {model: get_partitions(connection, model._meta.db_table) for model in models}
+        for model, table_partitions in current.items():
+            for name, modulus, _ in table_partitions or ():
+                if partitions < modulus or partitions % modulus:
+                    raise CommandError(f'{name} has modulus {modulus}, --partitions must be a multiple of it.')
+
+        for model, table_partitions in current.items():
+            table = model._meta.db_table
+            if table_partitions is None:
+                with connection.schema_editor() as schema_editor:
+                    partition_table(schema_editor, model, partitions)
+                self.analyze(table)
+                self.stdout.write(f'{table}: partitioned into {partitions}.')
+                continue
+            smaller = [partition for partition in table_partitions if partition[1] != partitions]
+            for name, modulus, remainder in smaller:
+                split = PartitionSplit(connection, model, name, modulus, remainder, partitions)
+                try:
+                    split.prepare(options['lock_timeout'])
+                    copied = split.copy()
+                    split.validate()
+                    replayed = split.swap(options['lock_timeout'])
+                except OperationalError as error:
+                    raise CommandError(f'{name} was not split: {str(error).strip()}. Run the command again to retry.')
+                self.stdout.write(f'{name}: {copied} rows copied, {replayed} changed meanwhile copied again.')
+            if smaller:
+                self.analyze(table)
+        self.stdout.write(self.style.SUCCESS(f'Relation and edge tables have {partitions} partitions.'))
+
+    def analyze(self, table):
+        # Autovacuum analyzes the partitions only, the planner needs statistics of the whole table too.
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(table)}')
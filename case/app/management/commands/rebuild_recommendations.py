@@ -0,0 +1,26 @@
+from app.models import FriendRecommendation, User
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute friend recommendations of all users from the friendship edges, a chunk of users '
+        'per transaction, so memory and lock time do not grow with the graph. Changes queued meanwhile '
+        'are left to update_recommendations.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=1000, help='Users recomputed per transaction.')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id').values_list('id', flat=True)
+        last, rebuilt = None, 0
+        while True:
+            chunk = list((users.filter(id__gt=last) if last else users)[:options['chunk']])
+            if not chunk:
+                break
+            FriendRecommendation.objects.rebuild(chunk)
+            last = chunk[-1]
+            rebuilt += len(chunk)
+            self.stdout.write(f'Users: {rebuilt}')
+        self.stdout.write(self.style.SUCCESS(f'Recommendations of {rebuilt} users rebuilt.'))
@@ -0,0 +1,25 @@
+from app.models import User
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount the friend and pending request counters of all users and fix the ones that drifted, '
+        'a chunk of users per transaction, so only that many users are locked at a time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=1000, help='Users recounted per transaction.')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id').values_list('id', flat=True)
+        last, checked, fixed = None, 0, 0
+        while True:
+            chunk = list((users.filter(id__gt=last) if last else users)[:options['chunk']])
+            if not chunk:
+                break
+            fixed += User.objects.reconcile_counters(chunk)
+            last = chunk[-1]
+            checked += len(chunk)
+            self.stdout.write(f'Users: {checked}, fixed: {fixed}')
+        self.stdout.write(self.style.SUCCESS(f'Counters of {checked} users checked, {fixed} fixed.'))
@@ -0,0 +1,25 @@
+import time
+
+from app.models import FriendshipChange
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Update friend recommendations from the queue of changed friendships.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=500, help='Changes processed per transaction.')
+        parser.add_argument('--loop', action='store_true', help='Keep waiting for new changes.')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep on an empty queue.')
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            count = FriendshipChange.objects.process(options['batch'])
+            processed += count
+            if count:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(f'Processed {processed} friendship changes.')
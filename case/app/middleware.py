@@ -0,0 +1,97 @@
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .routers import routing_state
+from .timing import get_timings, observe, request_timings
+
+logger = logging.getLogger('app.timing')
+
+
+class ReadYourWritesMiddleware:
+    """
+    Give every request its own database routing state and pin its user to the primary
+    for REPLICA_PIN_SECONDS if the request wrote anything. See `app.routers`.
+
+    Sync and async: under ASGI the async views keep running on the event loop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routing_state(request) as state:
+            response = self.get_response(request)
+            state.pin()
+        return response
+
+    async def __acall__(self, request):
+        with routing_state(request) as state:
+            response = await self.get_response(request)
+            await state.apin()
+        return response
+
+
+class ServerTimingMiddleware:
+    """
+    Measure a SERVER_TIMING_SAMPLE_RATE share of the requests: add a `Server-Timing` header, log
+    a line and update the histograms of the route. See `app.timing`.
+
+    Sync and async, like ReadYourWritesMiddleware: it is the first of the chain.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= settings.SERVER_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        with request_timings() as timings:
+            response = self.get_response(request)
+        return self.record(request, response, timings)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.SERVER_TIMING_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        with request_timings() as timings:
+            response = await self.get_response(request)
+        return self.record(request, response, timings)
+
+    def record(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        route = request.resolver_match.url_name if request.resolver_match else None
+        response['Server-Timing'] = timings.server_timing(total)
+        observe(route or 'unmatched', timings, total)
+        logger.info(
+            'route=%s method=%s status=%s queries=%d db_ms=%.2f serialize_ms=%.2f render_ms=%.2f total_ms=%.2f',
+            route, request.method, response.status_code, timings.queries, timings.durations['db'] * 1000,
+            timings.durations['serialize'] * 1000, timings.durations['render'] * 1000, total * 1000,
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view, the callback runs right after rendering.
+        timings = get_timings()
+        if timings is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(lambda response: timings.add('render', time.perf_counter() - started))
+        return response
@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-18 14:53
+
+import uuid
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def link_accepted_relations(apps, schema_editor):
+    FriendshipRelation = apps.get_model('app', 'FriendshipRelation')
+    FriendshipEdge = apps.get_model('app', 'FriendshipEdge')
+    relations = FriendshipRelation.objects.filter(is_accepted=True).values_list(
+        'id', 'user_sender_id', 'user_recipient_id',
+    )
+    edges = []
+    for relation_id, sender_id, recipient_id in relations.iterator(chunk_size=2000):
+        edges.append(FriendshipEdge(user_id=sender_id, friend_id=recipient_id, relation_id=relation_id))
+        edges.append(FriendshipEdge(user_id=recipient_id, friend_id=sender_id, relation_id=relation_id))
+        if len(edges) >= 2000:
+            FriendshipEdge.objects.bulk_create(edges, ignore_conflicts=True)
+            edges = []
+    FriendshipEdge.objects.bulk_create(edges, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendshipEdge',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('friend', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Друг')),
+                ('relation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='edges', to='app.friendshiprelation', verbose_name='Дружба')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friend_edges', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'unique_together': {('user', 'friend')},
+            },
+        ),
+        migrations.RunPython(link_accepted_relations, migrations.RunPython.noop),
+    ]
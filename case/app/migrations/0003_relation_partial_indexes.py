@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 14:54
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # The relation table is hot, build the indexes without blocking writes.
+    atomic = False
+
+    dependencies = [
+        ('app', '0002_friendshipedge'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='friendshiprelation',
+            index=models.Index(condition=models.Q(('is_accepted__isnull', True)), fields=['user_recipient', 'created_at', 'id'], name='relation_pending_in_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='friendshiprelation',
+            index=models.Index(condition=models.Q(('is_accepted__isnull', True)), fields=['user_sender', 'created_at', 'id'], name='relation_pending_out_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='friendshiprelation',
+            index=models.Index(condition=models.Q(('is_accepted', True)), fields=['user_recipient', 'created_at', 'id'], name='relation_accepted_in_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='friendshiprelation',
+            index=models.Index(condition=models.Q(('is_accepted', True)), fields=['user_sender', 'created_at', 'id'], name='relation_accepted_out_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 15:03
+
+import app.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Python-side default only, no SQL is run. Existing rows keep their v4 ids,
+    new rows get v7 ids once UUID_VERSION=7 is set.
+    """
+
+    dependencies = [
+        ('app', '0003_relation_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='friendshipedge',
+            name='id',
+            field=models.UUIDField(default=app.utils.generate_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='friendshiprelation',
+            name='id',
+            field=models.UUIDField(default=app.utils.generate_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='id',
+            field=models.UUIDField(default=app.utils.generate_id, editable=False, primary_key=True, serialize=False),
+        ),
+    ]
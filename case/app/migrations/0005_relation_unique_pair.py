@@ -0,0 +1,87 @@
+# Generated by Django 4.2 on 2026-10-18 15:11
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+STATUS_PRIORITY = {True: 0, None: 1, False: 2}
+
+
+def drop_reverse_duplicates(apps, schema_editor):
+    """
+    Keep one relation per unordered user pair: accepted first, then pending, then the oldest.
+
+    Runs in its own transaction with writes to the relations locked out, so no pair is written
+    while the duplicates are looked for.
+    """
+
+    FriendshipRelation = apps.get_model('app', 'FriendshipRelation')
+    FriendshipEdge = apps.get_model('app', 'FriendshipEdge')
+    schema_editor.execute(f'LOCK TABLE "{FriendshipRelation._meta.db_table}" IN SHARE MODE')
+    reverse = FriendshipRelation.objects.filter(
+        user_sender=OuterRef('user_recipient'),
+        user_recipient=OuterRef('user_sender'),
+    )
+    pairs = {}
+    for relation in FriendshipRelation.objects.filter(Exists(reverse)).iterator():
+        pairs.setdefault(frozenset((relation.user_sender_id, relation.user_recipient_id)), []).append(relation)
+    for relations in pairs.values():
+        keep, *drop = sorted(relations, key=lambda relation: (STATUS_PRIORITY[relation.is_accepted], relation.created_at))
+        FriendshipRelation.objects.filter(pk__in=[relation.pk for relation in drop]).delete()
+        if keep.is_accepted:
+            FriendshipEdge.objects.bulk_create(
+                [
+                    FriendshipEdge(user_id=keep.user_sender_id, friend_id=keep.user_recipient_id, relation=keep),
+                    FriendshipEdge(user_id=keep.user_recipient_id, friend_id=keep.user_sender_id, relation=keep),
+                ],
+                ignore_conflicts=True,
+            )
+
+
+def drop_invalid_pair_index(apps, schema_editor):
+    """
+    Drop the index left INVALID by a failed concurrent build, e.g. on a duplicate written meanwhile,
+    so a rerun builds it again instead of keeping it.
+    """
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)', ['relation_unique_pair'])
+        row = cursor.fetchone()
+        if row is not None and not row[0]:
+            cursor.execute('DROP INDEX CONCURRENTLY "relation_unique_pair"')
+
+
+class Migration(migrations.Migration):
+
+    # The unique index is built concurrently, so the hot table is not locked.
+    atomic = False
+
+    dependencies = [
+        ('app', '0004_time_ordered_ids'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_reverse_duplicates, migrations.RunPython.noop, atomic=True),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(drop_invalid_pair_index, migrations.RunPython.noop),
+                # Skips only a valid index, an invalid one was just dropped.
+                migrations.RunSQL(
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "relation_unique_pair" '
+                    'ON "app_friendshiprelation" '
+                    '((LEAST("user_sender_id", "user_recipient_id")), (GREATEST("user_sender_id", "user_recipient_id")))',
+                    reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS "relation_unique_pair"',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='friendshiprelation',
+                    constraint=models.UniqueConstraint(django.db.models.functions.comparison.Least('user_sender', 'user_recipient'), django.db.models.functions.comparison.Greatest('user_sender', 'user_recipient'), name='relation_unique_pair'),
+                ),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='friendshiprelation',
+            unique_together=set(),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2 on 2026-10-18 15:23
+
+import app.utils
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_relation_unique_pair'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendRecommendation',
+            fields=[
+                ('id', models.UUIDField(default=app.utils.generate_id, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('mutual_friends', models.PositiveIntegerField(verbose_name='Общих друзей')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FriendshipChange',
+            fields=[
+                ('id', models.UUIDField(default=app.utils.generate_id, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user_id', models.UUIDField(verbose_name='Пользователь')),
+                ('friend_id', models.UUIDField(verbose_name='Друг')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='friendshipchange',
+            index=models.Index(fields=['created_at'], name='friendship_change_queue_idx'),
+        ),
+        migrations.AddField(
+            model_name='friendrecommendation',
+            name='candidate',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Рекомендуемый пользователь'),
+        ),
+        migrations.AddField(
+            model_name='friendrecommendation',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AddIndex(
+            model_name='friendrecommendation',
+            index=models.Index(fields=['user', '-mutual_friends', 'candidate'], name='recommendation_rank_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='friendrecommendation',
+            unique_together={('user', 'candidate')},
+        ),
+    ]
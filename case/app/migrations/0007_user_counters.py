@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 15:42
+
+import app.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_friend_recommendations'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', app.models.UserManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='friends_count',
+            field=models.IntegerField(default=0, verbose_name='Друзей'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='incoming_pending_count',
+            field=models.IntegerField(default=0, verbose_name='Входящих заявок'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='outgoing_pending_count',
+            field=models.IntegerField(default=0, verbose_name='Исходящих заявок'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-18 16:00
+
+import app.utils
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_user_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendshipTombstone',
+            fields=[
+                ('id', models.UUIDField(default=app.utils.generate_id, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('outcome', models.CharField(choices=[('rejected', 'Отклонена'), ('removed', 'Удалена')], max_length=16, verbose_name='Итог')),
+                ('archived_at', models.DateTimeField(verbose_name='Перенесена')),
+                ('user_recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Получатель')),
+                ('user_sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Отправитель')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='friendshiptombstone',
+            index=models.Index(condition=models.Q(('outcome', 'rejected')), fields=['user_sender', 'user_recipient', 'updated_at'], name='tombstone_rejected_idx'),
+        ),
+    ]
@@ -0,0 +1,132 @@
+# Generated by Django 4.2 on 2026-10-18 16:20
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+BACKFILL_CHUNK = 10_000
+
+
+def backfill_owner(apps, schema_editor):
+    """
+    Set `owner_id` a chunk per statement, so no transaction holds many row locks for long.
+
+    Chunks are primary key ranges walked along its index, each one reads its own rows only. A last
+    pass sets the rows inserted behind the walk meanwhile.
+    """
+
+    FriendshipRelation = apps.get_model('app', 'FriendshipRelation')
+    table = FriendshipRelation._meta.db_table
+    last_id = '00000000-0000-0000-0000-000000000000'
+    with schema_editor.connection.cursor() as cursor:
+        while last_id is not None:
+            cursor.execute(
+                f'SELECT id FROM {table} WHERE id > %s ORDER BY id LIMIT 1 OFFSET %s',
+                [last_id, BACKFILL_CHUNK - 1],
+            )
+            row = cursor.fetchone()
+            # The last chunk is shorter and ends with the table.
+            chunk_last_id = row[0] if row else None
+            cursor.execute(
+                f'''
+                UPDATE {table} SET owner_id = LEAST(user_sender_id, user_recipient_id)
+                WHERE id > %s AND (id <= %s OR %s IS NULL) AND owner_id IS NULL
+                ''',
+                [last_id, chunk_last_id, chunk_last_id],
+            )
+            last_id = chunk_last_id
+        cursor.execute(
+            f'UPDATE {table} SET owner_id = LEAST(user_sender_id, user_recipient_id) WHERE owner_id IS NULL',
+        )
+
+
+def drop_invalid_owner_pair_index(apps, schema_editor):
+    """Drop the index left INVALID by a failed concurrent build, so a rerun builds it again."""
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)', ['relation_unique_owner_pair'],
+        )
+        row = cursor.fetchone()
+        if row is not None and not row[0]:
+            cursor.execute('DROP INDEX CONCURRENTLY "relation_unique_owner_pair"')
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are built and dropped concurrently and NOT NULL is checked by a constraint validated
+    # without blocking writes, so the hot table is not locked.
+    atomic = False
+
+    dependencies = [
+        ('app', '0008_relation_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='friendshiprelation',
+            name='owner_id',
+            field=models.UUIDField(editable=False, null=True, verbose_name='Владелец пары'),
+        ),
+        migrations.RunPython(backfill_owner, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'ALTER TABLE "app_friendshiprelation" '
+                    'ADD CONSTRAINT "relation_owner_not_null" CHECK ("owner_id" IS NOT NULL) NOT VALID',
+                    reverse_sql='ALTER TABLE "app_friendshiprelation" DROP CONSTRAINT "relation_owner_not_null"',
+                ),
+                migrations.RunSQL(
+                    'ALTER TABLE "app_friendshiprelation" VALIDATE CONSTRAINT "relation_owner_not_null"',
+                    reverse_sql=migrations.RunSQL.noop,
+                ),
+                migrations.RunSQL(
+                    'ALTER TABLE "app_friendshiprelation" ALTER COLUMN "owner_id" SET NOT NULL',
+                    reverse_sql='ALTER TABLE "app_friendshiprelation" ALTER COLUMN "owner_id" DROP NOT NULL',
+                ),
+                migrations.RunSQL(
+                    'ALTER TABLE "app_friendshiprelation" DROP CONSTRAINT "relation_owner_not_null"',
+                    reverse_sql=migrations.RunSQL.noop,
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='friendshiprelation',
+                    name='owner_id',
+                    field=models.UUIDField(editable=False, verbose_name='Владелец пары'),
+                ),
+            ],
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(drop_invalid_owner_pair_index, migrations.RunPython.noop),
+                # Skips only a valid index, an invalid one was just dropped.
+                migrations.RunSQL(
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "relation_unique_owner_pair" '
+                    'ON "app_friendshiprelation" ("owner_id", (GREATEST("user_sender_id", "user_recipient_id")))',
+                    reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS "relation_unique_owner_pair"',
+                ),
+                migrations.RunSQL(
+                    'DROP INDEX CONCURRENTLY IF EXISTS "relation_unique_pair"',
+                    reverse_sql=(
+                        'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "relation_unique_pair" '
+                        'ON "app_friendshiprelation" '
+                        '((LEAST("user_sender_id", "user_recipient_id")), (GREATEST("user_sender_id", "user_recipient_id")))'
+                    ),
+                ),
+                migrations.RunSQL(
+                    'ALTER INDEX "relation_unique_owner_pair" RENAME TO "relation_unique_pair"',
+                    reverse_sql='ALTER INDEX "relation_unique_pair" RENAME TO "relation_unique_owner_pair"',
+                ),
+            ],
+            state_operations=[
+                migrations.RemoveConstraint(
+                    model_name='friendshiprelation',
+                    name='relation_unique_pair',
+                ),
+                migrations.AddConstraint(
+                    model_name='friendshiprelation',
+                    constraint=models.UniqueConstraint(models.F('owner_id'), django.db.models.functions.comparison.Greatest('user_sender', 'user_recipient'), name='relation_unique_pair'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.db import migrations
+
+# Partition key columns, as of this migration.
+PARTITION_KEYS = {
+    'FriendshipRelation': 'owner_id',
+    'FriendshipEdge': 'user_id',
+}
+
+
+def is_partitioned(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))', [table])
+        return cursor.fetchone()[0]
+
+
+def partition_table(schema_editor, model, key, partitions):
+    """
+    Replace the table of `model` with one of `partitions` hash partitions by `key` holding the same rows.
+
+    A copy of `app.partitioning.partition_table` as it was when this migration was written, so that
+    later changes of that module do not change what this migration does.
+    """
+
+    connection = schema_editor.connection
+    quote = schema_editor.quote_name
+    table = model._meta.db_table
+    staging = f'{table}_partitioned'
+    columns = ', '.join(quote(field.column) for field in model._meta.local_concrete_fields)
+
+    # A table with deferred foreign key checks pending in the transaction can not be dropped.
+    connection.check_constraints()
+    schema_editor.execute(f'LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE')
+    schema_editor.execute(
+        f'CREATE TABLE {quote(staging)} (LIKE {quote(table)} INCLUDING DEFAULTS) PARTITION BY HASH ({quote(key)})'
+    )
+    for remainder in range(partitions):
+        schema_editor.execute(
+            f'CREATE TABLE {quote(f"{table}_p{partitions}_{remainder}")} PARTITION OF {quote(staging)} '
+            f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+        )
+    schema_editor.execute(f'INSERT INTO {quote(staging)} ({columns}) SELECT {columns} FROM {quote(table)}')
+    # Drops the foreign keys pointing to the table too, they can not point to a partitioned one.
+    schema_editor.execute(f'DROP TABLE {quote(table)} CASCADE')
+    schema_editor.execute(f'ALTER TABLE {quote(staging)} RENAME TO {quote(table)}')
+
+    pk = model._meta.pk.column
+    schema_editor.execute(
+        f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(f"{table}_pkey")} PRIMARY KEY ({quote(key)}, {quote(pk)})'
+    )
+    schema_editor.execute(f'CREATE INDEX {quote(f"{table}_{pk}_idx")} ON {quote(table)} ({quote(pk)})')
+    for statement in schema_editor._model_indexes_sql(model):
+        schema_editor.execute(statement)
+    for fields in model._meta.unique_together:
+        schema_editor.execute(
+            schema_editor._create_unique_sql(model, [model._meta.get_field(field) for field in fields])
+        )
+    for constraint in model._meta.constraints:
+        schema_editor.add_constraint(model, constraint)
+    for field in model._meta.local_concrete_fields:
+        if field.remote_field and field.db_constraint and not is_partitioned(
+            connection, field.remote_field.model._meta.db_table,
+        ):
+            schema_editor.execute(schema_editor._create_fk_sql(model, field, '_fk_%(to_table)s_%(to_column)s'))
+
+
+def partition_relation_tables(apps, schema_editor):
+    """Partition the relation and edge tables into RELATION_PARTITIONS hash partitions, if it is set."""
+
+    if not settings.RELATION_PARTITIONS or schema_editor.connection.vendor != 'postgresql':
+        return
+    for model_name, key in PARTITION_KEYS.items():
+        partition_table(schema_editor, apps.get_model('app', model_name), key, settings.RELATION_PARTITIONS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_relation_owner'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_relation_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations
+
+ACCEPTED_INDEXES = ('relation_accepted_in_idx', 'relation_accepted_out_idx')
+
+
+def is_partitioned(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))', [table])
+        return cursor.fetchone()[0]
+
+
+def drop_accepted_indexes(apps, schema_editor):
+    """
+    Drop the accepted relation indexes, the friend lists read FriendshipEdge since 0002.
+
+    Concurrently unless the table is partitioned, PostgreSQL drops partitioned indexes only under lock.
+    """
+
+    table = apps.get_model('app', 'FriendshipRelation')._meta.db_table
+    concurrently = '' if is_partitioned(schema_editor.connection, table) else ' CONCURRENTLY'
+    for name in ACCEPTED_INDEXES:
+        schema_editor.execute(f'DROP INDEX{concurrently} IF EXISTS {schema_editor.quote_name(name)}')
+
+
+def create_accepted_indexes(apps, schema_editor):
+    FriendshipRelation = apps.get_model('app', 'FriendshipRelation')
+    for index in FriendshipRelation._meta.indexes:
+        if index.name in ACCEPTED_INDEXES:
+            schema_editor.add_index(FriendshipRelation, index)
+
+
+class Migration(migrations.Migration):
+
+    # The relation table is hot, drop the indexes without blocking writes.
+    atomic = False
+
+    dependencies = [
+        ('app', '0010_relation_partitions'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(drop_accepted_indexes, create_accepted_indexes),
+            ],
+            state_operations=[
+                migrations.RemoveIndex(model_name='friendshiprelation', name='relation_accepted_in_idx'),
+                migrations.RemoveIndex(model_name='friendshiprelation', name='relation_accepted_out_idx'),
+            ],
+        ),
+    ]
@@ -1,12 +1,21 @@
 import uuid
+from collections import defaultdict
+from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.auth.models import UserManager as BaseUserManager
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Greatest, Least
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .utils import generate_id
 
 
 class BaseModel(models.Model):
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=generate_id, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -14,6 +23,74 @@ class BaseModel(models.Model):
         abstract = True
 
 
+COUNTER_FIELDS = ('friends_count', 'incoming_pending_count', 'outgoing_pending_count')
+
+
+def ordered_pair(user_id, other_id):
+    """Ids of two users as UUIDs, the lower one first: it is the owner of their relation."""
+
+    return tuple(sorted(uuid.UUID(str(value)) for value in (user_id, other_id)))
+
+
+class UserManager(BaseUserManager):
+
+    def change_counters(self, deltas):
+        """
+        Add `deltas` of user id -> (friends, incoming pending, outgoing pending) to the user counters.
+
+        Users with equal deltas are updated by one statement.
+        """
+
+        users = defaultdict(list)
+        for user_id, delta in deltas.items():
+            if any(delta):
+                users[tuple(delta)].append(user_id)
+        for delta, user_ids in users.items():
+            self.filter(pk__in=user_ids).update(**{
+                field: models.F(field) + value for field, value in zip(COUNTER_FIELDS, delta) if value
+            })
+
+    def reconcile_counters(self, user_ids):
+        """
+        Recount the counters of `user_ids` from FriendshipEdge and FriendshipRelation, return the number fixed.
+
+        The users are locked first, so changes committed meanwhile are counted and later ones wait.
+        """
+
+        db = router.db_for_write(self.model)
+        table = self.model._meta.db_table
+        edge_table = FriendshipEdge._meta.db_table
+        relation_table = FriendshipRelation._meta.db_table
+        with transaction.atomic(using=db), connections[db].cursor() as cursor:
+            list(self.select_for_update().filter(pk__in=user_ids).order_by('pk').values_list('pk'))
+            cursor.execute(
+                f'''
+                UPDATE {table} AS account SET
+                    friends_count = actual.friends,
+                    incoming_pending_count = actual.incoming,
+                    outgoing_pending_count = actual.outgoing
+                FROM (
+                    SELECT chunk.id,
+                        (SELECT count(*) FROM {edge_table} WHERE user_id = chunk.id) AS friends,
+                        (
+                            SELECT count(*) FROM {relation_table}
+                            WHERE user_recipient_id = chunk.id AND is_accepted IS NULL
+                        ) AS incoming,
+                        (
+                            SELECT count(*) FROM {relation_table}
+                            WHERE user_sender_id = chunk.id AND is_accepted IS NULL
+                        ) AS outgoing
+                    FROM unnest(%s::uuid[]) AS chunk (id)
+                ) AS actual
+                WHERE account.id = actual.id
+                    AND (account.friends_count, account.incoming_pending_count, account.outgoing_pending_count)
+                    IS DISTINCT FROM (actual.friends, actual.incoming, actual.outgoing)
+                ''',
+                [[str(user_id) for user_id in user_ids]],
+            )
+            return cursor.rowcount
+
+
 class User(AbstractUser, BaseModel):
 
     username = models.CharField(
@@ -25,6 +102,172 @@ class User(AbstractUser, BaseModel):
             "unique": "A user with that username already exists.",
         },
     )
+    # Kept up to date by the relation signals, see `app.signals.count_relations`.
+    friends_count = models.IntegerField(default=0, verbose_name='Друзей')
+    incoming_pending_count = models.IntegerField(default=0, verbose_name='Входящих заявок')
+    outgoing_pending_count = models.IntegerField(default=0, verbose_name='Исходящих заявок')
+
+    objects = UserManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        # The stored username, a save tells a rename by it, see `api.signals.invalidate_saved_user`.
+        user._loaded_username = vars(user).get('username')
+        return user
+
+
+class FriendshipRelationQuerySet(models.QuerySet):
+
+    def between(self, user_id, other_id):
+        """Relation of two users in either direction, a point lookup on the unordered pair index."""
+
+        owner_id, other_id = ordered_pair(user_id, other_id)
+        return self.alias(
+            user_high=Greatest('user_sender', 'user_recipient'),
+        ).filter(owner_id=owner_id, user_high=other_id)
+
+    def friendships_of(self, user_id):
+        """Accepted relations of a user, found by the user's friendship edges."""
+
+        # The owner is the partition key of the relations, so each edge is joined to one partition.
+        return self.filter(edges__user=user_id, owner_id=Least('edges__user', 'edges__friend'))
+
+
+class FriendshipRelationManager(models.Manager.from_queryset(FriendshipRelationQuerySet)):
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for relation in objs:
+            relation.set_owner()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def request_friendship(self, sender, recipient_id):
+        """
+        Request friendship from `sender` to the user with `recipient_id` in a single statement.
+
+        A pending request in the opposite direction is accepted, otherwise a new pending request
+        is inserted. The upsert goes through the unique index on the unordered user pair, so two
+        users requesting each other at the same time can not both insert.
+
+        Return the created or accepted relation, or None if the recipient does not exist, the pair
+        already has another relation or the recipient rejected a request of `sender` within
+        REJECTION_COOLDOWN_SECONDS. post_save is sent for the relation, as after save().
+        """
+
+        db = router.db_for_write(self.model)
+        relation_table = self.model._meta.db_table
+        user_table = User._meta.db_table
+        tombstone_table = FriendshipTombstone._meta.db_table
+        now = timezone.now()
+        # A relation returned with this id was inserted, one with another id was accepted.
+        relation_id = generate_id()
+        columns = [field.column for field in self.model._meta.concrete_fields]
+        with transaction.atomic(using=db), connections[db].cursor() as cursor:
+            cursor.execute(
+                f'''
+                WITH recipient AS (
+                    SELECT id, username FROM {user_table} WHERE id = %(recipient)s
+                ), relation AS (
+                    INSERT INTO {relation_table} AS existing (
+                        id, created_at, updated_at, is_accepted, user_sender_id, user_recipient_id, owner_id
+                    )
+                    SELECT %(id)s, %(now)s, %(now)s, NULL, %(sender)s, recipient.id,
+                           LEAST(%(sender)s::uuid, recipient.id)
+                    FROM recipient
+                    WHERE NOT EXISTS (
+                        SELECT FROM {tombstone_table}
+                        WHERE user_sender_id = %(sender)s AND user_recipient_id = recipient.id
+                            AND outcome = %(rejected)s AND updated_at > %(cooldown_start)s
+                    ) OR EXISTS (
+                        SELECT FROM {relation_table}
+                        WHERE user_sender_id = recipient.id AND user_recipient_id = %(sender)s AND is_accepted IS NULL
+                    )
+                    ON CONFLICT (owner_id, (GREATEST(user_sender_id, user_recipient_id)))
+                    DO UPDATE SET is_accepted = TRUE, updated_at = EXCLUDED.updated_at
+                    WHERE existing.user_sender_id = EXCLUDED.user_recipient_id AND existing.is_accepted IS NULL
+                    RETURNING {', '.join(f'existing.{column}' for column in columns)}, existing.id = %(id)s AS created
+                )
+                SELECT relation.*, recipient.username FROM relation, recipient
+                ''',
+                {
+                    'id': relation_id, 'now': now, 'sender': sender.pk, 'recipient': recipient_id,
+                    'rejected': FriendshipTombstone.Outcome.REJECTED,
+                    'cooldown_start': now - timedelta(seconds=settings.REJECTION_COOLDOWN_SECONDS),
+                },
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+
+            *values, created, recipient_username = row
+            relation = self.model.from_db(db, [field.attname for field in self.model._meta.concrete_fields], values)
+            recipient_id = relation.user_recipient_id if created else relation.user_sender_id
+            recipient = User.from_db(db, ['id', 'username'], [recipient_id, recipient_username])
+            if created:
+                relation.user_sender, relation.user_recipient = sender, recipient
+            else:
+                relation.user_sender, relation.user_recipient = recipient, sender
+            post_save.send(
+                sender=self.model, instance=relation, created=created, update_fields=None, raw=False, using=db,
+            )
+        return relation
+
+    def archive(self, relations, outcome):
+        """Move `relations` to FriendshipTombstone with `outcome`, return the relations moved."""
+
+        if not relations:
+            return []
+        return self._move('id = ANY(%(ids)s::uuid[])', {'ids': [str(relation.pk) for relation in relations]}, outcome)
+
+    def compact(self, batch_size):
+        """
+        Move up to `batch_size` rejected relations to FriendshipTombstone, return the number moved.
+
+        Relations locked by other transactions are skipped, so compaction never waits for them.
+        """
+
+        return len(self._move('is_accepted = FALSE', {}, FriendshipTombstone.Outcome.REJECTED, limit=batch_size))
+
+    def _move(self, condition, params, outcome, limit=None):
+        """
+        Delete the relations matching `condition` with their edges and insert their tombstones, in one statement.
+
+        post_delete is sent for every relation moved, as after delete().
+        """
+
+        db = router.db_for_write(self.model)
+        relation_table = self.model._meta.db_table
+        edge_table = FriendshipEdge._meta.db_table
+        tombstone_table = FriendshipTombstone._meta.db_table
+        columns = ', '.join(field.column for field in self.model._meta.concrete_fields)
+        lock = 'LIMIT %(limit)s FOR UPDATE SKIP LOCKED' if limit else 'FOR UPDATE'
+        with transaction.atomic(using=db), connections[db].cursor() as cursor:
+            cursor.execute(
+                f'''
+                WITH selected AS (
+                    SELECT id FROM {relation_table} WHERE {condition} {lock}
+                ), edges AS (
+                    DELETE FROM {edge_table} WHERE relation_id IN (SELECT id FROM selected)
+                ), moved AS (
+                    DELETE FROM {relation_table} WHERE id IN (SELECT id FROM selected)
+                    RETURNING {columns}
+                ), archived AS (
+                    INSERT INTO {tombstone_table} (
+                        id, created_at, updated_at, user_sender_id, user_recipient_id, outcome, archived_at
+                    )
+                    SELECT id, created_at, updated_at, user_sender_id, user_recipient_id, %(outcome)s, %(now)s
+                    FROM moved
+                )
+                SELECT {columns} FROM moved
+                ''',
+                {**params, 'outcome': outcome, 'now': timezone.now(), 'limit': limit},
+            )
+            attnames = [field.attname for field in self.model._meta.concrete_fields]
+            relations = [self.model.from_db(db, attnames, row) for row in cursor.fetchall()]
+            for relation in relations:
+                post_delete.send(sender=self.model, instance=relation, using=db, origin=relation)
+        return relations
 
 
 class FriendshipRelation(BaseModel):
@@ -49,6 +292,334 @@ class FriendshipRelation(BaseModel):
         default=None,
         verbose_name='Подтверждение'
     )
+    # The lower of the two user ids, see `ordered_pair`: the key of the unordered pair and of the
+    # hash partitions, see `app.partitioning`.
+    owner_id = models.UUIDField(editable=False, verbose_name='Владелец пары')
+
+    objects = FriendshipRelationManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                models.F('owner_id'),
+                Greatest('user_sender', 'user_recipient'),
+                name='relation_unique_pair',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user_recipient', 'created_at', 'id'],
+                condition=models.Q(is_accepted__isnull=True),
+                name='relation_pending_in_idx',
+            ),
+            models.Index(
+                fields=['user_sender', 'created_at', 'id'],
+                condition=models.Q(is_accepted__isnull=True),
+                name='relation_pending_out_idx',
+            ),
+        ]
+
+    def set_owner(self):
+        self.owner_id = ordered_pair(self.user_sender_id, self.user_recipient_id)[0]
+
+    def save(self, *args, **kwargs):
+        self.set_owner()
+        super().save(*args, **kwargs)
+
+
+class FriendshipTombstoneQuerySet(models.QuerySet):
+
+    def in_cooldown(self):
+        """Requests rejected less than REJECTION_COOLDOWN_SECONDS ago, their sender can not repeat them yet."""
+
+        return self.filter(
+            outcome=FriendshipTombstone.Outcome.REJECTED,
+            updated_at__gt=timezone.now() - timedelta(seconds=settings.REJECTION_COOLDOWN_SECONDS),
+        )
+
+
+class FriendshipTombstone(BaseModel):
+    """
+    Rejected request or removed friendship, moved out of FriendshipRelation.
+
+    Keeps the id, timestamps and users of the relation: `updated_at` is the time it was rejected
+    or last answered before the removal. FriendshipRelation holds pending and accepted relations
+    only, rejected ones left there are moved by `compact_relations`.
+    """
+
+    class Outcome(models.TextChoices):
+        REJECTED = 'rejected', 'Отклонена'
+        REMOVED = 'removed', 'Удалена'
+
+    user_sender = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Отправитель',
+    )
+    user_recipient = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Получатель',
+    )
+    outcome = models.CharField(max_length=16, choices=Outcome.choices, verbose_name='Итог')
+    archived_at = models.DateTimeField(verbose_name='Перенесена')
+
+    objects = FriendshipTombstoneQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user_sender', 'user_recipient', 'updated_at'],
+                condition=models.Q(outcome='rejected'),
+                name='tombstone_rejected_idx',
+            ),
+        ]
+
+
+class FriendshipEdgeManager(models.Manager):
+
+    def link(self, *relations):
+        """Store both directions of accepted friendships."""
+
+        self.bulk_create(
+            [
+                self.model(user_id=user_id, friend_id=friend_id, relation=relation)
+                for relation in relations
+                for user_id, friend_id in (
+                    (relation.user_sender_id, relation.user_recipient_id),
+                    (relation.user_recipient_id, relation.user_sender_id),
+                )
+            ],
+            ignore_conflicts=True,
+        )
+
+    def unlink(self, *relations):
+        self.filter(relation__in=relations).delete()
+
+
+class FriendshipEdge(BaseModel):
+    """
+    Denormalized accepted friendship, stored once per direction.
+
+    "Friends of a user" is a lookup on `user` alone and "friendship of A and B" is a point
+    lookup on `(user, friend)`, without OR-filtering both sides of FriendshipRelation.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='friend_edges',
+        verbose_name='Пользователь',
+    )
+    friend = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Друг',
+    )
+    relation = models.ForeignKey(
+        FriendshipRelation,
+        on_delete=models.CASCADE,
+        related_name='edges',
+        verbose_name='Дружба',
+    )
+
+    objects = FriendshipEdgeManager()
+
+    class Meta:
+        unique_together = ('user', 'friend')
+
+
+class FriendshipChangeManager(models.Manager):
+
+    def process(self, batch_size):
+        """
+        Update recommendations for up to `batch_size` oldest queued changes and drop them from the queue.
+
+        Queued rows are locked with SKIP LOCKED, so several workers can run at once.
+        Return the number of changes processed.
+        """
+
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            changes = list(
+                self.select_for_update(skip_locked=True).order_by('created_at').values_list(
+                    'id', 'user_id', 'friend_id',
+                )[:batch_size]
+            )
+            if changes:
+                FriendRecommendation.objects.refresh({(user_id, friend_id) for _, user_id, friend_id in changes})
+                self.filter(id__in=[change_id for change_id, _, _ in changes]).delete()
+        return len(changes)
+
+
+class FriendshipChange(BaseModel):
+    """
+    Queue of friendships added or removed since recommendations were last updated.
+
+    Filled in the transaction that changes the friendship and drained by `update_recommendations`.
+    """
+
+    user_id = models.UUIDField(verbose_name='Пользователь')
+    friend_id = models.UUIDField(verbose_name='Друг')
+
+    objects = FriendshipChangeManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='friendship_change_queue_idx'),
+        ]
+
+
+class FriendRecommendationManager(models.Manager):
+
+    def refresh(self, pairs):
+        """
+        Recount mutual friends of the pairs of users affected by friendships of `pairs` being added or removed.
+
+        A friendship of A and B changes the mutual friends count of A with every friend of B and of B
+        with every friend of A, and makes A and B candidates of each other or not. Counts of these pairs
+        are taken from FriendshipEdge in one statement, then the users are trimmed to their top
+        RECOMMENDATIONS_TOP_K. A lowered count does not bring back candidates trimmed before, those
+        come back with `rebuild`.
+        """
+
+        db = router.db_for_write(self.model)
+        table = self.model._meta.db_table
+        edge_table = FriendshipEdge._meta.db_table
+        user_ids, friend_ids = zip(*pairs)
+        with transaction.atomic(using=db), connections[db].cursor() as cursor:
+            cursor.execute(
+                f'''
+                WITH changed (user_id, friend_id) AS (
+                    SELECT * FROM unnest(%(user_ids)s::uuid[], %(friend_ids)s::uuid[])
+                    UNION
+                    SELECT * FROM unnest(%(friend_ids)s::uuid[], %(user_ids)s::uuid[])
+                ), pairs (user_id, candidate_id) AS (
+                    SELECT user_id, friend_id FROM changed
+                    UNION
+                    SELECT changed.user_id, edge.friend_id
+                    FROM changed JOIN {edge_table} edge ON edge.user_id = changed.friend_id
+                    WHERE edge.friend_id <> changed.user_id
+                    UNION
+                    SELECT edge.friend_id, changed.user_id
+                    FROM changed JOIN {edge_table} edge ON edge.user_id = changed.friend_id
+                    WHERE edge.friend_id <> changed.user_id
+                ), counts AS (
+                    SELECT pairs.user_id, pairs.candidate_id, count(theirs.id) AS mutual_friends,
+                           EXISTS (
+                               SELECT FROM {edge_table}
+                               WHERE user_id = pairs.user_id AND friend_id = pairs.candidate_id
+                           ) AS are_friends
+                    FROM pairs
+                    LEFT JOIN {edge_table} mine ON mine.user_id = pairs.user_id
+                    LEFT JOIN {edge_table} theirs
+                        ON theirs.user_id = pairs.candidate_id AND theirs.friend_id = mine.friend_id
+                    GROUP BY pairs.user_id, pairs.candidate_id
+                ), deleted AS (
+                    DELETE FROM {table} recommendation USING counts
+                    WHERE recommendation.user_id = counts.user_id
+                        AND recommendation.candidate_id = counts.candidate_id
+                        AND (counts.mutual_friends = 0 OR counts.are_friends)
+                ), upserted AS (
+                    INSERT INTO {table} (id, created_at, updated_at, user_id, candidate_id, mutual_friends)
+                    SELECT gen_random_uuid(), %(now)s, %(now)s, user_id, candidate_id, mutual_friends
+                    FROM counts
+                    WHERE mutual_friends > 0 AND NOT are_friends
+                    ON CONFLICT (user_id, candidate_id) DO UPDATE
+                    SET mutual_friends = EXCLUDED.mutual_friends, updated_at = EXCLUDED.updated_at
+                    RETURNING user_id
+                )
+                SELECT DISTINCT user_id FROM upserted
+                ''',
+                {
+                    'user_ids': [str(user_id) for user_id in user_ids],
+                    'friend_ids': [str(friend_id) for friend_id in friend_ids],
+                    'now': timezone.now(),
+                },
+            )
+            self._trim(cursor, [user_id for user_id, in cursor.fetchall()])
+
+    def rebuild(self, user_ids):
+        """Recompute top RECOMMENDATIONS_TOP_K of `user_ids` from FriendshipEdge."""
+
+        db = router.db_for_write(self.model)
+        table = self.model._meta.db_table
+        edge_table = FriendshipEdge._meta.db_table
+        user_ids = [str(user_id) for user_id in user_ids]
+        with transaction.atomic(using=db), connections[db].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE user_id = ANY(%s::uuid[])', [user_ids])
+            cursor.execute(
+                f'''
+                INSERT INTO {table} (id, created_at, updated_at, user_id, candidate_id, mutual_friends)
+                SELECT gen_random_uuid(), %(now)s, %(now)s, user_id, candidate_id, mutual_friends
+                FROM (
+                    SELECT *, row_number() OVER (
+                        PARTITION BY user_id ORDER BY mutual_friends DESC, candidate_id
+                    ) AS rank
+                    FROM (
+                        SELECT mine.user_id, theirs.friend_id AS candidate_id, count(*) AS mutual_friends
+                        FROM {edge_table} mine
+                        JOIN {edge_table} theirs ON theirs.user_id = mine.friend_id
+                        WHERE mine.user_id = ANY(%(user_ids)s::uuid[])
+                            AND theirs.friend_id <> mine.user_id
+                            AND NOT EXISTS (
+                                SELECT FROM {edge_table}
+                                WHERE user_id = mine.user_id AND friend_id = theirs.friend_id
+                            )
+                        GROUP BY mine.user_id, theirs.friend_id
+                    ) AS counts
+                ) AS ranked
+                WHERE rank <= %(top)s
+                ''',
+                {'user_ids': user_ids, 'now': timezone.now(), 'top': settings.RECOMMENDATIONS_TOP_K},
+            )
+
+    def _trim(self, cursor, user_ids):
+        if not user_ids:
+            return
+        table = self.model._meta.db_table
+        cursor.execute(
+            f'''
+            DELETE FROM {table} WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (
+                        PARTITION BY user_id ORDER BY mutual_friends DESC, candidate_id
+                    ) AS rank
+                    FROM {table}
+                    WHERE user_id = ANY(%(user_ids)s::uuid[])
+                ) AS ranked
+                WHERE rank > %(top)s
+            )
+            ''',
+            {'user_ids': [str(user_id) for user_id in user_ids], 'top': settings.RECOMMENDATIONS_TOP_K},
+        )
+
+
+class FriendRecommendation(BaseModel):
+    """
+    Top RECOMMENDATIONS_TOP_K non-friends of a user by number of mutual friends.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+        verbose_name='Пользователь',
+    )
+    candidate = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рекомендуемый пользователь',
+    )
+    mutual_friends = models.PositiveIntegerField(verbose_name='Общих друзей')
+
+    objects = FriendRecommendationManager()
 
     class Meta:
-        unique_together = ('user_sender', 'user_recipient')
+        unique_together = ('user', 'candidate')
+        indexes = [
+            models.Index(fields=['user', '-mutual_friends', 'candidate'], name='recommendation_rank_idx'),
+        ]
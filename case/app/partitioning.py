@@ -0,0 +1,279 @@
+"""
+Optional hash partitioning of the relation tables by the user owning their rows.
+
+FriendshipRelation is partitioned by `owner_id`, the lower user id of the pair, and FriendshipEdge
+by `user_id`: migration 0010 creates RELATION_PARTITIONS partitions of each. A primary key must
+hold the partition key, so it becomes `(key, id)` with a plain index on `id` for lookups by id
+alone, and no foreign key can point to a partitioned table: the edge -> relation one is left
+out, Django deletes the edges of a relation itself.
+
+Queries carrying the key read a single partition: pair lookups (`between`, the upsert of
+`request_friendship`) and everything on the edges of a user, which the friend list and relation
+views join to their relation by owner. The requests of a user, sent or received, can not carry
+it and read the partial index of every partition.
+
+`rebalance_partitions` splits the partitions into more, online, see `PartitionSplit`.
+"""
+import re
+from functools import cached_property
+
+from django.db import transaction
+
+PARTITION_KEYS = {
+    'friendshiprelation': 'owner_id',
+    'friendshipedge': 'user_id',
+}
+
+_bound = re.compile(r'FOR VALUES WITH \(modulus (\d+), remainder (\d+)\)')
+
+
+def partition_key(model):
+    return model._meta.get_field(PARTITION_KEYS[model._meta.model_name]).column
+
+
+def partition_name(table, modulus, remainder):
+    return f'{table}_p{modulus}_{remainder}'
+
+
+def get_partitions(connection, table):
+    """(name, modulus, remainder) of the hash partitions of `table`, None if it is not partitioned."""
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))', [table])
+        if not cursor.fetchone()[0]:
+            return None
+        cursor.execute(
+            '''
+            SELECT partition.relname, pg_get_expr(partition.relpartbound, partition.oid)
+            FROM pg_inherits JOIN pg_class partition ON partition.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+            ORDER BY partition.relname
+            ''',
+            [table],
+        )
+        return [
+            (name, *map(int, _bound.match(bound).groups()))
+            for name, bound in cursor.fetchall()
+        ]
+
+
+def partition_table(schema_editor, model, partitions):
+    """
+    Replace the table of `model` with one of `partitions` hash partitions holding the same rows.
+
+    The rows are copied under an exclusive lock, like a table rewrite of ALTER TABLE: this is for
+    tables that are still small, migration 0010 has a copy of its own. Partitioned tables are split
+    by `PartitionSplit`.
+    """
+
+    connection = schema_editor.connection
+    quote = schema_editor.quote_name
+    table = model._meta.db_table
+    key = partition_key(model)
+    staging = f'{table}_partitioned'
+    columns = ', '.join(quote(field.column) for field in model._meta.local_concrete_fields)
+
+    # A table with deferred foreign key checks pending in the transaction can not be dropped.
+    connection.check_constraints()
+    schema_editor.execute(f'LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE')
+    schema_editor.execute(
+        f'CREATE TABLE {quote(staging)} (LIKE {quote(table)} INCLUDING DEFAULTS) PARTITION BY HASH ({quote(key)})'
+    )
+    for remainder in range(partitions):
+        schema_editor.execute(
+            f'CREATE TABLE {quote(partition_name(table, partitions, remainder))} PARTITION OF {quote(staging)} '
+            f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+        )
+    schema_editor.execute(f'INSERT INTO {quote(staging)} ({columns}) SELECT {columns} FROM {quote(table)}')
+    # Drops the foreign keys pointing to the table too, they can not point to a partitioned one.
+    schema_editor.execute(f'DROP TABLE {quote(table)} CASCADE')
+    schema_editor.execute(f'ALTER TABLE {quote(staging)} RENAME TO {quote(table)}')
+
+    pk = model._meta.pk.column
+    schema_editor.execute(
+        f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(f"{table}_pkey")} PRIMARY KEY ({quote(key)}, {quote(pk)})'
+    )
+    schema_editor.execute(f'CREATE INDEX {quote(f"{table}_{pk}_idx")} ON {quote(table)} ({quote(pk)})')
+    for statement in schema_editor._model_indexes_sql(model):
+        schema_editor.execute(statement)
+    for fields in model._meta.unique_together:
+        schema_editor.execute(
+            schema_editor._create_unique_sql(model, [model._meta.get_field(field) for field in fields])
+        )
+    for constraint in model._meta.constraints:
+        schema_editor.add_constraint(model, constraint)
+    for field in model._meta.local_concrete_fields:
+        if field.remote_field and field.db_constraint and get_partitions(
+            connection, field.remote_field.model._meta.db_table,
+        ) is None:
+            schema_editor.execute(schema_editor._create_fk_sql(model, field, '_fk_%(to_table)s_%(to_column)s'))
+
+
+class PartitionSplit:
+    """
+    Split the hash partition `name` of `model` into partitions of the larger modulus `partitions`, online.
+
+    1. `prepare`: a trigger starts logging the ids of rows changed in the partition, and the new
+       partitions are created as plain tables like the parent table, with its indexes, a CHECK of
+       their hash bounds and its foreign keys, NOT VALID.
+    2. `copy`: the rows are copied to the new partitions, while the old one serves reads and writes.
+    3. `validate`: the foreign keys are checked against the copied rows, under a lock of the new
+       partitions only, which blocks neither reads nor writes of the table.
+    4. `swap`: the parent table is locked, the rows logged since `prepare` are copied again and the
+       old partition is replaced by the new ones. ATTACH scans nothing thanks to the CHECK and the
+       validated foreign keys, and builds no index, so the lock is held about as long as the replay
+       of the logged changes.
+
+    A split that failed midway is started over by the next `prepare`.
+    """
+
+    def __init__(self, connection, model, name, modulus, remainder, partitions):
+        self.connection = connection
+        self.quote = connection.ops.quote_name
+        self.table = model._meta.db_table
+        self.key = partition_key(model)
+        self.pk = model._meta.pk.column
+        self.columns = ', '.join(self.quote(field.column) for field in model._meta.local_concrete_fields)
+        self.name = name
+        self.log = f'{name}_changes'
+        self.partitions = [
+            (partition_name(self.table, partitions, remainder + modulus * step), partitions, remainder + modulus * step)
+            for step in range(partitions // modulus)
+        ]
+
+    def execute(self, sql, params=()):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    @cached_property
+    def table_oid(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s)::oid', [self.table])
+            return cursor.fetchone()[0]
+
+    def satisfies(self, modulus, remainder):
+        """Condition of a row belonging to the partition `(modulus, remainder)`, as in its partition bound."""
+
+        return f'satisfies_hash_partition({self.table_oid}::oid, {modulus}, {remainder}, {self.quote(self.key)})'
+
+    @cached_property
+    def foreign_keys(self):
+        """(column, definition) of the foreign keys of the parent table."""
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                '''
+                SELECT attribute.attname, pg_get_constraintdef(fk.oid)
+                FROM pg_constraint fk
+                JOIN pg_attribute attribute ON attribute.attrelid = fk.conrelid AND attribute.attnum = fk.conkey[1]
+                WHERE fk.conrelid = %s AND fk.contype = 'f'
+                ORDER BY attribute.attname
+                ''',
+                [self.table_oid],
+            )
+            return cursor.fetchall()
+
+    def foreign_key_name(self, partition, column):
+        return f'{partition}_{column}_fk'
+
+    def set_lock_timeout(self, lock_timeout):
+        """Give up the transaction instead of queueing writes behind a lock waited for longer."""
+
+        self.execute('SELECT set_config(%s, %s, true)', ['lock_timeout', f'{lock_timeout}s'])
+
+    def prepare(self, lock_timeout):
+        quote = self.quote
+        with transaction.atomic(using=self.connection.alias):
+            # The trigger locks the old partition against writes until this transaction ends.
+            self.set_lock_timeout(lock_timeout)
+            self.execute(f'DROP FUNCTION IF EXISTS {quote(self.log)}() CASCADE')
+            self.execute(f'DROP TABLE IF EXISTS {quote(self.log)}')
+            self.execute(f'CREATE TABLE {quote(self.log)} (id uuid NOT NULL)')
+            self.execute(
+                f'''
+                CREATE FUNCTION {quote(self.log)}() RETURNS trigger LANGUAGE plpgsql AS $$
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        INSERT INTO {quote(self.log)} VALUES (OLD.{quote(self.pk)});
+                    ELSE
+                        INSERT INTO {quote(self.log)} VALUES (NEW.{quote(self.pk)});
+                    END IF;
+                    RETURN NULL;
+                END
+                $$
+                '''
+            )
+            self.execute(
+                f'CREATE TRIGGER {quote(self.log)} AFTER INSERT OR UPDATE OR DELETE ON {quote(self.name)} '
+                f'FOR EACH ROW EXECUTE FUNCTION {quote(self.log)}()'
+            )
+            for name, modulus, remainder in self.partitions:
+                self.execute(f'DROP TABLE IF EXISTS {quote(name)}')
+                self.execute(f'CREATE TABLE {quote(name)} (LIKE {quote(self.table)} INCLUDING ALL)')
+                self.execute(
+                    f'ALTER TABLE {quote(name)} ADD CONSTRAINT {quote(f"{name}_bound")} '
+                    f'CHECK ({self.satisfies(modulus, remainder)})'
+                )
+                # ATTACH takes foreign keys matching those of the parent table as they are, it only
+                # scans the rows for them when they are not validated.
+                for column, definition in self.foreign_keys:
+                    self.execute(
+                        f'ALTER TABLE {quote(name)} ADD CONSTRAINT {quote(self.foreign_key_name(name, column))} '
+                        f'{definition} NOT VALID'
+                    )
+
+    def copy(self):
+        """Copy the rows of the old partition, return the number copied."""
+
+        copied = 0
+        with transaction.atomic(using=self.connection.alias):
+            for name, modulus, remainder in self.partitions:
+                copied += self.execute(
+                    f'INSERT INTO {self.quote(name)} ({self.columns}) SELECT {self.columns} '
+                    f'FROM {self.quote(self.name)} WHERE {self.satisfies(modulus, remainder)}'
+                )
+        for name, _, _ in self.partitions:
+            self.execute(f'ANALYZE {self.quote(name)}')
+        return copied
+
+    def validate(self):
+        """Check the foreign keys of the new partitions against their rows."""
+
+        # A table with deferred foreign key checks pending in the transaction can not be altered.
+        self.connection.check_constraints()
+        for name, _, _ in self.partitions:
+            for column, _ in self.foreign_keys:
+                self.execute(
+                    f'ALTER TABLE {self.quote(name)} VALIDATE CONSTRAINT '
+                    f'{self.quote(self.foreign_key_name(name, column))}'
+                )
+
+    def swap(self, lock_timeout):
+        """Replace the old partition with the new ones, return the number of changed rows copied again."""
+
+        quote = self.quote
+        with transaction.atomic(using=self.connection.alias):
+            self.set_lock_timeout(lock_timeout)
+            self.execute(f'LOCK TABLE {quote(self.table)} IN ACCESS EXCLUSIVE MODE')
+            changed = f'SELECT id FROM {quote(self.log)}'
+            replayed = 0
+            for name, modulus, remainder in self.partitions:
+                self.execute(f'DELETE FROM {quote(name)} WHERE {quote(self.pk)} IN ({changed})')
+                replayed += self.execute(
+                    f'INSERT INTO {quote(name)} ({self.columns}) SELECT {self.columns} FROM {quote(self.name)} '
+                    f'WHERE {quote(self.pk)} IN ({changed}) AND {self.satisfies(modulus, remainder)}'
+                )
+            # Checks the replayed rows, tables with deferred checks pending can not be attached.
+            self.connection.check_constraints()
+            self.execute(f'ALTER TABLE {quote(self.table)} DETACH PARTITION {quote(self.name)}')
+            for name, modulus, remainder in self.partitions:
+                self.execute(
+                    f'ALTER TABLE {quote(self.table)} ATTACH PARTITION {quote(name)} '
+                    f'FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})'
+                )
+                self.execute(f'ALTER TABLE {quote(name)} DROP CONSTRAINT {quote(f"{name}_bound")}')
+            self.execute(f'DROP TABLE {quote(self.name)}')
+            self.execute(f'DROP FUNCTION {quote(self.log)}()')
+            self.execute(f'DROP TABLE {quote(self.log)}')
+        return replayed
@@ -0,0 +1,72 @@
+from functools import partial
+
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.creation import \
+    DatabaseCreation as BaseDatabaseCreation
+from psycopg2 import extensions
+
+from .pool import ConnectionPool, PoolTimeout, close_pools, get_pool
+
+
+def is_usable(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except base.Database.Error:
+        return False
+    return True
+
+
+class DatabaseCreation(BaseDatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections to the test database, also of its test mirrors, would block DROP DATABASE.
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend taking connections from a per-process pool instead of opening new ones.
+
+    Closing the connection (at the end of every request with CONN_MAX_AGE 0) returns it to the
+    pool, rolled back if it was left inside a transaction. Pool limits come from the POOL dict
+    of the database settings: SIZE, MAX_OVERFLOW and TIMEOUT in seconds.
+    """
+
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        if self.alias == NO_DB_ALIAS:
+            return super().get_new_connection(conn_params)
+        # Kept for _close(), the settings may change while the connection is open in tests.
+        self.pool = self.get_pool(conn_params)
+        try:
+            return self.pool.checkout(partial(super().get_new_connection, conn_params))
+        except PoolTimeout as error:
+            raise base.Database.OperationalError(str(error)) from error
+
+    def get_pool(self, conn_params):
+        def factory():
+            options = self.settings_dict.get('POOL', {})
+            return ConnectionPool(
+                is_usable,
+                size=options.get('SIZE', 10),
+                max_overflow=options.get('MAX_OVERFLOW', 10),
+                timeout=options.get('TIMEOUT', 5),
+            )
+
+        return get_pool(self.alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())), factory)
+
+    def _close(self):
+        if self.connection is None or self.alias == NO_DB_ALIAS:
+            return super()._close()
+        connection = self.connection
+        reusable = not connection.closed
+        if reusable and connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except base.Database.Error:
+                reusable = False
+        self.pool.checkin(connection, reusable)
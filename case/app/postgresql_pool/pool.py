@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of up to `size + max_overflow` connections.
+
+    Up to `size` returned connections are kept open for reuse, overflow connections are closed
+    on checkin. A checkout waits up to `timeout` seconds for a free connection and raises
+    PoolTimeout after that. A connection idle for longer than `ping_after` seconds is checked
+    with `is_usable(connection)` before it is handed out, and replaced if the check fails.
+    """
+
+    def __init__(self, is_usable, size, max_overflow, timeout, ping_after=10.0):
+        self.is_usable = is_usable
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._condition = threading.Condition()
+        self._idle = deque()
+        self._opened = 0
+        self._metrics = {
+            'checkouts': 0,
+            'connects': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    def checkout(self, connect):
+        """Take an idle connection, or one made by `connect()` if there is none and the limit allows."""
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        connection = idle_since = None
+        with self._condition:
+            while True:
+                if self._idle:
+                    # Most recently returned first: it is the least likely to have been dropped.
+                    connection, idle_since = self._idle.pop()
+                    break
+                if self._opened < self.size + self.max_overflow:
+                    self._opened += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'No database connection became free in {self.timeout:g}s, '
+                        f'all {self.size + self.max_overflow} are in use.'
+                    )
+                self._condition.wait(remaining)
+            waited = time.monotonic() - started
+            self._metrics['checkouts'] += 1
+            self._metrics['wait_seconds_total'] += waited
+            self._metrics['wait_seconds_max'] = max(self._metrics['wait_seconds_max'], waited)
+
+        if connection is not None and (
+            connection.closed
+            or time.monotonic() - idle_since > self.ping_after and not self.is_usable(connection)
+        ):
+            self._close(connection)
+            with self._condition:
+                self._metrics['discarded'] += 1
+            connection = None
+        if connection is None:
+            try:
+                connection = connect()
+            except BaseException:
+                with self._condition:
+                    self._opened -= 1
+                    self._condition.notify()
+                raise
+            with self._condition:
+                self._metrics['connects'] += 1
+        return connection
+
+    def checkin(self, connection, reusable=True):
+        """Return a checked out connection, closing it if it is not `reusable` or is an overflow one."""
+
+        with self._condition:
+            keep = reusable and not connection.closed and self._opened <= self.size
+            if keep:
+                self._idle.append((connection, time.monotonic()))
+            else:
+                self._opened -= 1
+                if not reusable:
+                    self._metrics['discarded'] += 1
+            self._condition.notify()
+        if not keep:
+            self._close(connection)
+
+    def close(self):
+        """Close the idle connections, checked out ones are closed on checkin."""
+
+        with self._condition:
+            idle, self._idle = self._idle, deque()
+            self._opened -= len(idle)
+            self.size = 0
+            self._condition.notify_all()
+        for connection, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'in_use': self._opened - len(self._idle),
+                'idle': len(self._idle),
+                **self._metrics,
+            }
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, key, factory):
+    """Pool of database `alias` for connection parameters `key`, made by `factory()` on first use."""
+
+    with _pools_lock:
+        pool = _pools.get((alias, key))
+        if pool is None:
+            pool = _pools[alias, key] = factory()
+        return pool
+
+
+def close_pools(alias=None):
+    """Close and forget the pools of database `alias`, or all of them."""
+
+    with _pools_lock:
+        keys = [key for key in _pools if alias is None or key[0] == alias]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
+
+
+def pool_stats():
+    """Stats of every pool of this process, by database alias."""
+
+    with _pools_lock:
+        pools = list(_pools.items())
+    stats = {}
+    for (alias, _), pool in pools:
+        stats[alias] = pool.stats()
+    return stats
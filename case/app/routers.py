@@ -0,0 +1,123 @@
+"""
+Routing of reads to the replica database and writes to the primary.
+
+Reads go to `settings.DATABASE_REPLICA` (None sends everything to the primary), except:
+
+- inside a transaction on the primary, where they must see its own writes and locks;
+- in a context that has written, or is inside `use_primary()`;
+- for REPLICA_PIN_SECONDS after the user of the request last wrote: ReadYourWritesMiddleware
+  pins the user in the cache, so their next requests see what they changed even though the
+  replica may lag.
+
+The routing state lives in a context variable: ReadYourWritesMiddleware gives every request its
+own, outside of requests (management commands, workers) it lasts for the thread.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import SimpleLazyObject
+
+
+def pin_key(user_id):
+    return f'db:primary-pin:{user_id}'
+
+
+class RoutingState:
+    def __init__(self, request=None):
+        self.request = request
+        self.primary = False
+        self.wrote = False
+        self.pinned = None
+
+    def reads_primary(self):
+        if self.primary or self.wrote:
+            return True
+        if self.pinned is None:
+            user_id = self.user_id()
+            if user_id is None:
+                return False
+            self.pinned = bool(cache.get(pin_key(user_id)))
+        return self.pinned
+
+    def user_id(self):
+        """Id of the authenticated user of the request, None until DRF has authenticated it."""
+
+        user = vars(self.request).get('user') if self.request is not None else None
+        # The lazy session user is not evaluated: its query would be routed right back here.
+        if user is None or isinstance(user, SimpleLazyObject) or not user.is_authenticated:
+            return None
+        return user.pk
+
+    def user_to_pin(self):
+        return self.user_id() if self.wrote and settings.DATABASE_REPLICA else None
+
+    def pin(self):
+        user_id = self.user_to_pin()
+        if user_id is not None:
+            cache.set(pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+    async def apin(self):
+        user_id = self.user_to_pin()
+        if user_id is not None:
+            await cache.aset(pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+_state = ContextVar('db_routing_state', default=None)
+
+
+def get_state():
+    state = _state.get()
+    if state is None:
+        state = RoutingState()
+        _state.set(state)
+    return state
+
+
+@contextmanager
+def routing_state(request):
+    """Give the code inside its own routing state for `request`."""
+
+    state = RoutingState(request)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Send the reads inside to the primary, e.g. to fill a shared cache with fresh data."""
+
+    state = get_state()
+    previous, state.primary = state.primary, True
+    try:
+        yield
+    finally:
+        state.primary = previous
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replica = settings.DATABASE_REPLICA
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        state = _state.get()
+        if state is not None and state.reads_primary():
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        get_state().wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,102 @@
+from collections import defaultdict
+
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from . import timing
+from .models import FriendshipChange, FriendshipEdge, FriendshipRelation, User
+
+# Sent after relations are written with bulk_create/bulk_update, which send no post_save.
+# Arguments: `created` - inserted relations, `updated` - relations whose status was changed.
+relations_bulk_saved = Signal()
+
+
+def queue_friendship_changes(*relations):
+    FriendshipChange.objects.bulk_create([
+        FriendshipChange(user_id=relation.user_sender_id, friend_id=relation.user_recipient_id)
+        for relation in relations
+    ])
+
+
+def count_relations(added=(), answered=(), removed=()):
+    """
+    Update the friend and pending request counters of the users of relations `added`, pending
+    relations `answered` (now accepted or rejected) and relations `removed`.
+    """
+
+    deltas = defaultdict(lambda: [0, 0, 0])
+
+    def count(relation, sign):
+        if relation.is_accepted:
+            deltas[relation.user_sender_id][0] += sign
+            deltas[relation.user_recipient_id][0] += sign
+        elif relation.is_accepted is None:
+            deltas[relation.user_recipient_id][1] += sign
+            deltas[relation.user_sender_id][2] += sign
+
+    for relation in added:
+        count(relation, 1)
+    for relation in answered:
+        deltas[relation.user_recipient_id][1] -= 1
+        deltas[relation.user_sender_id][2] -= 1
+        count(relation, 1)
+    for relation in removed:
+        count(relation, -1)
+    User.objects.change_counters(deltas)
+
+
+@receiver(post_save, sender=FriendshipRelation)
+def count_saved_relation(sender, instance, created, update_fields, **kwargs):
+    """
+    Count a new relation, or a pending one answered: relations only change status from pending.
+    """
+
+    if created:
+        count_relations(added=[instance])
+    elif update_fields is None or 'is_accepted' in update_fields:
+        count_relations(answered=[instance])
+
+
+@receiver(post_save, sender=FriendshipRelation)
+def sync_friendship_edges(sender, instance, created, **kwargs):
+    """
+    Keep FriendshipEdge in step with accepted relations.
+
+    Deleted relations drop their edges by cascade.
+    """
+
+    if instance.is_accepted:
+        FriendshipEdge.objects.link(instance)
+        queue_friendship_changes(instance)
+    elif not created:
+        FriendshipEdge.objects.unlink(instance)
+
+
+@receiver(post_delete, sender=FriendshipRelation)
+def queue_deleted_friendship(sender, instance, **kwargs):
+    if instance.is_accepted:
+        queue_friendship_changes(instance)
+
+
+@receiver(post_delete, sender=FriendshipRelation)
+def count_deleted_relation(sender, instance, **kwargs):
+    count_relations(removed=[instance])
+
+
+@receiver(relations_bulk_saved, sender=FriendshipRelation)
+def sync_bulk_friendship_edges(sender, created, updated, **kwargs):
+    accepted = [relation for relation in created + updated if relation.is_accepted]
+    FriendshipEdge.objects.link(*accepted)
+    FriendshipEdge.objects.unlink(*[relation for relation in updated if not relation.is_accepted])
+    queue_friendship_changes(*accepted)
+
+
+@receiver(relations_bulk_saved, sender=FriendshipRelation)
+def count_bulk_relations(sender, created, updated, **kwargs):
+    count_relations(added=created, answered=updated)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    timing.install_query_recorder(connection)
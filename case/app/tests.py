@@ -0,0 +1,681 @@
+import random
+import threading
+import uuid
+from contextvars import Context
+from io import StringIO
+from unittest import skipUnless
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import (PBKDF2PasswordHasher, check_password,
+                                         make_password)
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, router, transaction
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+
+from . import hashers
+from .models import (COUNTER_FIELDS, FriendRecommendation, FriendshipChange,
+                     FriendshipEdge, FriendshipRelation, FriendshipTombstone,
+                     User)
+from .partitioning import PartitionSplit, get_partitions
+from .postgresql_pool.base import DatabaseWrapper
+from .postgresql_pool.pool import ConnectionPool, PoolTimeout, close_pools
+from .routers import pin_key, routing_state, use_primary
+from .signals import relations_bulk_saved
+from .utils import generate_id, uuid7
+
+
+class UUID7Test(SimpleTestCase):
+    """
+    Testing the time-ordered primary key generator.
+    """
+
+    def test_uuid7_layout(self):
+        """
+        Generated ids are RFC 4122 variant UUIDs of version 7.
+        """
+
+        value = uuid7()
+        self.assertEqual(value.version, 7)
+        self.assertEqual(value.variant, uuid.RFC_4122)
+
+    def test_uuid7_is_monotonic(self):
+        """
+        Ids generated in a row are strictly increasing, also within one millisecond.
+        """
+
+        values = [uuid7() for _ in range(10000)]
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(len(set(values)), len(values))
+
+    def test_generate_id_version(self):
+        """
+        UUID_VERSION setting switches primary keys between v4 and v7.
+        """
+
+        with override_settings(UUID_VERSION=7):
+            self.assertEqual(generate_id().version, 7)
+        with override_settings(UUID_VERSION=4):
+            self.assertEqual(generate_id().version, 4)
+
+
+class FakeConnection:
+    closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    """
+    Testing the connection pool limits, health checks and metrics.
+    """
+
+    def make_pool(self, is_usable=lambda connection: True, **kwargs):
+        return ConnectionPool(is_usable, **{'size': 1, 'max_overflow': 1, 'timeout': 0.01, **kwargs})
+
+    def test_connection_is_reused(self):
+        """
+        A returned connection is handed out again instead of opening a new one.
+        """
+
+        pool = self.make_pool()
+        first = pool.checkout(FakeConnection)
+        pool.checkin(first)
+        self.assertIs(pool.checkout(FakeConnection), first)
+        self.assertEqual(pool.stats()['connects'], 1)
+        self.assertEqual(pool.stats()['checkouts'], 2)
+
+    def test_overflow_and_timeout(self):
+        """
+        Up to size + max_overflow connections are opened, then checkouts time out.
+        Overflow connections are closed when returned.
+        """
+
+        pool = self.make_pool()
+        first, second = pool.checkout(FakeConnection), pool.checkout(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.checkout(FakeConnection)
+        pool.checkin(second)
+        pool.checkin(first)
+        self.assertTrue(second.closed)
+        self.assertFalse(first.closed)
+        stats = pool.stats()
+        self.assertEqual((stats['in_use'], stats['idle'], stats['timeouts']), (0, 1, 1))
+        self.assertGreater(stats['wait_seconds_total'], 0)
+
+    def test_waiting_checkout_gets_returned_connection(self):
+        """
+        A checkout waiting on a full pool gets the connection another thread returns.
+        """
+
+        pool = self.make_pool(max_overflow=0, timeout=5)
+        first = pool.checkout(FakeConnection)
+        timer = threading.Timer(0.05, pool.checkin, args=(first,))
+        timer.start()
+        self.assertIs(pool.checkout(FakeConnection), first)
+        timer.join()
+        self.assertGreaterEqual(pool.stats()['wait_seconds_max'], 0.04)
+
+    def test_broken_connection_is_replaced(self):
+        """
+        Connections closed or failing the health check are discarded, not handed out.
+        """
+
+        pool = self.make_pool(is_usable=lambda connection: False, ping_after=0)
+        first = pool.checkout(FakeConnection)
+        pool.checkin(first)
+        second = pool.checkout(FakeConnection)
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        pool.checkin(second, reusable=False)
+        self.assertTrue(second.closed)
+        stats = pool.stats()
+        self.assertEqual((stats['discarded'], stats['connects'], stats['in_use'], stats['idle']), (2, 2, 0, 0))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'The pooled backend is PostgreSQL specific.')
+class PooledDatabaseWrapperTest(TestCase):
+    """
+    Testing the pooled PostgreSQL backend against the test database.
+    """
+
+    def setUp(self):
+        self.wrapper = DatabaseWrapper({**connections['default'].settings_dict}, alias='pooled')
+        self.addCleanup(close_pools, 'pooled')
+        self.addCleanup(self.wrapper.close)
+
+    def test_closed_connection_returns_to_pool(self):
+        """
+        Closing the wrapper returns its connection, rolled back, and the next connect reuses it.
+        """
+
+        self.wrapper.ensure_connection()
+        first = self.wrapper.connection
+        self.wrapper.set_autocommit(False)
+        with self.wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.wrapper.close()
+        self.assertFalse(first.closed)
+
+        self.wrapper.ensure_connection()
+        self.assertIs(self.wrapper.connection, first)
+        self.assertTrue(self.wrapper.get_autocommit())
+        self.assertEqual(self.wrapper.pool.stats()['connects'], 1)
+
+
+SCRYPT_FIRST = ['app.hashers.ScryptPasswordHasher', 'app.hashers.PBKDF2PasswordHasher']
+
+
+class PasswordHashingTest(TestCase):
+    """
+    Testing the password hasher policy and the hashing process pool.
+    """
+
+    def test_new_passwords_use_preferred_hasher(self):
+        self.assertTrue(make_password('password').startswith('pbkdf2_sha256$600000$'))
+        with override_settings(PASSWORD_HASHERS=SCRYPT_FIRST):
+            self.assertTrue(make_password('password').startswith('scrypt$16384$'))
+
+    def test_django_hash_is_kept_on_login(self):
+        """
+        Hashes made with the Django defaults are not re-hashed by the default policy.
+        """
+
+        hasher = PBKDF2PasswordHasher()
+        password = hasher.encode('password', hasher.salt())
+        user = User.objects.create(username='user', password=password)
+        self.assertEqual(authenticate(username='user', password='password'), user)
+        user.refresh_from_db()
+        self.assertEqual(user.password, password)
+
+    @override_settings(PASSWORD_HASHERS=SCRYPT_FIRST)
+    def test_old_hash_is_upgraded_on_login(self):
+        """
+        A password hashed by another hasher is re-hashed with the preferred one on login.
+        """
+
+        user = User.objects.create(
+            username='user',
+            password=PBKDF2PasswordHasher().encode('password', 'salt', iterations=1000),
+        )
+        self.assertEqual(authenticate(username='user', password='password'), user)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('scrypt$'))
+        self.assertTrue(user.check_password('password'))
+
+    @override_settings(PASSWORD_HASHING_WORKERS=1)
+    def test_hashing_in_process_pool(self):
+        self.addCleanup(self.shutdown_executor)
+        encoded = make_password('password')
+        self.assertIsNotNone(hashers._executor)
+        self.assertTrue(check_password('password', encoded))
+        self.assertFalse(check_password('wrong', encoded))
+
+    def test_encode_takes_cost_parameters(self):
+        """
+        Cost parameters given as keyword arguments reach the hasher, in the process pool too.
+        """
+
+        hasher = hashers.PBKDF2PasswordHasher()
+        self.assertTrue(hasher.encode('password', 'salt', iterations=1000).startswith('pbkdf2_sha256$1000$'))
+        self.addCleanup(self.shutdown_executor)
+        with override_settings(PASSWORD_HASHING_WORKERS=1):
+            encoded = hasher.encode('password', 'salt', iterations=1000)
+        self.assertTrue(encoded.startswith('pbkdf2_sha256$1000$'))
+        self.assertTrue(hasher.verify('password', encoded))
+
+    def shutdown_executor(self):
+        executor, hashers._executor = hashers._executor, None
+        executor.shutdown()
+
+
+@override_settings(DATABASE_REPLICA='replica')
+class PrimaryReplicaRouterTest(TransactionTestCase):
+    """
+    Testing the routing of reads to the replica and of writes to the primary.
+
+    The replica alias is a test mirror: a second connection to the test database.
+    """
+
+    databases = {'default', 'replica'}
+
+    def route(self, function):
+        """Run `function` with a fresh routing state, as a new thread or request would."""
+
+        return Context().run(function)
+
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        self.assertEqual(self.route(lambda: router.db_for_read(User)), 'replica')
+        self.assertEqual(self.route(lambda: router.db_for_write(User)), 'default')
+        with override_settings(DATABASE_REPLICA=None):
+            self.assertEqual(self.route(lambda: router.db_for_read(User)), 'default')
+
+    def test_reads_after_write_go_to_primary(self):
+        """
+        Once something was written, the rest of the context reads from the primary.
+        """
+
+        def write_then_read():
+            User.objects.create(username='user')
+            return User.objects.get(username='user')._state.db
+
+        self.assertEqual(self.route(write_then_read), 'default')
+
+    def test_reads_in_transaction_or_forced_go_to_primary(self):
+        def read_in_transaction():
+            with transaction.atomic():
+                return router.db_for_read(User)
+
+        def read_forced():
+            with use_primary():
+                return router.db_for_read(User)
+
+        self.assertEqual(self.route(read_in_transaction), 'default')
+        self.assertEqual(self.route(read_forced), 'default')
+
+    def test_pinned_user_reads_from_primary(self):
+        """
+        A request of a user pinned after a write reads from the primary, others from the replica.
+        """
+
+        user, other = User.objects.bulk_create([User(username='user'), User(username='other')])
+        request = RequestFactory().get('/')
+
+        def read_as(request_user):
+            with routing_state(request):
+                request.user = request_user
+                return router.db_for_read(User)
+
+        cache.set(pin_key(user.pk), True)
+        self.addCleanup(cache.delete, pin_key(user.pk))
+        self.assertEqual(self.route(lambda: read_as(user)), 'default')
+        self.assertEqual(self.route(lambda: read_as(other)), 'replica')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'The friendship upsert is PostgreSQL specific.')
+class RequestFriendshipConcurrencyTest(TransactionTestCase):
+    """
+    Testing friendship requests sent by many threads at the same moment.
+    """
+
+    def run_concurrently(self, requests):
+        barrier = threading.Barrier(len(requests))
+        errors = []
+
+        def send(sender, recipient):
+            try:
+                barrier.wait()
+                FriendshipRelation.objects.request_friendship(sender, recipient.pk)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=send, args=request) for request in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_mutual_requests_make_one_friendship(self):
+        """
+        Users requesting each other at the same time end up with a single accepted relation.
+        """
+
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(16)])
+        pairs = list(zip(users[::2], users[1::2]))
+        self.run_concurrently([(a, b) for a, b in pairs] + [(b, a) for a, b in pairs])
+        for a, b in pairs:
+            relations = list(FriendshipRelation.objects.between(a.pk, b.pk))
+            self.assertEqual(len(relations), 1)
+            self.assertTrue(relations[0].is_accepted)
+            self.assertEqual(FriendshipEdge.objects.filter(relation=relations[0]).count(), 2)
+
+    def test_repeated_requests_make_one_request(self):
+        """
+        The same request sent many times at once is stored once and stays pending.
+        """
+
+        sender, recipient = User.objects.bulk_create([User(username='sender'), User(username='recipient')])
+        self.run_concurrently([(sender, recipient)] * 16)
+        relation = FriendshipRelation.objects.get()
+        self.assertIsNone(relation.is_accepted)
+        self.assertEqual(relation.user_sender, sender)
+
+
+class UserCountersTest(TestCase):
+    """
+    Testing the friend and pending request counters stored on User.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username=f'user{i}') for i in range(4)])
+
+    def counters(self):
+        users = User.objects.filter(pk__in=[user.pk for user in self.users]).order_by('username')
+        return [tuple(counters) for counters in users.values_list(*COUNTER_FIELDS)]
+
+    def test_counters_follow_relations(self):
+        """
+        Requests, answers and deletions change the counters of both users.
+        """
+
+        a, b, c, _ = self.users
+        first = FriendshipRelation.objects.create(user_sender=a, user_recipient=b)
+        second = FriendshipRelation.objects.create(user_sender=a, user_recipient=c)
+        self.assertEqual(self.counters(), [(0, 0, 2), (0, 1, 0), (0, 1, 0), (0, 0, 0)])
+
+        first.is_accepted = True
+        first.save(update_fields=['is_accepted'])
+        second.is_accepted = False
+        second.save()
+        self.assertEqual(self.counters(), [(1, 0, 0), (1, 0, 0), (0, 0, 0), (0, 0, 0)])
+
+        first.delete()
+        second.delete()
+        self.assertEqual(self.counters(), [(0, 0, 0)] * 4)
+
+    def test_bulk_saved_relations_are_counted(self):
+        a, b, c, d = self.users
+        created = FriendshipRelation.objects.bulk_create([
+            FriendshipRelation(user_sender=a, user_recipient=b),
+            FriendshipRelation(user_sender=c, user_recipient=b),
+            FriendshipRelation(user_sender=d, user_recipient=a, is_accepted=True),
+        ])
+        relations_bulk_saved.send(FriendshipRelation, created=created, updated=[])
+        created[0].is_accepted = True
+        FriendshipRelation.objects.bulk_update(created[:1], ['is_accepted'])
+        relations_bulk_saved.send(FriendshipRelation, created=[], updated=created[:1])
+        self.assertEqual(self.counters(), [(2, 0, 0), (1, 1, 0), (0, 0, 1), (1, 0, 0)])
+
+    def test_reconcile_fixes_drift(self):
+        """
+        The reconcile command recounts the counters of users that drifted and leaves the others.
+        """
+
+        a, b, c, _ = self.users
+        FriendshipRelation.objects.create(user_sender=a, user_recipient=b, is_accepted=True)
+        FriendshipRelation.objects.create(user_sender=c, user_recipient=a)
+        expected = self.counters()
+        User.objects.filter(pk__in=[a.pk, c.pk]).update(friends_count=7, outgoing_pending_count=0)
+
+        self.assertEqual(User.objects.reconcile_counters([user.pk for user in self.users]), 2)
+        self.assertEqual(self.counters(), expected)
+
+        User.objects.filter(pk=b.pk).update(incoming_pending_count=3)
+        call_command('reconcile_user_counters', chunk=1, stdout=StringIO())
+        self.assertEqual(self.counters(), expected)
+
+
+class FriendshipTombstoneTest(TestCase):
+    """
+    Testing rejected and removed relations moved to FriendshipTombstone.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username=f'user{i}') for i in range(4)])
+
+    def test_compaction_moves_rejected_relations(self):
+        """
+        Only rejected relations are moved, in batches, keeping their ids and answer time.
+        """
+
+        a, b, c, d = self.users
+        accepted = FriendshipRelation.objects.create(user_sender=a, user_recipient=b, is_accepted=True)
+        pending = FriendshipRelation.objects.create(user_sender=a, user_recipient=c)
+        # Rejected rows left in the relation table from before rejections were archived right away.
+        rejected = [
+            FriendshipRelation.objects.create(user_sender=sender, user_recipient=recipient, is_accepted=False)
+            for sender, recipient in ((a, d), (b, c), (d, b))
+        ]
+
+        self.assertEqual(FriendshipRelation.objects.compact(2), 2)
+        call_command('compact_relations', batch=1, sleep=0, stdout=StringIO())
+        self.assertEqual(set(FriendshipRelation.objects.values_list('pk', flat=True)), {accepted.pk, pending.pk})
+        for relation in rejected:
+            tombstone = FriendshipTombstone.objects.get(pk=relation.pk)
+            self.assertEqual(tombstone.outcome, FriendshipTombstone.Outcome.REJECTED)
+            self.assertEqual(
+                (tombstone.user_sender_id, tombstone.user_recipient_id, tombstone.updated_at),
+                (relation.user_sender_id, relation.user_recipient_id, relation.updated_at),
+            )
+        self.assertEqual(FriendshipEdge.objects.count(), 2)
+        self.assertEqual(User.objects.reconcile_counters([user.pk for user in self.users]), 0)
+
+    def test_archive_removed_friendship(self):
+        """
+        A removed friendship leaves its edges and counters as after delete().
+        """
+
+        a, b, _, _ = self.users
+        relation = FriendshipRelation.objects.create(user_sender=a, user_recipient=b, is_accepted=True)
+        FriendshipChange.objects.all().delete()
+
+        moved = FriendshipRelation.objects.archive([relation], FriendshipTombstone.Outcome.REMOVED)
+        self.assertEqual([moved_relation.pk for moved_relation in moved], [relation.pk])
+        self.assertFalse(FriendshipRelation.objects.exists())
+        self.assertFalse(FriendshipEdge.objects.exists())
+        self.assertEqual(FriendshipTombstone.objects.get().outcome, FriendshipTombstone.Outcome.REMOVED)
+        self.assertEqual(FriendshipChange.objects.count(), 1)
+        self.assertEqual(User.objects.get(pk=a.pk).friends_count, 0)
+
+    def test_rejected_request_cooldown(self):
+        """
+        The sender of a rejected request can not repeat it until the cooldown ends, the recipient can request.
+        """
+
+        a, b, c, _ = self.users
+        relation = FriendshipRelation.objects.create(user_sender=a, user_recipient=b)
+        FriendshipRelation.objects.archive([relation], FriendshipTombstone.Outcome.REJECTED)
+        self.assertIsNone(FriendshipRelation.objects.request_friendship(a, b.pk))
+        with override_settings(REJECTION_COOLDOWN_SECONDS=0):
+            self.assertIsNotNone(FriendshipRelation.objects.request_friendship(a, b.pk))
+
+        # A pending request of the other user is still accepted.
+        relation = FriendshipRelation.objects.create(user_sender=a, user_recipient=c)
+        FriendshipRelation.objects.archive([relation], FriendshipTombstone.Outcome.REJECTED)
+        FriendshipRelation.objects.request_friendship(c, a.pk)
+        self.assertTrue(FriendshipRelation.objects.request_friendship(a, c.pk).is_accepted)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Hash partitioning is PostgreSQL specific.')
+class PartitioningTest(TestCase):
+    """
+    Testing hash partitions of the relation and edge tables, whether or not RELATION_PARTITIONS is set.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username=f'user{i}') for i in range(12)])
+        for index, user in enumerate(cls.users[1:], 1):
+            FriendshipRelation.objects.create(
+                user_sender=cls.users[0], user_recipient=user, is_accepted=True if index % 2 else None,
+            )
+
+    def setUp(self):
+        table = FriendshipRelation._meta.db_table
+        if get_partitions(connection, table) is None:
+            call_command('rebalance_partitions', partitions=2, stdout=StringIO())
+        self.modulus = get_partitions(connection, table)[0][1]
+
+    def rows(self):
+        return (
+            set(FriendshipRelation.objects.values_list('id', 'is_accepted')),
+            set(FriendshipEdge.objects.values_list('id', 'relation')),
+        )
+
+    def test_split_keeps_changes_made_during_copy(self):
+        """
+        Rows inserted, updated and deleted between the copy and the swap of a partition are moved too.
+        """
+
+        a, b, c, *_ = self.users
+        for model in (FriendshipRelation, FriendshipEdge):
+            splits = [
+                PartitionSplit(connection, model, name, modulus, remainder, 2 * self.modulus)
+                for name, modulus, remainder in get_partitions(connection, model._meta.db_table)
+            ]
+            for split in splits:
+                split.prepare(lock_timeout=5)
+                split.copy()
+                split.validate()
+            if model is FriendshipRelation:
+                FriendshipRelation.objects.request_friendship(b, c.pk)
+                pending = FriendshipRelation.objects.filter(is_accepted=None).first()
+                pending.is_accepted = True
+                pending.save()
+                FriendshipRelation.objects.filter(user_recipient=self.users[1]).get().delete()
+            expected = self.rows()
+            # Run the deferred foreign key checks of the changes, a table with pending ones can not be dropped.
+            connection.check_constraints()
+            for split in splits:
+                split.swap(lock_timeout=5)
+            self.assertEqual(self.rows(), expected)
+            self.assertEqual(
+                {modulus for _, modulus, _ in get_partitions(connection, model._meta.db_table)}, {2 * self.modulus},
+            )
+
+    def foreign_keys(self, table):
+        """Referenced table of each foreign key of `table`, with whether it is validated."""
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT confrelid::regclass::text, convalidated FROM pg_constraint "
+                "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+                [table],
+            )
+            return sorted(cursor.fetchall())
+
+    def test_split_validates_foreign_keys_before_swap(self):
+        """
+        New partitions get the foreign keys of the table before the swap, which attaches them as they are.
+        """
+
+        table = FriendshipRelation._meta.db_table
+        expected = [(User._meta.db_table, True)] * 2
+        name, modulus, remainder = get_partitions(connection, table)[0]
+        split = PartitionSplit(connection, FriendshipRelation, name, modulus, remainder, 2 * modulus)
+        split.prepare(lock_timeout=5)
+        split.copy()
+        for partition, _, _ in split.partitions:
+            self.assertEqual(self.foreign_keys(partition), [(User._meta.db_table, False)] * 2)
+        split.validate()
+        for partition, _, _ in split.partitions:
+            self.assertEqual(self.foreign_keys(partition), expected)
+        split.swap(lock_timeout=5)
+        # Not cloned again by ATTACH.
+        for partition, _, _ in split.partitions:
+            self.assertEqual(self.foreign_keys(partition), expected)
+
+    def test_pair_lookup_reads_one_partition(self):
+        a, b, *_ = self.users
+        plan = FriendshipRelation.objects.between(a.pk, b.pk).explain()
+        self.assertEqual(plan.count(f' on {FriendshipRelation._meta.db_table}_p'), 1)
+
+    def test_bad_rebalance_into_fewer_partitions(self):
+        with self.assertRaises(CommandError):
+            call_command('rebalance_partitions', partitions=self.modulus + 1, stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'The graph is loaded with PostgreSQL COPY.')
+class GenerateSocialGraphTest(TestCase):
+    """
+    Testing the synthetic power-law friendship graph.
+    """
+
+    def test_generate_graph(self):
+        call_command('generate_social_graph', users=300, relations=2000, chunk=700, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 300)
+        rejected = FriendshipTombstone.objects.filter(outcome=FriendshipTombstone.Outcome.REJECTED).count()
+        self.assertEqual(FriendshipRelation.objects.count() + rejected, 2000)
+        self.assertTrue(50 < rejected < 150)
+        self.assertFalse(FriendshipRelation.objects.filter(is_accepted=False).exists())
+        pending = FriendshipRelation.objects.filter(is_accepted=None).count()
+        self.assertTrue(300 < pending < 500)
+
+        accepted = FriendshipRelation.objects.filter(is_accepted=True).count()
+        self.assertEqual(FriendshipEdge.objects.count(), 2 * accepted)
+        self.assertEqual(User.objects.reconcile_counters(list(User.objects.values_list('pk', flat=True))), 0)
+
+        # Hubs: the first users have many times the average number of friends.
+        hub = User.objects.get(username='bench_1')
+        self.assertGreater(hub.friends_count, 5 * 2 * accepted / 300)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Recommendation updates are PostgreSQL specific.')
+class FriendRecommendationTest(TestCase):
+    """
+    Testing incremental updates of friend-of-friend recommendations against a full rebuild.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username=f'user{i}') for i in range(12)])
+
+    def befriend(self, pairs):
+        return [
+            FriendshipRelation.objects.create(user_sender=self.users[a], user_recipient=self.users[b], is_accepted=True)
+            for a, b in pairs
+        ]
+
+    def recommendations(self):
+        return set(FriendRecommendation.objects.values_list('user', 'candidate', 'mutual_friends'))
+
+    def rebuilt_recommendations(self):
+        FriendRecommendation.objects.rebuild([user.pk for user in self.users])
+        return self.recommendations()
+
+    def test_incremental_updates_match_rebuild(self):
+        """
+        Recommendations updated from queued changes equal the ones computed from scratch.
+        """
+
+        rng = random.Random(0)
+        pairs = rng.sample([(a, b) for a in range(12) for b in range(a + 1, 12)], 30)
+        relations = self.befriend(pairs)
+        self.assertEqual(FriendshipChange.objects.process(batch_size=1000), 30)
+        updated = self.recommendations()
+        self.assertTrue(updated)
+        self.assertEqual(updated, self.rebuilt_recommendations())
+
+        for relation in rng.sample(relations, 10):
+            relation.delete()
+        FriendshipChange.objects.process(batch_size=3)
+        FriendshipChange.objects.process(batch_size=1000)
+        updated = self.recommendations()
+        self.assertEqual(updated, self.rebuilt_recommendations())
+        self.assertFalse(FriendshipChange.objects.exists())
+
+    def test_friends_are_not_recommended(self):
+        """
+        Friends of friends are recommended until they become friends.
+        """
+
+        self.befriend([(0, 1), (1, 2)])
+        FriendshipChange.objects.process(batch_size=100)
+        self.assertEqual(self.recommendations(), {
+            (self.users[0].pk, self.users[2].pk, 1),
+            (self.users[2].pk, self.users[0].pk, 1),
+        })
+        self.befriend([(0, 2)])
+        FriendshipChange.objects.process(batch_size=100)
+        self.assertEqual(self.recommendations(), set())
+
+    @override_settings(RECOMMENDATIONS_TOP_K=1)
+    def test_top_k_is_kept(self):
+        """
+        Only RECOMMENDATIONS_TOP_K candidates with most mutual friends are kept per user.
+        """
+
+        self.befriend([(0, 1), (0, 2), (1, 3), (2, 3), (2, 4)])
+        FriendshipChange.objects.process(batch_size=100)
+        self.assertEqual(
+            list(FriendRecommendation.objects.filter(user=self.users[0]).values_list('candidate', 'mutual_friends')),
+            [(self.users[3].pk, 2)],
+        )
+        self.assertEqual(self.recommendations(), self.rebuilt_recommendations())
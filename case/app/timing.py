@@ -0,0 +1,140 @@
+"""
+Where the time of a request goes: database queries, serialization and rendering.
+
+`ServerTimingMiddleware` measures a SERVER_TIMING_SAMPLE_RATE share of the requests. For them it
+adds a `Server-Timing` header, logs a line to the `app.timing` logger and adds the durations to
+the histograms of the route (`friendships-list`, `requests-list`, ...), see `timing_stats()`.
+Requests that are not sampled only pay for a context variable lookup per query.
+
+Queries are counted by `record_query`, installed on every new connection in any thread, so the
+queries that async views run through the async ORM are counted too.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds of the histogram buckets: milliseconds, or queries for the query count.
+BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+METRICS = ('total', 'db', 'serialize', 'render')
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.durations = dict.fromkeys(METRICS[1:], 0.0)
+
+    def add(self, name, seconds):
+        self.durations[name] += seconds
+
+    def server_timing(self, total):
+        """`Server-Timing` header value, durations in milliseconds."""
+
+        entries = [f'db;dur={self.durations["db"] * 1000:.2f};desc="{self.queries} queries"']
+        entries += [f'{name};dur={self.durations[name] * 1000:.2f}' for name in METRICS[2:]]
+        entries.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(entries)
+
+
+_timings = ContextVar('request_timings', default=None)
+
+
+def get_timings():
+    """Timings of the current request, None unless it is sampled."""
+
+    return _timings.get()
+
+
+@contextmanager
+def request_timings():
+    timings = RequestTimings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent inside to `name` of the current request, if it is sampled."""
+
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.add('db', time.perf_counter() - started)
+
+
+def install_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+    def stats(self):
+        """Cumulative bucket counts, like Prometheus `_bucket{le=...}` series."""
+
+        cumulative, buckets = 0, {}
+        for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'buckets': buckets, 'count': cumulative, 'sum': round(self.sum, 3)}
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def observe(route, timings, total):
+    with _histograms_lock:
+        histograms = _histograms.get(route)
+        if histograms is None:
+            histograms = _histograms[route] = {
+                'queries': Histogram(), **{name: Histogram() for name in METRICS},
+            }
+        histograms['queries'].observe(timings.queries)
+        histograms['total'].observe(total * 1000)
+        for name, seconds in timings.durations.items():
+            histograms[name].observe(seconds * 1000)
+
+
+def timing_stats():
+    """Histograms of the sampled requests of this process by route, durations in milliseconds."""
+
+    with _histograms_lock:
+        return {
+            route: {name: histogram.stats() for name, histogram in histograms.items()}
+            for route, histograms in _histograms.items()
+        }
+
+
+def reset_timing_stats():
+    with _histograms_lock:
+        _histograms.clear()
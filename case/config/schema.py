@@ -0,0 +1,111 @@
+"""
+OpenAPI schema, generated once per code version and served from memory with an ETag.
+
+drf_yasg introspects every view and serializer to build the schema, so it is built only once:
+read from OPENAPI_SCHEMA_FILE (written by `generate_openapi_schema`) if the file was made for the
+running code version, generated on the first request otherwise. The code version is CODE_VERSION,
+or a digest of the project's source files if it is unset.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, yaml_sane_dump
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.renderers import SwaggerYAMLRenderer
+from drf_yasg.views import SPEC_RENDERERS, get_schema_view
+from rest_framework.permissions import AllowAny
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+VERSION_KEY = 'x-code-version'
+
+info = openapi.Info(
+   title="Тестовое задание ВКонтакте",
+   default_version='v1',
+   description="Дружеская социальная сеть",
+   contact=openapi.Contact(email="maxvihr@yandex.ru"),
+)
+
+_lock = threading.Lock()
+_documents = {}
+
+
+@lru_cache
+def code_version():
+    if settings.CODE_VERSION:
+        return settings.CODE_VERSION
+    digest = hashlib.sha256()
+    for path in sorted(settings.BASE_DIR.rglob('*.py')):
+        digest.update(str(path.relative_to(settings.BASE_DIR)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def generate_schema():
+    """Schema of all endpoints for the running code version, as JSON bytes."""
+
+    # Views build their querysets from the request user, so they get an anonymous request, like the
+    # one of `manage.py generate_swagger --mock-request`. The empty url leaves the host out of the
+    # schema: it is the one the schema is served from.
+    request = APIView().initialize_request(APIRequestFactory().get('/swagger/?format=openapi'))
+    schema = OpenAPISchemaGenerator(info, url='').get_schema(request=request, public=True)
+    schema[VERSION_KEY] = code_version()
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def load_schema():
+    """Schema from OPENAPI_SCHEMA_FILE if it was generated for this code version, else None."""
+
+    try:
+        with open(settings.OPENAPI_SCHEMA_FILE, 'rb') as file:
+            content = file.read()
+    except FileNotFoundError:
+        return None
+    if json.loads(content).get(VERSION_KEY) != code_version():
+        return None
+    return content
+
+
+def get_document(yaml=False):
+    """Return the schema as JSON, or YAML, bytes and its ETag."""
+
+    key = 'yaml' if yaml else 'json'
+    with _lock:
+        if 'json' not in _documents:
+            content = load_schema() or generate_schema()
+            _documents['json'] = content, f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+        if key not in _documents:
+            content, etag = _documents['json']
+            data = json.loads(content, object_pairs_hook=OrderedDict)
+            _documents[key] = yaml_sane_dump(data, binary=True), etag[:-1] + '-yaml"'
+        return _documents[key]
+
+
+class SchemaView(get_schema_view(info, public=True, permission_classes=[AllowAny])):
+    """
+    drf_yasg schema view serving the spec formats from `get_document()`.
+
+    The UI page is still rendered by drf_yasg, it holds no endpoints and loads the spec.
+    """
+
+    authentication_classes = ()
+
+    def get(self, request, version='', format=None):
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, SPEC_RENDERERS):
+            return super().get(request, version, format)
+
+        content, etag = get_document(yaml=isinstance(renderer, SwaggerYAMLRenderer))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(content, content_type=f'{renderer.media_type}; charset=utf-8')
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
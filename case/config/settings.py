@@ -25,11 +25,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.middleware.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -54,17 +56,110 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
+# Seconds to keep a connection open between requests, 0 closes it after each request.
+POSTGRES_CONN_MAX_AGE = int(os.getenv('POSTGRES_CONN_MAX_AGE', default=60))
+
+# 1 - take connections from a per-process pool instead, returned to it after each request.
+POSTGRES_POOL = int(os.getenv('POSTGRES_POOL', default=0))
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": "app.postgresql_pool" if POSTGRES_POOL else "django.db.backends.postgresql_psycopg2",
         "NAME": str(os.getenv('POSTGRES_DB', default='database')),
         "USER": str(os.getenv('POSTGRES_USER', default='user')),
         "PASSWORD": str(os.getenv('POSTGRES_PASSWORD', default='password')),
         "HOST": str(os.getenv('POSTGRES_HOST', default='db')),
         "PORT": int(os.getenv('POSTGRES_PORT', default=5432)),
+        "CONN_MAX_AGE": 0 if POSTGRES_POOL else POSTGRES_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+        "POOL": {
+            "SIZE": int(os.getenv('POSTGRES_POOL_SIZE', default=10)),
+            "MAX_OVERFLOW": int(os.getenv('POSTGRES_POOL_MAX_OVERFLOW', default=10)),
+            "TIMEOUT": float(os.getenv('POSTGRES_POOL_TIMEOUT', default=5)),
+        },
     }
 }
 
+# Host of a streaming replica for reads, unset - everything goes to the primary.
+POSTGRES_REPLICA_HOST = os.getenv('POSTGRES_REPLICA_HOST')
+
+DATABASES["replica"] = {
+    **DATABASES["default"],
+    "HOST": POSTGRES_REPLICA_HOST or DATABASES["default"]["HOST"],
+    "PORT": int(os.getenv('POSTGRES_REPLICA_PORT', default=DATABASES["default"]["PORT"])),
+    "TEST": {"MIRROR": "default"},
+}
+
+DATABASE_REPLICA = "replica" if POSTGRES_REPLICA_HOST else None
+
+DATABASE_ROUTERS = ['app.routers.PrimaryReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they changed something, to see their own writes.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', default=5))
+
+REDIS_URL = os.getenv('REDIS_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Seconds to keep username -> id and user pair -> relation entries.
+RELATION_CACHE_TIMEOUT = int(os.getenv('RELATION_CACHE_TIMEOUT', default=300))
+
+# Share of requests, 0 to 1, measured by ServerTimingMiddleware: Server-Timing header, log line
+# and per-route histograms at /api/v1/metrics/timings/.
+SERVER_TIMING_SAMPLE_RATE = float(os.getenv('SERVER_TIMING_SAMPLE_RATE', default=0))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'app.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'api.events': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
+# Events buffered per event stream, a stream further behind is told to resync and closed.
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', default=32))
+
+# Seconds between keepalive comments of an idle event stream.
+EVENTS_KEEPALIVE_SECONDS = int(os.getenv('EVENTS_KEEPALIVE_SECONDS', default=15))
+
+# Seconds an event stream stays open before the client has to reconnect.
+EVENTS_STREAM_SECONDS = int(os.getenv('EVENTS_STREAM_SECONDS', default=600))
+
+# Hasher of new passwords: pbkdf2, the Django default, scrypt or argon2 (needs the argon2-cffi
+# package). Passwords hashed by another one or with other costs are re-hashed on the next login:
+# switching makes every user's next login hash anew.
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', default='pbkdf2')
+
+password_hashers = {
+    'pbkdf2': 'app.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'app.hashers.ScryptPasswordHasher',
+    'argon2': 'app.hashers.Argon2PasswordHasher',
+}
+PASSWORD_HASHERS = [password_hashers.pop(PASSWORD_HASHER), *password_hashers.values()]
+
+# Hashing costs. scrypt: N, r, p; argon2: passes, memory in KiB, lanes; pbkdf2: iterations.
+PASSWORD_SCRYPT_WORK_FACTOR = int(os.getenv('PASSWORD_SCRYPT_WORK_FACTOR', default=2**14))
+PASSWORD_SCRYPT_BLOCK_SIZE = int(os.getenv('PASSWORD_SCRYPT_BLOCK_SIZE', default=8))
+PASSWORD_SCRYPT_PARALLELISM = int(os.getenv('PASSWORD_SCRYPT_PARALLELISM', default=1))
+PASSWORD_ARGON2_TIME_COST = int(os.getenv('PASSWORD_ARGON2_TIME_COST', default=2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv('PASSWORD_ARGON2_MEMORY_COST', default=19456))
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv('PASSWORD_ARGON2_PARALLELISM', default=1))
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv('PASSWORD_PBKDF2_ITERATIONS', default=600_000))
+
+# Processes hashing passwords outside of the web workers, 0 - hash in the request thread.
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', default=0))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -80,10 +175,50 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Trust token claims instead of loading the user row on every request.
+JWT_STATELESS_AUTH = int(os.getenv('JWT_STATELESS_AUTH', default=0))
+
+# Seconds to trust the cached "user is active" flag in the stateless mode.
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', default=60))
+
+# Friend lists kept in the in-process adjacency index, 0 turns the index off.
+ADJACENCY_INDEX_MAX_USERS = int(os.getenv('ADJACENCY_INDEX_MAX_USERS', default=100_000))
+
+# Seconds before a friend list is reloaded, to pick up changes made by other processes.
+ADJACENCY_INDEX_TIMEOUT = int(os.getenv('ADJACENCY_INDEX_TIMEOUT', default=60))
+
+# Limits of the friendship path search: longest path, users in a frontier, friendships read
+# by a step, wall time.
+PATH_MAX_DEPTH = int(os.getenv('PATH_MAX_DEPTH', default=6))
+PATH_MAX_FRONTIER = int(os.getenv('PATH_MAX_FRONTIER', default=10_000))
+PATH_MAX_EDGES = int(os.getenv('PATH_MAX_EDGES', default=200_000))
+PATH_TIME_BUDGET_MS = int(os.getenv('PATH_TIME_BUDGET_MS', default=500))
+
+# Friend-of-friend recommendations kept per user.
+RECOMMENDATIONS_TOP_K = int(os.getenv('RECOMMENDATIONS_TOP_K', default=50))
+
+# Hash partitions of the relation and edge tables created by the migrations, 0 - plain tables.
+# Splitting them into more later: `manage.py rebalance_partitions`.
+RELATION_PARTITIONS = int(os.getenv('RELATION_PARTITIONS', default=0))
+
+# Seconds after a rejection before its sender can request friendship with the same user again.
+REJECTION_COOLDOWN_SECONDS = int(os.getenv('REJECTION_COOLDOWN_SECONDS', default=7 * 24 * 3600))
+
+# Most users or friendship requests handled by one bulk call.
+BULK_REQUESTS_LIMIT = int(os.getenv('BULK_REQUESTS_LIMIT', default=100))
+
+# Relations fetched from the server-side cursor of an export at a time, and written out together.
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', default=2000))
+
+# Seconds an export may wait for its reader before PostgreSQL ends its transaction and connection.
+EXPORT_IDLE_TIMEOUT_SECONDS = int(os.getenv('EXPORT_IDLE_TIMEOUT_SECONDS', default=60))
+
 REST_FRAMEWORK = {
    'DEFAULT_AUTHENTICATION_CLASSES': (
+       'api.authentication.StatelessJWTAuthentication' if JWT_STATELESS_AUTH else
        'rest_framework_simplejwt.authentication.JWTAuthentication',
    ),
+   'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetCursorPagination',
 }
 
 SIMPLE_JWT = {
@@ -91,8 +226,15 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=5),
     "SIGNING_KEY": SECRET_KEY,
     'VERIFYING_KEY': None,
+    'TOKEN_OBTAIN_SERIALIZER': 'api.serializers.TokenObtainPairWithClaimsSerializer',
 }
 
+# Code version the OpenAPI schema is cached for, e.g. the commit; unset - a digest of the source files.
+CODE_VERSION = os.getenv('CODE_VERSION')
+
+# Schema written by `generate_openapi_schema`, served if it was made for the running code version.
+OPENAPI_SCHEMA_FILE = os.getenv('OPENAPI_SCHEMA_FILE', default=str(BASE_DIR / 'openapi.json'))
+
 SWAGGER_SETTINGS = {
    'SECURITY_DEFINITIONS': {
       'Bearer': {
@@ -105,6 +247,9 @@ SWAGGER_SETTINGS = {
 
 AUTH_USER_MODEL = 'app.User'
 
+# Primary keys: 4 - random UUIDs, 7 - time-ordered UUIDs.
+UUID_VERSION = int(os.getenv('UUID_VERSION', default=4))
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'